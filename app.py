@@ -1,11 +1,20 @@
 import os
 import dash
+from flask import jsonify
 from flask_caching import Cache
 import logging
 import dash_mantine_components as dmc
 from layout import create_layout
 from callbacks import register_callbacks
 from src.Chat import start_ollama_server
+from src.providers.CircuitBreaker import get_circuit_breakers
+from src.providers.ProviderScheduler import get_scheduler, start_reaper
+from src.providers.ResponseCache import get_response_cache
+from src.levels.LevelList import warm_reference_embeddings
+from src.embeddings.EmbeddingCache import get_embedding_cache
+from src.embeddings.EmbeddingServer import start_embedding_server
+from src.embeddings.Models import model_id
+from src.sessions.SessionStore import get_session_store
 from cache_manager import configure_cache, reset_cache
 from datetime import timedelta
 
@@ -55,22 +64,59 @@ app = dash.Dash(
 )
 
 
-# Réinitialiser le model_queue au démarrage de l'application
-def reset_model_queue():
-    """Réinitialise le fichier model_queue.txt"""
-    queue_file = "scratch/model_queue.txt"
-    providers = ["OpenAI", "Replicate", "Ollama"]
-    with open(queue_file, "w") as f:
-        for provider in providers:
-            f.write(f"{provider}: 0\n")
-
-
 # Configure cache
 cache = configure_cache(app)
 
-# Réinitialiser le cache et le model_queue au démarrage de l'application
-reset_cache(cache)
-reset_model_queue()
+# Réinitialiser le cache et les compteurs des providers au démarrage de l'application.
+# Les sessions sont partagées par tous les workers et hôtes : elles ne sont effacées
+# que sur demande explicite.
+reset_cache(cache, sessions=os.getenv("RESET_SESSIONS_ON_START") == "1")
+get_scheduler().reset()
+if get_circuit_breakers() is not None:
+    get_circuit_breakers().reset()
+
+# Récupérer en tâche de fond les leases des requêtes interrompues
+start_reaper()
+
+# Serveur d'embeddings partagé par les workers des callbacks
+if os.getenv("EMBEDDING_SERVER", "on") != "off":
+    start_embedding_server()
+
+# Embeddings des réponses de référence, hérités par les workers des callbacks
+warm_reference_embeddings()
+
+
+@app.server.route("/api/providers/leases")
+def provider_leases():
+    """Expose the live in-flight leases per provider, for monitoring."""
+    leases = get_scheduler().leases()
+    return jsonify(
+        {
+            provider: [lease._asdict() for lease in provider_leases]
+            for provider, provider_leases in leases.items()
+        }
+    )
+
+
+@app.server.route("/api/embeddings/cache")
+def embedding_cache_stats():
+    """Expose the hit rate of the embedding cache, for monitoring."""
+    cache = get_embedding_cache(model_id())
+    return jsonify(cache.stats() if cache is not None else {})
+
+
+@app.server.route("/api/storage")
+def storage_usage():
+    """Expose the size of the sessions and of the caches, for monitoring."""
+    response_cache = get_response_cache()
+    embedding_cache = get_embedding_cache(model_id())
+    return jsonify(
+        {
+            "sessions": get_session_store().usage(),
+            "response_cache": response_cache.usage() if response_cache else {},
+            "embedding_cache": embedding_cache.usage() if embedding_cache else {},
+        }
+    )
 
 
 # Set up app layout
@@ -1,11 +1,33 @@
 from flask_caching import Cache
 from src.Chat import Chat
 from src.Logger import Logger
-import json
+from src.sessions.SessionStore import get_session_store
+import os
 import uuid
+import weakref
 
 logger = Logger(__name__).get_logger()
 
+# Number of messages of a chat loaded by default, the older ones on demand
+RECENT_MESSAGES = int(os.getenv("SESSION_RECENT_MESSAGES", 20))
+
+# Number of sessions read at once when listing them
+SESSION_PAGE_SIZE = 500
+
+# Positions and contents of the messages of each chat as they were loaded, to
+# store only what changed since
+_loaded_messages = weakref.WeakKeyDictionary()
+
+CACHE_CONFIG = {
+    "CACHE_TYPE": "filesystem",
+    "CACHE_DIR": "cache-directory",
+    # Sessions and usernames live in the session store, and derived data in
+    # caches bounded in bytes: nothing is stored here any more, so pruning (and
+    # the scan of the directory it costs) stays disabled.
+    "CACHE_THRESHOLD": 0,
+    "CACHE_DEFAULT_TIMEOUT": 365 * 24 * 60 * 60,  # 31536000,
+}
+
 
 def configure_cache(app):
     """
@@ -18,45 +40,72 @@ def configure_cache(app):
         Cache: Configured cache instance.
     """
     logger.info("Configuring cache")
-    cache = Cache(
-        app.server,
-        config={
-            "CACHE_TYPE": "filesystem",
-            "CACHE_DIR": "cache-directory",
-            "CACHE_THRESHOLD": 200,
-            "CACHE_DEFAULT_TIMEOUT": 365 * 24 * 60 * 60,  # 31536000,
-        },
-    )
+    cache = Cache(app.server, config=CACHE_CONFIG)
     logger.debug("Cache configured successfully")
     return cache
 
 
-def get_user_data(cache, session_id):
+def open_cache():
+    """
+    Open the cache of the app outside of it, e.g. from a script.
+
+    Returns:
+        Cache: Cache instance on the same store as the app.
     """
-    Get user data from cache.
+    from flask import Flask
+
+    return Cache(Flask(__name__), config=CACHE_CONFIG)
+
+
+def get_user_data(cache, session_id, history=False):
+    """
+    Get user data from the session store.
+
+    Only the most recent messages of the chat are loaded, unless ``history`` is
+    set.
 
     Args:
         cache: The cache instance.
         session_id: The session ID.
+        history (bool): Whether to load every message of the chat.
 
     Returns:
         dict: User data.
     """
     logger.debug(f"Getting user data for session {session_id}")
-    data = cache.get(session_id)
-    if data:
+    store = get_session_store()
+    header = store.get_header(session_id)
+    if header:
         logger.debug(f"User data found for session {session_id}")
-        data = json.loads(data)
-        data["chat"] = Chat.from_dict(data["chat"])
+        data = dict(header)
+        start, messages = store.get_message_window(
+            session_id, None if history else RECENT_MESSAGES
+        )
+        data["chat"] = Chat.from_dict({**header.get("chat", {}), "messages": messages})
+        _loaded_messages[data["chat"]] = (
+            list(range(start, start + len(messages))),
+            messages,
+        )
     else:
         logger.info(f"No user data found for session {session_id}, creating new data")
         data = {"chat": Chat(), "level": 1}
     return data
 
 
+def _best_score(messages, best_score=0):
+    """Best score among messages, as dictionaries, and a previous best score."""
+    scores = [msg["score"] for msg in messages if msg.get("score") is not None]
+    return max([best_score, *scores])
+
+
 def update_user_data(cache, session_id, user_data):
     """
-    Update user data in cache.
+    Update user data in the session store.
+
+    Messages added to a chat loaded by ``get_user_data`` are appended to its log,
+    and the loaded messages that changed are rewritten at their positions, so
+    that messages appended meanwhile by another process are kept. A new chat
+    replaces the whole log.
 
     Args:
         cache: The cache instance.
@@ -64,12 +113,90 @@ def update_user_data(cache, session_id, user_data):
         user_data: The user data to update.
     """
     logger.debug(f"Updating user data for session {session_id}")
-    serializable_data = user_data.copy()
-    serializable_data["chat"] = user_data["chat"].to_dict()
-    cache.set(session_id, json.dumps(serializable_data))
+    store = get_session_store()
+    chat = user_data["chat"]
+    messages = [msg.to_dict() for msg in chat.messages]
+    loaded = _loaded_messages.get(chat)
+
+    header = {key: value for key, value in user_data.items() if key != "chat"}
+    header["chat"] = chat.to_dict(include_messages=False)
+    if loaded is None:
+        store.replace_messages(session_id, messages)
+        positions = list(range(len(messages)))
+        header["best_score"] = _best_score(messages)
+    else:
+        positions, loaded = loaded
+        if len(messages) < len(loaded):
+            logger.warning(
+                f"Messages removed from the chat of session {session_id} are kept"
+            )
+        # A message changed meanwhile, e.g. by a cleaned chat, is left as it is
+        updates = {
+            position: (old, new)
+            for position, old, new in zip(positions, loaded, messages)
+            if old != new
+        }
+        added = messages[len(loaded) :]
+        positions = positions[: len(messages)]
+        if added:
+            position = store.append_messages(session_id, added)
+            positions += range(position, position + len(added))
+        if updates:
+            store.update_messages(session_id, updates)
+            header["best_score"] = _best_score(store.get_messages(session_id))
+        else:
+            header["best_score"] = _best_score(added, header.get("best_score", 0))
+    store.set_header(session_id, header)
+    _loaded_messages[chat] = (positions, messages)
     logger.info(f"User data updated for session {session_id}")
 
 
+def update_scores(cache, session_id, chat, scores):
+    """
+    Set new scores on messages of a chat loaded by ``get_user_data``.
+
+    Each score is written on its own message, unless the message changed since
+    it was loaded. The rest of the session is left as it is, so that scores can
+    be updated while the user plays.
+
+    Args:
+        cache: The cache instance.
+        session_id: The session ID.
+        chat: The chat, as loaded.
+        scores (dict): The new score of messages, by index in the chat.
+
+    Returns:
+        int: The number of messages updated.
+    """
+    store = get_session_store()
+    positions, loaded = _loaded_messages[chat]
+    updates = {
+        positions[index]: (
+            loaded[index],
+            {**loaded[index], "score": score, "degraded": False},
+        )
+        for index, score in scores.items()
+    }
+    updated = store.update_messages(session_id, updates)
+    if updated:
+        best_score = _best_score(store.get_messages(session_id))
+        store.update_header(session_id, best_score=best_score)
+    return updated
+
+
+def update_user_fields(cache, session_id, **fields):
+    """
+    Update fields of the user data, without reading nor writing the chat.
+
+    Args:
+        cache: The cache instance.
+        session_id: The session ID.
+        **fields: The fields to set, e.g. ``level``.
+    """
+    logger.debug(f"Updating {', '.join(fields)} for session {session_id}")
+    get_session_store().update_header(session_id, **fields)
+
+
 def generate_session_id():
     """Generate a unique session ID."""
     session_id = str(uuid.uuid4())
@@ -77,45 +204,128 @@ def generate_session_id():
     return session_id
 
 
+def register_username(cache, session_id, username):
+    """
+    Register the username of a session, unless another session has it.
+
+    Args:
+        cache: The cache instance.
+        session_id: The session ID.
+        username: The username.
+
+    Returns:
+        bool: Whether the username belongs to the session.
+    """
+    return get_session_store().register_username(session_id, username)
+
+
+def find_session(cache, username):
+    """
+    Find the session registered with a username.
+
+    Args:
+        cache: The cache instance.
+        username: The username.
+
+    Returns:
+        str: The session ID, or None if the username is free.
+    """
+    return get_session_store().find_session(username)
+
+
+def iter_sessions(cache, page_size=SESSION_PAGE_SIZE):
+    """
+    Stream the sessions of all users, a page at a time.
+
+    Args:
+        cache: The cache instance.
+        page_size (int): Number of sessions read at once.
+
+    Yields:
+        tuple: The session ID and the username of each session.
+    """
+    store = get_session_store()
+    offset = 0
+    while True:
+        page = store.list_sessions(offset, page_size)
+        yield from page
+        if len(page) < page_size:
+            return
+        offset += page_size
+
+
 def get_all_users_data(cache):
     """
     Recovers data from all users.
 
+    Only the headers of the sessions are read, not their chats.
+
     Args:
         cache: The cache instance.
 
     Returns:
-        dict: A dictionary containing the data of all users.
+        dict: A dictionary containing the username, level and best score of all
+            users.
     """
     logger.info("Retrieving data for all users")
-    all_sessions = json.loads(cache.get("all_sessions") or "{}")
+    sessions = list(iter_sessions(cache))
+    headers = get_session_store().get_headers([sid for sid, _ in sessions])
     all_users_data = {}
 
-    for session_id, session_data in all_sessions.items():
-        logger.debug(f"Processing data for session {session_id}")
-        user_data = get_user_data(cache, session_id)
+    for (session_id, username), header in zip(sessions, headers):
+        header = header or {}
         all_users_data[session_id] = {
-            "username": session_data.get("username"),
-            "level": user_data.get("level", 1),
-            "chat": user_data.get("chat"),
+            "username": username,
+            "level": header.get("level", 1),
+            "best_score": header.get("best_score", 0),
         }
 
     logger.info(f"Retrieved data for {len(all_users_data)} users")
     return all_users_data
 
 
-def reset_cache(cache):
+def get_ranked_users_data(cache, offset=0, limit=100):
+    """
+    Recovers data from a page of users, by decreasing level then best score.
+
+    Args:
+        cache: The cache instance.
+        offset (int): Number of users skipped.
+        limit (int): Maximum number of users returned.
+
+    Returns:
+        list: The session ID and a dictionary with the username, level and best
+            score of each user.
     """
-    Resets the cache completely, deleting all user data.
+    store = get_session_store()
+    session_ids = store.ranked_sessions(offset, limit)
+    return [
+        (
+            session_id,
+            {
+                "username": header.get("username"),
+                "level": header.get("level", 1),
+                "best_score": header.get("best_score", 0),
+            },
+        )
+        for session_id, header in zip(session_ids, store.get_headers(session_ids))
+        if header
+    ]
+
+
+def reset_cache(cache, sessions=False):
+    """
+    Resets the cache, and the sessions of all users if asked to.
 
     Args:
         cache: The cache instance to reset.
+        sessions (bool): Whether to delete the sessions and usernames as well.
+            They are shared by every process and host of the deployment.
     """
     logger.warning("Resetting cache")
-    # Deletes all cache entries
     cache.clear()
-
-    # Reset session list
-    cache.set("all_sessions", json.dumps({}))
+    if sessions:
+        logger.warning("Deleting the sessions of all users")
+        get_session_store().clear()
 
     logger.info("Cache successfully reset")
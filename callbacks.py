@@ -37,6 +37,7 @@ def register_callbacks(app):
         Output("welcome-alert", "style"),
         Output("welcome-alert", "children"),
         Output("session-id", "data"),
+        Output("username-input", "error"),
         Input("session-store", "data"),
         prevent_initial_call=False,
     )
@@ -45,7 +46,7 @@ def register_callbacks(app):
 
     @app.callback(
         Output("session-store", "data"),
-        Output("username-input", "error"),
+        Output("username-input", "error", allow_duplicate=True),
         Output("username-modal", "opened", allow_duplicate=True),
         Output("level-instructions-markdown", "children", allow_duplicate=True),
         Output("sub-title", "children"),
@@ -82,6 +83,7 @@ def register_callbacks(app):
         State("top-p-slider", "value"),
         State("scores-modal", "children"),
         background=True,
+        interval=200,
         running=[
             (Output("question-input", "disabled"), True, False),
             (Output("submit-button", "disabled"), True, False),
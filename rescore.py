@@ -0,0 +1,231 @@
+"""
+Recompute the scores stored in the chats of every user.
+
+The scores of the messages become stale when the checks of a level or its
+``min_score_to_pass`` change. This script streams the sessions from the cache of
+the app, evaluates again every (prompt, answer) pair of their chat with the
+current level, writes the new scores back and reports the differences.
+
+Usage:
+    poetry run python rescore.py [--dry-run] [--workers N] [--report PATH]
+"""
+
+import argparse
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
+
+from cache_manager import get_user_data, iter_sessions, open_cache, update_scores
+
+_cache = None
+
+
+def _get_cache():
+    global _cache
+    if _cache is None:
+        _cache = open_cache()
+    return _cache
+
+
+def _exchanges(chat) -> list:
+    """
+    The scored exchanges of a chat.
+
+    Returns:
+        list: (index of the user message, prompt, answer) tuples. The answer is
+            empty when the model was not asked.
+    """
+    exchanges = []
+    for i, msg in enumerate(chat.messages):
+        if msg.role != "user" or msg.score is None:
+            continue
+        following = chat.messages[i + 1] if i + 1 < len(chat.messages) else None
+        answer = (
+            following.content if following and following.role == "assistant" else ""
+        )
+        exchanges.append((i, msg.content, answer))
+    return exchanges
+
+
+def rescore_sessions(sessions: list, dry_run: bool = False) -> list:
+    """
+    Rescore the chats of sessions (runs in a worker process).
+
+    The exchanges of all the sessions are evaluated level by level, so that their
+    prompts and answers are encoded in a few batches.
+
+    Args:
+        sessions (list): (session ID, username) pairs.
+        dry_run (bool): Whether to leave the stored scores unchanged.
+
+    Returns:
+        list: One row per scored exchange, with its old and new scores.
+    """
+    from src.levels.LevelList import levels
+
+    cache = _get_cache()
+    exchanges_by_level = {}
+    chats = {}
+    for session_id, username in sessions:
+        user_data = get_user_data(cache, session_id, history=True)
+        # Game completed: the chat of the last level is kept
+        level_number = min(user_data.get("level", 1), max(levels))
+        chats[session_id] = user_data["chat"]
+        messages = user_data["chat"].messages
+        for index, prompt, answer in _exchanges(user_data["chat"]):
+            exchanges_by_level.setdefault(level_number, []).append(
+                (session_id, username, index, prompt, answer, messages[index].score)
+            )
+
+    rows = []
+    for level_number, exchanges in exchanges_by_level.items():
+        level = levels[level_number]
+        results = level.evaluate_batch(
+            [(prompt, answer) for _, _, _, prompt, answer, _ in exchanges]
+        )
+        for (session_id, username, index, prompt, _, old_score), result in zip(
+            exchanges, results
+        ):
+            rows.append(
+                {
+                    "session_id": session_id,
+                    "username": username,
+                    "level": level_number,
+                    "index": index,
+                    "prompt": prompt,
+                    "old_score": old_score,
+                    "new_score": result.total_score,
+                    "old_passed": old_score >= level.min_score_to_pass,
+                    "new_passed": result.total_score >= level.min_score_to_pass,
+                }
+            )
+
+    if not dry_run:
+        scores_by_session = {}
+        for row in rows:
+            scores = scores_by_session.setdefault(row["session_id"], {})
+            scores[row["index"]] = row["new_score"]
+        # Each score is written on its own message: a user playing meanwhile
+        # keeps the rest of the session, and messages changed since keep theirs
+        for session_id, scores in scores_by_session.items():
+            update_scores(cache, session_id, chats[session_id], scores)
+    return rows
+
+
+def _chunks(iterable, size: int):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def generate_markdown_report(rows: list, tolerance: float) -> str:
+    """
+    Génère un rapport Markdown des différences de scores.
+
+    Args:
+        rows (list): Lignes renvoyées par ``rescore_sessions``.
+        tolerance (float): Écart en dessous duquel un score est inchangé.
+
+    Returns:
+        str: Rapport au format Markdown.
+    """
+    changed = [r for r in rows if abs(r["new_score"] - r["old_score"]) > tolerance]
+    changed.sort(key=lambda r: abs(r["new_score"] - r["old_score"]), reverse=True)
+    now_passing = sum(r["new_passed"] and not r["old_passed"] for r in rows)
+    now_failing = sum(r["old_passed"] and not r["new_passed"] for r in rows)
+
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    markdown = f"# Rescoring Report\n\nDate: {now}\n\n"
+    markdown += "| Metric | Value |\n|--------|-------|\n"
+    markdown += f"| Sessions | {len({r['session_id'] for r in rows})} |\n"
+    markdown += f"| Exchanges | {len(rows)} |\n"
+    markdown += f"| Changed scores | {len(changed)} |\n"
+    markdown += f"| Now passing | {now_passing} |\n"
+    markdown += f"| Now failing | {now_failing} |\n"
+
+    if changed:
+        markdown += "\n## Changed Scores\n\n"
+        markdown += (
+            "| User | Level | Prompt | Old | New | Delta |\n"
+            "|------|-------|--------|-----|-----|-------|\n"
+        )
+        for r in changed:
+            prompt = " ".join(r["prompt"].split())[:60].replace("|", "\\|")
+            markdown += (
+                f"| {r['username'] or r['session_id']} | {r['level']} | {prompt} "
+                f"| {r['old_score']:.2f} | {r['new_score']:.2f} "
+                f"| {r['new_score'] - r['old_score']:+.2f} |\n"
+            )
+    return markdown
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Recompute the scores stored in the chats of every user."
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="report the differences without writing the new scores",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="number of worker processes (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--sessions-per-task",
+        type=int,
+        default=20,
+        help="number of sessions rescored by each task (default: 20)",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.01,
+        help="score difference below which a score is unchanged (default: 0.01)",
+    )
+    parser.add_argument(
+        "--report",
+        default="rescore_report.md",
+        help="path of the Markdown report (default: rescore_report.md)",
+    )
+    args = parser.parse_args()
+
+    # Every score must be computed with the embeddings, never approximated
+    os.environ["LEXICAL_FALLBACK"] = "off"
+    if os.getenv("EMBEDDING_SERVER", "on") != "off":
+        from src.embeddings.EmbeddingServer import start_embedding_server
+
+        # A server of its own, batching the encodes of every worker
+        socket_path = os.path.join(tempfile.mkdtemp(), "embeddings.sock")
+        os.environ["EMBEDDING_SOCKET"] = socket_path
+        start_embedding_server(socket_path)
+
+    rows = []
+    # Spawn, like the embedding server: the model must not be shared by a fork
+    with ProcessPoolExecutor(
+        max_workers=args.workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        futures = [
+            executor.submit(rescore_sessions, chunk, args.dry_run)
+            for chunk in _chunks(iter_sessions(_get_cache()), args.sessions_per_task)
+        ]
+        for future in futures:
+            rows.extend(future.result())
+
+    with open(args.report, "w") as f:
+        f.write(generate_markdown_report(rows, args.tolerance))
+
+    changed = sum(abs(r["new_score"] - r["old_score"]) > args.tolerance for r in rows)
+    action = "would change" if args.dry_run else "changed"
+    print(f"Rescored {len(rows)} exchanges, {action} {changed} scores")
+    print(f"Report saved to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,23 @@
-import ollama
-import replicate
+import asyncio
 import os
+import queue
+from contextlib import aclosing
 from src.Logger import Logger
 import subprocess
 import time
 from getpass import getpass
-from openai import OpenAI
-from filelock import FileLock
+from src.providers.EventLoop import run_sync, submit
+from src.providers.CircuitBreaker import (
+    CircuitOpenError,
+    ProviderUnavailableError,
+    get_circuit_breakers,
+)
+from src.providers.ClientRegistry import get_adapter
+from src.providers.ProviderAdapters import GenerationParams
+from src.providers.Hedging import get_hedging_policy, hedge
+from src.providers.ProviderScheduler import get_scheduler
+from src.providers.ResponseCache import get_response_cache
+from src.providers.SingleFlight import get_single_flight
 
 
 class Message:
@@ -17,12 +28,36 @@ class Message:
         role (str): The role of the message sender.
         content (str): The content of the message.
         score (float, optional): The score of the message.
+        degraded (bool): Whether the score was approximated and should be
+            rescored.
     """
 
-    def __init__(self, role: str, content: str, score: float = None):
+    def __init__(
+        self, role: str, content: str, score: float = None, degraded: bool = False
+    ):
         self.role = role
         self.content = content
         self.score = score
+        self.degraded = degraded
+
+    def to_dict(self) -> dict:
+        """Convert the message to a dictionary for serialization."""
+        return {
+            "role": self.role,
+            "content": self.content,
+            "score": self.score,
+            "degraded": self.degraded,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Message":
+        """Create a message from its dictionary representation."""
+        return cls(
+            data["role"],
+            data["content"],
+            data.get("score"),
+            data.get("degraded", False),
+        )
 
 
 def get_replicate_token():
@@ -87,9 +122,15 @@ def start_ollama_server():
         )
 
 
-queue_file = "scratch/model_queue.txt"
-lock_file = queue_file + ".lock"
-file_lock = FileLock(lock_file)
+def _print_chunks(on_token=None):
+    """Wrap a chunk callback so that the chunks are also printed to stdout."""
+
+    def print_chunk(chunk: str):
+        print(chunk, end="", flush=True)
+        if on_token is not None:
+            on_token(chunk)
+
+    return print_chunk
 
 
 class Chat:
@@ -111,64 +152,34 @@ class Chat:
         if system_prompt:
             self.add_message("system", system_prompt)
 
-    def _select_provider(self):
-        """Sélectionne le provider en fonction des requêtes en cours."""
-        providers = ["OpenAI", "Replicate"]
+    def _providers(self) -> list:
+        """Providers this chat may use, by order of preference."""
+        providers = ["openai", "replicate"]
         if not self.disable_ollama:
-            providers.append("Ollama")
-        self._ensure_queue_file(queue_file, providers)
-
-        with file_lock:
-            with open(queue_file, "r+") as f:
-                lines = f.readlines()
-                counts = {
-                    p.lower(): int(l.split(":")[1].strip())
-                    for p, l in zip(providers, lines)
-                }
-
-                if counts["openai"] < 3:
-                    provider = "openai"
-                elif counts["replicate"] < 3:
-                    provider = "replicate"
-                elif not self.disable_ollama and counts["ollama"] < 3:
-                    provider = "ollama"
-                else:
-                    provider = min(counts, key=counts.get)
-
-        return provider
-
-    def _update_provider_count(self, increment: bool):
-        """Met à jour le nombre de requêtes pour le provider actuel."""
-        providers = ["OpenAI", "Replicate", "Ollama"]
-        self._ensure_queue_file(queue_file, providers)
-
-        with file_lock:
-            with open(queue_file, "r+") as f:
-                lines = f.readlines()
-                counts = {
-                    p.lower(): int(l.split(":")[1].strip())
-                    for p, l in zip(providers, lines)
-                }
-
-                counts[self.provider] += 1 if increment else -1
-                counts[self.provider] = max(
-                    0, counts[self.provider]
-                )  # Évite les négatifs
-
-                f.seek(0)
-                f.writelines(f"{p}: {counts[p.lower()]}\n" for p in providers)
-                f.truncate()
-
-    def _ensure_queue_file(self, file_path: str, providers: list):
-        """Vérifie l'existence du fichier de queue et le crée si nécessaire."""
-        if not os.path.exists(file_path):
-            os.makedirs(os.path.dirname(file_path), exist_ok=True)
-            with file_lock:
-                with open(file_path, "w") as f:
-                    for provider in providers:
-                        f.write(f"{provider}: 0\n")
-
-    def add_message(self, role, content, score=None):
+            providers.append("ollama")
+        return providers
+
+    def _select_provider(self, exclude=()):
+        """
+        Sélectionne le provider en fonction des requêtes en cours.
+
+        Providers whose circuit breaker refuses calls are skipped.
+
+        Args:
+            exclude (iterable): Providers not to select.
+
+        Returns:
+            str: The provider, or None if none is available.
+        """
+        candidates = [p for p in self._providers() if p not in exclude]
+        breakers = get_circuit_breakers()
+        if breakers is not None:
+            candidates = breakers.available(candidates)
+        if not candidates:
+            return None
+        return get_scheduler().select(candidates)
+
+    def add_message(self, role, content, score=None, degraded=False):
         """
         Add a message to the chat history.
 
@@ -176,8 +187,9 @@ class Chat:
             role (str): The role of the message sender.
             content (str): The content of the message.
             score (float, optional): The score of the message.
+            degraded (bool): Whether the score was approximated.
         """
-        self.messages.append(Message(role, content, score))
+        self.messages.append(Message(role, content, score, degraded))
 
     def get_messages(self):
         return self.messages
@@ -190,158 +202,399 @@ class Chat:
         top_k: int = 40,
         top_p: float = 0.95,
         streamline: bool = False,
+        use_cache: bool = True,
+        on_token=None,
+        stop_condition=None,
+        max_tokens: int = None,
+        stop: tuple = (),
     ) -> str:
         """
         Ask a message to the chat without using previous message history.
 
+        Blocking wrapper around ``aask``, run on the event loop shared by the process.
+
+        Args:
+            message (str): The message to ask.
+            temperature (float): Controls randomness in generation. Range: 0-2.
+            repeat_penalty (float): Penalty for repeating tokens.
+            top_k (int): Limits token selection to top K options.
+            top_p (float): Nucleus sampling threshold. Range: 0-1.
+            streamline (bool): If True, stream the response to stdout.
+            use_cache (bool): If False, always call the provider, even for a call
+                already in the response cache.
+            on_token (callable, optional): Called with every chunk of the answer
+                as it is generated, on the calling thread.
+            stop_condition (callable, optional): See ``aask``.
+            max_tokens (int, optional): Maximum number of tokens of the answer.
+            stop (tuple): Sequences ending the answer, not included in it.
+
+        Returns:
+            str: The answer to the message.
+        """
+        options = dict(
+            temperature=temperature,
+            repeat_penalty=repeat_penalty,
+            top_k=top_k,
+            top_p=top_p,
+            streamline=streamline,
+            use_cache=use_cache,
+            stop_condition=stop_condition,
+            max_tokens=max_tokens,
+            stop=stop,
+        )
+        if on_token is None:
+            return run_sync(self.aask(message, **options))
+
+        # Chunks are produced on the event loop thread; hand them over to the
+        # calling thread, where callbacks such as Dash's set_props are bound.
+        chunks = queue.SimpleQueue()
+        future = submit(self.aask(message, on_token=chunks.put, **options))
+        future.add_done_callback(lambda _: chunks.put(None))
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                break
+            on_token(chunk)
+        return future.result()
+
+    async def aask(
+        self,
+        message: str,
+        temperature: float = 0.7,
+        repeat_penalty: float = 1.1,
+        top_k: int = 40,
+        top_p: float = 0.95,
+        streamline: bool = False,
+        use_cache: bool = True,
+        on_token=None,
+        stop_condition=None,
+        max_tokens: int = None,
+        stop: tuple = (),
+    ) -> str:
+        """
+        Ask a message to the chat without using previous message history, without
+        blocking the event loop while the provider generates the answer.
+
         Args:
             message (str): The message to ask.
             temperature (float): Controls randomness in generation. Range: 0-2.
             repeat_penalty (float): Penalty for repeating tokens.
             top_k (int): Limits token selection to top K options.
             top_p (float): Nucleus sampling threshold. Range: 0-1.
-            streamline (bool): If True, stream the response.
+            streamline (bool): If True, stream the response to stdout.
+            use_cache (bool): If False, always call the provider, even for a call
+                already in the response cache.
+            on_token (callable, optional): Called on the event loop with every
+                chunk of the answer as it is generated. Cached and coalesced
+                answers are delivered as a single chunk.
+            stop_condition (callable, optional): Called with the answer generated
+                so far; the generation is aborted as soon as it returns a truthy
+                value, and the answer is returned as it is. Answers cut short are
+                not cached, and calls are only coalesced with calls using a stop
+                condition of the same qualified name.
+            max_tokens (int, optional): Maximum number of tokens of the answer.
+            stop (tuple): Sequences ending the answer, not included in it.
 
         Returns:
             str: The answer to the message.
         """
-        with file_lock:
+        # The breakers, the scheduler and the preparation of the providers do
+        # blocking I/O: they run on worker threads, off the shared event loop
+        if self.provider is None:
+            self.provider = await asyncio.to_thread(self._select_provider)
             if self.provider is None:
-                self.provider = self._select_provider()
-                self._initialize_provider()
-                self._update_provider_count(increment=True)
-            else:
-                self._update_provider_count(increment=True)
+                raise ProviderUnavailableError("Every provider circuit is open")
+            await asyncio.to_thread(self._initialize_provider)
 
-        try:
-            self.add_message("user", message, score=None)
-            response_content = ""
-
-            # Prepare messages with only system prompt (if any) and current user message
-            current_messages = []
-            if self.system_prompt:
-                current_messages.append(
-                    {"role": "system", "content": self.system_prompt}
+        self.add_message("user", message, score=None)
+
+        # Prepare messages with only system prompt (if any) and current user message
+        current_messages = []
+        if self.system_prompt:
+            current_messages.append({"role": "system", "content": self.system_prompt})
+        current_messages.append({"role": "user", "content": message})
+
+        params = GenerationParams(
+            temperature, repeat_penalty, top_k, top_p, max_tokens, tuple(stop)
+        )
+
+        if streamline:
+            on_token = _print_chunks(on_token)
+        streamed = False
+
+        stopped = False
+        should_stop = None
+        if stop_condition is not None:
+
+            def should_stop(partial_answer: str) -> bool:
+                nonlocal stopped
+                stopped = stopped or bool(stop_condition(partial_answer))
+                return stopped
+
+        cache = get_response_cache() if use_cache else None
+        response_content = None
+        if cache is not None:
+            cache_key = cache.make_key(
+                self.provider, self.model, self.system_prompt, message, params
+            )
+            response_content = await cache.get(cache_key, params)
+
+        if response_content is None:
+
+            async def generate():
+                nonlocal streamed
+                streamed = on_token is not None
+                answer = await self._generate(
+                    current_messages, params, on_token, should_stop
                 )
-            current_messages.append({"role": "user", "content": message})
-
-            if self.provider == "openai":
-                try:
-                    completion = self.openai_client.chat.completions.create(
-                        model=self.model,
-                        messages=current_messages,
-                        temperature=temperature,
-                        top_p=top_p,
-                        frequency_penalty=repeat_penalty,
-                        presence_penalty=0,
-                        stream=streamline,
+                if cache is not None and not stopped:
+                    await cache.set(cache_key, params, answer)
+                return answer
+
+            single_flight = get_single_flight()
+            try:
+                if single_flight is None:
+                    response_content = await generate()
+                else:
+                    # Identical concurrent calls share the answer of the first one
+                    flight_key = single_flight.make_key(
+                        self.system_prompt,
+                        message,
+                        params,
+                        (
+                            getattr(stop_condition, "__qualname__", "stop_condition")
+                            if stop_condition is not None
+                            else ""
+                        ),
                     )
+                    response_content = await single_flight.do(flight_key, generate)
+            except Exception:
+                # No answer: forget the question, so that it is not scored
+                self.messages.pop()
+                raise
+
+        if on_token is not None and not streamed:
+            on_token(response_content)
+        if streamline:
+            print()  # New line after streaming
+
+        self.logger.debug(f"Received response: {response_content}")
+        self.add_message("assistant", response_content)
+        return response_content
+
+    async def _generate(
+        self, messages: list, params: GenerationParams, on_token=None, should_stop=None
+    ) -> str:
+        """
+        Generate an answer with the selected provider, failing over to the next
+        healthy provider when it fails before streaming anything.
 
-                    if streamline:
-                        for chunk in completion:
-                            if chunk.choices[0].delta.content is not None:
-                                content = chunk.choices[0].delta.content
-                                response_content += content
-                                print(content, end="", flush=True)
-                        print()  # New line after streaming
-                    else:
-                        response_content = completion.choices[0].message.content
-
-                except Exception as e:
-                    self.logger.error(f"Error with OpenAI API: {str(e)}")
-                    return f"Error: {str(e)}"
-
-            elif self.provider == "replicate":
-                formatted_prompt = ""
-                for msg in current_messages:
-                    formatted_prompt += f"{msg['role']}: {msg['content']}\n"
-                formatted_prompt += "assistant: "
-
-                output = replicate.run(
-                    self.replicate_model,
-                    input={
-                        "prompt": formatted_prompt,
-                        "temperature": temperature,
-                        "top_p": top_p,
-                        "max_new_tokens": 500,
-                        "repetition_penalty": repeat_penalty,
-                    },
+        The chat switches to the provider that answered.
+
+        Args:
+            messages (list): The messages sent to the provider.
+            params (GenerationParams): The sampling parameters.
+            on_token (callable, optional): If set, the answer is streamed and
+                every chunk is passed to it.
+            should_stop (callable, optional): See ``_call``.
+
+        Returns:
+            str: The answer.
+
+        Raises:
+            ProviderUnavailableError: If no provider could answer.
+        """
+        failed = []
+        while True:
+            emitted = False
+
+            def emit(chunk: str):
+                nonlocal emitted
+                emitted = True
+                on_token(chunk)
+
+            try:
+                return await self._attempt(
+                    messages,
+                    params,
+                    emit if on_token is not None else None,
+                    should_stop,
                 )
-                response_content = "".join(output)
-
-            elif self.provider == "ollama":
-                self.logger.debug(
-                    f"""Sending message to Ollama: {message}
-                    - Temperature: {temperature}
-                    - Repeat Penalty: {repeat_penalty}
-                    - Top K: {top_k}
-                    - Top P: {top_p}
-                    """
+            except Exception as e:
+                failed.append(self.provider)
+                if emitted:
+                    raise ProviderUnavailableError(
+                        f"{self.provider} failed while streaming: {str(e)}"
+                    ) from e
+                fallback = await asyncio.to_thread(self._select_provider, failed)
+                if fallback is None:
+                    raise ProviderUnavailableError(
+                        f"No provider could answer, last error: {str(e)}"
+                    ) from e
+                self.logger.warning(
+                    f"{self.provider} failed ({str(e)}), retrying on {fallback}"
                 )
+                self.provider = fallback
+                await asyncio.to_thread(self._initialize_provider)
 
-                chat_params = {
-                    "model": self.model,
-                    "messages": current_messages,
-                    "options": {
-                        "temperature": temperature,
-                        "repeat_penalty": repeat_penalty,
-                        "top_k": top_k,
-                        "top_p": top_p,
-                    },
-                }
-
-                if streamline:
-                    chat_params["stream"] = True
-                    for response in self.client.chat(**chat_params):
-                        chunk = response["message"]["content"]
-                        response_content += chunk
-                        print(chunk, end="", flush=True)
-                    print()  # New line after streaming
-                else:
-                    response = self.client.chat(**chat_params)
-                    response_content = response["message"]["content"]
+    async def _attempt(
+        self, messages: list, params: GenerationParams, on_token=None, should_stop=None
+    ) -> str:
+        """
+        Call the selected provider.
+
+        When hedging is enabled, a late call is duplicated on another provider
+        and the fastest answer is kept.
+
+        Args:
+            messages (list): The messages sent to the provider.
+            params (GenerationParams): The sampling parameters.
+            on_token (callable, optional): If set, the answer is streamed and
+                every chunk is passed to it.
+            should_stop (callable, optional): See ``_call``.
+
+        Returns:
+            str: The answer.
+        """
+        hedging = get_hedging_policy()
+        if hedging is None:
+            return await self._call(
+                self.provider, self.adapter, messages, params, on_token, should_stop
+            )
 
-            self.logger.debug(f"Received response: {response_content}")
-            self.add_message("assistant", response_content)
-            return response_content
+        def call(provider, adapter):
+            return lambda emit: self._call(
+                provider, adapter, messages, params, emit, should_stop
+            )
+
+        async def make_backup():
+            provider = await asyncio.to_thread(self._select_provider, [self.provider])
+            if provider is None:
+                return None
+            adapter = await asyncio.to_thread(
+                get_adapter, provider, lambda: self._prepare_provider(provider)
+            )
+            return call(provider, adapter)
+
+        # A streamed call is hedged on its first token, not on its whole answer
+        latencies = await asyncio.to_thread(
+            get_scheduler().latencies, self.provider, on_token is not None
+        )
+        delay = hedging.delay(latencies)
+        return await hedge(
+            call(self.provider, self.adapter), make_backup, delay, on_token
+        )
+
+    async def _call(
+        self,
+        provider: str,
+        adapter,
+        messages: list,
+        params: GenerationParams,
+        on_token=None,
+        should_stop=None,
+    ) -> str:
+        """
+        Call a provider, holding a lease on it, if its circuit breaker allows it.
+
+        Args:
+            provider (str): The provider name.
+            adapter (ProviderAdapter): The adapter of the provider.
+            messages (list): The messages sent to the provider.
+            params (GenerationParams): The sampling parameters.
+            on_token (callable, optional): If set, the answer is streamed and
+                every chunk is passed to it.
+            should_stop (callable, optional): If set, the answer is streamed and the
+                stream is closed, releasing the provider, as soon as it returns
+                True for the answer generated so far.
+
+        Returns:
+            str: The answer.
+
+        Raises:
+            CircuitOpenError: If the circuit of the provider refuses the call.
+        """
+        breakers = get_circuit_breakers()
+        if breakers is not None and not await asyncio.to_thread(
+            breakers.allow, provider
+        ):
+            raise CircuitOpenError(provider)
+
+        self.logger.debug(f"Sending messages to {provider}: {messages} - {params}")
+        scheduler = get_scheduler()
+        lease = await asyncio.to_thread(scheduler.acquire, provider)
+        started_at = time.time()
+        first_token = None
+        succeeded = False
+        cancelled = False
+
+        def finish(latency: float):
+            scheduler.release(lease)
+            # Feed the routing policy with the latency and outcome of the call
+            if not cancelled:
+                scheduler.record(provider, latency, succeeded, first_token)
+                if breakers is not None:
+                    breakers.record(provider, succeeded)
+
+        try:
+            if on_token is not None or should_stop is not None:
+                response_content = ""
+                stream = adapter.stream(messages, params)
+                async with aclosing(stream):
+                    async for chunk in stream:
+                        if first_token is None:
+                            first_token = time.time() - started_at
+                        response_content += chunk
+                        if on_token is not None:
+                            on_token(chunk)
+                        if should_stop is not None and should_stop(response_content):
+                            self.logger.info(f"Stopped {provider} early")
+                            break
+            else:
+                response_content = await adapter.complete(messages, params)
+            succeeded = True
+        except asyncio.CancelledError:
+            # A call that lost a hedging race says nothing about its provider
+            cancelled = True
+            raise
         finally:
-            with file_lock:
-                self._update_provider_count(increment=False)
+            # The lease is released even if this task is cancelled meanwhile
+            await asyncio.to_thread(finish, time.time() - started_at)
+        return response_content
 
     def _initialize_provider(self):
-        """Initialize the selected provider."""
-        if self.provider == "ollama":
-            self.model = "llama3:instruct"
-            self.client = ollama.Client()
+        """Attach the pooled adapter of the selected provider."""
+        self.adapter = get_adapter(self.provider, prepare=self._prepare_provider)
+        self.model = self.adapter.model
+
+    def _prepare_provider(self, provider: str = None):
+        """Load the credentials or start the server of a provider."""
+        provider = provider or self.provider
+        if provider == "ollama":
             start_ollama_server()
-        elif self.provider == "replicate":
-            self.replicate_model = "meta/meta-llama-3-8b-instruct"
+        elif provider == "replicate":
             get_replicate_token()
-        elif self.provider == "openai":
-            self.model = "gpt-4o-mini"
+        elif provider == "openai":
             get_openai_token()
-            self.openai_client = OpenAI()
-        else:
-            raise ValueError(
-                "Invalid provider. Choose 'ollama', 'replicate', or 'openai'."
-            )
 
-    def to_dict(self):
+    def to_dict(self, include_messages: bool = True):
         """
         Convert the Chat instance to a dictionary for serialization.
 
+        Args:
+            include_messages (bool): Whether to serialize the messages too.
+
         Returns:
             dict: A dictionary representation of the Chat instance.
         """
-        return {
+        data = {
             "provider": self.provider,
             "model": getattr(self, "model", None),
             "system_prompt": self.system_prompt,
-            "messages": [
-                {"role": msg.role, "content": msg.content, "score": msg.score}
-                for msg in self.messages
-            ],
         }
+        if include_messages:
+            data["messages"] = [msg.to_dict() for msg in self.messages]
+        return data
 
     @classmethod
     def from_dict(cls, data):
@@ -356,16 +609,17 @@ class Chat:
         """
         chat = cls(system_prompt=data.get("system_prompt"))
         chat.model = data.get("model")
-        for msg in data["messages"]:
-            chat.add_message(msg["role"], msg["content"], msg.get("score"))
+        # The stored messages already contain the system message
+        chat.messages = [Message.from_dict(msg) for msg in data["messages"]]
         return chat
 
-    def add_score_to_last_exchange(self, score: float) -> bool:
+    def add_score_to_last_exchange(self, score: float, degraded: bool = False) -> bool:
         """
         Add score to the last user message in the chat.
 
         Args:
             score (float): The score to add.
+            degraded (bool): Whether the score was approximated.
 
         Returns:
             bool: True if score was added successfully, False otherwise.
@@ -377,6 +631,7 @@ class Chat:
         for msg in reversed(self.messages):
             if msg.role == "user":
                 msg.score = score
+                msg.degraded = degraded
                 self.logger.info(f"Added score {score} to user message")
                 return True
 
@@ -4,13 +4,35 @@ mp.set_start_method("spawn", force=True)
 
 from abc import ABC, abstractmethod
 from collections import namedtuple
-from sentence_transformers import SentenceTransformer, util
+from typing import Optional
+import numpy as np
+from sentence_transformers import util
 from scipy.spatial.distance import cosine
+from src.embeddings.EmbeddingCache import get_embedding_cache
+from src.embeddings.EmbeddingClient import get_embedding_client
+from src.embeddings.EmbeddingLoad import get_embedding_load
+from src.embeddings.LexicalSimilarity import TfidfIndex
+from src.embeddings.Models import load_model, model_id
+from src.embeddings.ReferenceStore import ReferenceEmbeddingStore
 
 CheckResult = namedtuple("CheckResult", ["score", "messages"])
 Message = namedtuple("Message", ["content", "color", "icon"])
+# ``degraded`` flags the scores whose similarities were approximated lexically
+# because the embeddings were overloaded: they should be rescored later.
 LevelResult = namedtuple(
-    "LevelResult", ["total_score", "messages", "individual_scores"]
+    "LevelResult",
+    ["total_score", "messages", "individual_scores", "degraded"],
+    defaults=[False],
+)
+PromptEvaluation = namedtuple(
+    "PromptEvaluation", ["check", "similarity", "degraded"], defaults=[False]
+)
+# Limits of the answers of a level: maximum number of output tokens, stop sequences,
+# and allowed (min, max) range of each sampling parameter.
+GenerationProfile = namedtuple(
+    "GenerationProfile",
+    ["max_tokens", "stop", "temperature", "repeat_penalty", "top_k", "top_p"],
+    defaults=[500, (), (0, 2), (1, 2), (0, 100), (0, 1)],
 )
 
 
@@ -19,12 +41,89 @@ class Level(ABC):
 
     # Charger le modèle une seule fois pour toutes les instances
     _model = None
+    _reference_store = None
 
     @classmethod
     def get_model(cls):
-        if cls._model is None:
-            cls._model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
-        return cls._model
+        # Stored on Level, so that every level shares the same model
+        if Level._model is None:
+            Level._model = load_model()
+        return Level._model
+
+    @classmethod
+    def encode(cls, texts: list) -> np.ndarray:
+        """
+        Encode texts with the embedding model.
+
+        Texts already encoded are read from the embedding cache. The others are
+        sent to the embedding server, which batches the requests of every worker.
+        The model is only loaded in this process when the server is disabled or
+        unavailable.
+
+        Args:
+            texts (list): The texts to encode.
+
+        Returns:
+            np.ndarray: Their embeddings, one row per text.
+        """
+        cache = get_embedding_cache(model_id())
+        if cache is not None:
+            return cache.encode(texts, Level._encode)
+        return Level._encode(texts)
+
+    @classmethod
+    def _encode(cls, texts: list) -> np.ndarray:
+        """Encode texts on the embedding server, or in this process as a fallback."""
+        load = get_embedding_load()
+        if load is None:
+            return Level._encode_now(texts)
+        with load.track():
+            embeddings = Level._encode_now(texts)
+        client = get_embedding_client()
+        if client is not None:
+            load.report_queue_depth(client.queue_depth)
+        return embeddings
+
+    @classmethod
+    def _encode_now(cls, texts: list) -> np.ndarray:
+        client = get_embedding_client()
+        if client is not None:
+            embeddings = client.encode(texts)
+            if embeddings is not None:
+                return embeddings
+        return Level.get_model().encode(texts)
+
+    @classmethod
+    def embeddings_overloaded(cls) -> bool:
+        """Whether similarities should be approximated lexically for now."""
+        load = get_embedding_load()
+        if load is None:
+            return False
+        # The server knows the load of every process, this one only its own
+        client = get_embedding_client()
+        if client is not None:
+            status = client.status()
+            if status is not None:
+                load.report_status(status)
+        return load.overloaded()
+
+    @classmethod
+    def get_reference_store(cls) -> ReferenceEmbeddingStore:
+        """The store of the reference embeddings, shared by every level."""
+        if Level._reference_store is None:
+            # The store persists the references itself, at full precision
+            Level._reference_store = ReferenceEmbeddingStore(model_id(), Level._encode)
+        return Level._reference_store
+
+    def reference_texts(self) -> list:
+        """The reference texts of the level, compared to the prompts and answers."""
+        return [text for text in (self.correct_question, self.correct_answer) if text]
+
+    def get_lexical_index(self) -> TfidfIndex:
+        """The lexical index of the reference texts of the level."""
+        if getattr(self, "_lexical_index", None) is None:
+            self._lexical_index = TfidfIndex(self.reference_texts())
+        return self._lexical_index
 
     @property
     @abstractmethod
@@ -58,6 +157,38 @@ class Level(ABC):
         """System prompt for the level."""
         return ""
 
+    @property
+    def generation_profile(self) -> GenerationProfile:
+        """Generation limits of the answers for the level."""
+        return GenerationProfile()
+
+    def sampling_params(
+        self, temperature: float, repeat_penalty: float, top_k: int, top_p: float
+    ) -> dict:
+        """
+        Clamp the sampling parameters chosen by the user to the ranges of the level.
+
+        Args:
+            temperature (float): Controls randomness in generation.
+            repeat_penalty (float): Penalty for repeating tokens.
+            top_k (int): Limits token selection to top K options.
+            top_p (float): Nucleus sampling threshold.
+
+        Returns:
+            dict: The clamped parameters, by name.
+        """
+        profile = self.generation_profile
+        params = {
+            "temperature": temperature,
+            "repeat_penalty": repeat_penalty,
+            "top_k": top_k,
+            "top_p": top_p,
+        }
+        for name, value in params.items():
+            low, high = getattr(profile, name)
+            params[name] = min(max(value, low), high)
+        return params
+
     def check_answer(self, answer: str) -> CheckResult:
         """
         Check if the given answer is correct.
@@ -70,6 +201,23 @@ class Level(ABC):
         """
         return CheckResult(100, [])
 
+    def check_partial_answer(self, partial_answer: str) -> Optional[CheckResult]:
+        """
+        Check the beginning of an answer while it is being generated.
+
+        Levels override this to stop the generation as soon as the outcome of the
+        level is decided: a verdict must only be returned when no continuation of
+        ``partial_answer`` can change the result of ``__call__``, since the answer
+        is then scored as it is.
+
+        Args:
+            partial_answer: The answer generated so far.
+
+        Returns:
+            CheckResult of the whole answer if it is already decided, else None.
+        """
+        return None
+
     def check_prompt(self, prompt: str) -> CheckResult:
         """
         Check if the given prompt is correct.
@@ -82,38 +230,49 @@ class Level(ABC):
         """
         return CheckResult(100, [])
 
-    def check_prompt_similarity(self, user_prompt: str) -> float:
+    def check_prompt_similarity(self, user_prompt: str, lexical: bool = False) -> float:
         """
         Check the similarity between the user's prompt and the correct prompt.
 
         Args:
             user_prompt (str): The prompt provided by the user.
+            lexical (bool): Approximate it lexically instead of with embeddings.
 
         Returns:
             float: Similarity score between 0 and 1.
         """
         if not self.correct_question:
             return 1.0
-        model = self.get_model()
-        user_embedding = model.encode([user_prompt])
-        correct_embedding = model.encode([self.correct_question])
+        if lexical:
+            return self.get_lexical_index().similarity(
+                user_prompt, self.correct_question
+            )
+        user_embedding = self.encode([user_prompt])
+        correct_embedding = self.get_reference_store().get(self.correct_question)
         similarity = util.pytorch_cos_sim(user_embedding, correct_embedding)
         return similarity.item()
 
-    def check_answer_similarity(self, model_answer: str) -> float:
+    def check_answer_similarity(
+        self, model_answer: str, lexical: bool = False
+    ) -> float:
         """
         Check the similarity between the model's answer and the correct answer.
 
         Args:
             model_answer: The answer provided by the model.
+            lexical: Approximate it lexically instead of with embeddings.
 
         Returns:
             Similarity score between 0 and 1.
         """
         if not self.correct_answer:
             return 1.0
-        model_embedding = self._model.encode([model_answer])[0]
-        correct_embedding = self._model.encode([self.correct_answer])[0]
+        if lexical:
+            return self.get_lexical_index().similarity(
+                model_answer, self.correct_answer
+            )
+        model_embedding = self.encode([model_answer])[0]
+        correct_embedding = self.get_reference_store().get(self.correct_answer)
         return 1 - cosine(model_embedding, correct_embedding)
 
     def on_success(self, score: float) -> str:
@@ -142,20 +301,21 @@ class Level(ABC):
             f"Keep trying! Your current score is {score:.2f}/{self.min_score_to_pass}"
         )
 
-    def __call__(self, user_prompt: str, model_answer: str) -> LevelResult:
+    def gate_prompt(self, user_prompt: str) -> Optional[LevelResult]:
         """
-        Evaluate the user's prompt and model's answer.
+        Evaluate the prompt alone, before the model is called.
+
+        Levels override this to declare the prompts that decide the level whatever
+        the answer, so that the model call is skipped for them.
 
         Args:
             user_prompt: The prompt provided by the user.
-            model_answer: The answer provided by the model.
 
         Returns:
-            LevelResult with total score, messages, and individual scores.
+            LevelResult if the prompt decides the level, else None.
         """
         # Check for cheat code
         if user_prompt.strip().lower() == "cheatcode42":
-            success_message = self.on_success(100)
             return LevelResult(
                 100,
                 [
@@ -167,11 +327,112 @@ class Level(ABC):
                 ],
                 {"cheat_code": 100},
             )
+        return None
+
+    @property
+    def failed_prompt_fails_level(self) -> bool:
+        """
+        Whether a prompt failing its check can never pass the level.
+
+        Every check scores at least 10, so the best total of such a prompt is
+        (10 + 3 * 100) / 4 = 77.5: below the pass mark of the level, the answer
+        cannot change the outcome.
+        """
+        return (10 + 3 * 100) / 4 < self.min_score_to_pass
+
+    def _reject_prompt(self, user_prompt: str) -> Optional[LevelResult]:
+        """
+        Score a prompt failing its check, if it fails the level whatever the answer.
+
+        The answer checks get their minimum score, since no answer is generated.
+
+        Args:
+            user_prompt: The prompt provided by the user.
 
-        prompt_check = self.check_prompt(user_prompt)
-        prompt_similarity = self.check_prompt_similarity(user_prompt)
+        Returns:
+            LevelResult with total score, messages, and individual scores, or None
+            if the answer could still pass the level.
+        """
+        if not self.failed_prompt_fails_level:
+            return None
+        prompt_check, prompt_similarity, degraded = self.evaluate_prompt(user_prompt)
+        individual_scores = {
+            "prompt_check": max(prompt_check.score, 10),
+            "prompt_similarity": max(prompt_similarity * 100, 10),
+            "answer_check": 10,
+            "answer_similarity": 10,
+        }
+        total_score = sum(individual_scores.values()) / len(individual_scores)
+        messages = [
+            Message(content=msg, color="red", icon="error")
+            for msg in prompt_check.messages
+            + ["This prompt cannot pass the level, the model was not asked."]
+        ]
+        return LevelResult(total_score, messages, individual_scores, degraded)
+
+    def __call__(self, user_prompt: str, model_answer: str) -> LevelResult:
+        """
+        Evaluate the user's prompt and model's answer.
+
+        Args:
+            user_prompt: The prompt provided by the user.
+            model_answer: The answer provided by the model.
+
+        Returns:
+            LevelResult with total score, messages, and individual scores.
+        """
+        gated_result = self.gate_prompt(user_prompt)
+        if gated_result is not None:
+            return gated_result
+
+        return self.evaluate_answer(self.evaluate_prompt(user_prompt), model_answer)
+
+    def evaluate_prompt(
+        self, user_prompt: str, similarity: Optional[float] = None
+    ) -> PromptEvaluation:
+        """
+        Run the checks of the prompt, which do not depend on the answer.
+
+        They can run while the model generates the answer. The similarity is
+        approximated lexically while the embeddings are overloaded.
+
+        Args:
+            user_prompt: The prompt provided by the user.
+            similarity: The similarity of the prompt, if already computed.
+
+        Returns:
+            PromptEvaluation with the prompt check and similarity.
+        """
+        degraded = False
+        if similarity is None:
+            degraded = bool(self.correct_question) and self.embeddings_overloaded()
+            similarity = self.check_prompt_similarity(user_prompt, lexical=degraded)
+        return PromptEvaluation(self.check_prompt(user_prompt), similarity, degraded)
+
+    def evaluate_answer(
+        self,
+        prompt_evaluation: PromptEvaluation,
+        model_answer: str,
+        similarity: Optional[float] = None,
+    ) -> LevelResult:
+        """
+        Run the checks of the answer and combine them with those of the prompt.
+
+        Args:
+            prompt_evaluation: The result of ``evaluate_prompt``.
+            model_answer: The answer provided by the model.
+            similarity: The similarity of the answer, if already computed.
+
+        Returns:
+            LevelResult with total score, messages, and individual scores.
+        """
+        prompt_check, prompt_similarity, degraded = prompt_evaluation
         answer_check = self.check_answer(model_answer)
-        answer_similarity = self.check_answer_similarity(model_answer)
+        lexical = False
+        if similarity is None:
+            lexical = bool(self.correct_answer) and self.embeddings_overloaded()
+            similarity = self.check_answer_similarity(model_answer, lexical=lexical)
+        answer_similarity = similarity
 
         individual_scores = {
             "prompt_check": max(prompt_check.score, 10),
@@ -187,7 +448,55 @@ class Level(ABC):
             for msg in prompt_check.messages + answer_check.messages
         ]
 
-        return LevelResult(total_score, messages, individual_scores)
+        return LevelResult(
+            total_score, messages, individual_scores, degraded or lexical
+        )
+
+    def _batch_similarity(self, texts: list, reference: str) -> list:
+        """Cosine similarities of texts to a reference, encoded in one batch."""
+        if not reference or not texts:
+            return [1.0] * len(texts)
+        embeddings = np.asarray(self.encode(texts), dtype=np.float64)
+        reference_embedding = np.asarray(
+            self.get_reference_store().get(reference), dtype=np.float64
+        )
+        similarities = embeddings @ reference_embedding
+        similarities /= np.linalg.norm(embeddings, axis=1) * np.linalg.norm(
+            reference_embedding
+        )
+        return similarities.tolist()
+
+    def evaluate_batch(self, pairs: list) -> list:
+        """
+        Evaluate many prompts and answers, like ``__call__`` on each of them.
+
+        The prompts and the answers are encoded in one batch each, and their
+        similarities computed at once.
+
+        Args:
+            pairs: The (prompt, answer) pairs.
+
+        Returns:
+            list: The LevelResult of each pair.
+        """
+        results = [self.gate_prompt(prompt) for prompt, _ in pairs]
+        pending = [i for i, result in enumerate(results) if result is None]
+        prompt_similarities = self._batch_similarity(
+            [pairs[i][0] for i in pending], self.correct_question
+        )
+        answer_similarities = self._batch_similarity(
+            [pairs[i][1] for i in pending], self.correct_answer
+        )
+        for i, prompt_similarity, answer_similarity in zip(
+            pending, prompt_similarities, answer_similarities
+        ):
+            prompt, answer = pairs[i]
+            results[i] = self.evaluate_answer(
+                self.evaluate_prompt(prompt, similarity=prompt_similarity),
+                answer,
+                similarity=answer_similarity,
+            )
+        return results
 
 
 if __name__ == "__main__":
@@ -3,12 +3,20 @@ import dash_mantine_components as dmc
 from dash import callback_context
 from dash_iconify import DashIconify
 
-from cache_manager import get_all_users_data, get_user_data, update_user_data
+from cache_manager import (
+    get_all_users_data,
+    get_ranked_users_data,
+    get_user_data,
+    update_user_data,
+)
 from src.Chat import Chat
 from src.Logger import Logger
 
 logger = Logger(__name__)
 
+# Nombre d'utilisateurs du classement affichés dans le tableau des scores
+SCORES_TABLE_SIZE = 100
+
 from typing import Tuple
 import dash_mantine_components as dmc
 from dash import html
@@ -68,7 +76,7 @@ def toggle_history_drawer(n_clicks: int, session_id: str, cache) -> tuple[bool,
         return False, [dmc.Text("Error: Invalid session ID")]
 
     try:
-        user_data = get_user_data(cache, session_id)
+        user_data = get_user_data(cache, session_id, history=True)
         chat = user_data["chat"]
         history_blocks = []
 
@@ -203,26 +211,9 @@ def update_user_table(
     if n_intervals is None and not force_update:
         return dash.no_update
 
-    all_users_data = get_all_users_data(cache)
-
-    # Calculate best score for each user
-    for user_data in all_users_data.values():
-        chat = user_data.get("chat")
-        if chat and isinstance(chat, Chat):
-            best_score = max(
-                (msg.score for msg in chat.messages if msg.score is not None), default=0
-            )
-            user_data["best_score"] = best_score
-
-    sorted_users = sorted(
-        all_users_data.items(),
-        key=lambda x: (x[1].get("level", 1), x[1].get("best_score", 0)),
-        reverse=True,
-    )
-
     rows = []
-    for session_id, user_data in sorted_users:
-        username = user_data.get("username", "Unknown")
+    for session_id, user_data in get_ranked_users_data(cache, limit=SCORES_TABLE_SIZE):
+        username = user_data.get("username") or "Unknown"
         level = user_data.get("level", 1)
         best_score = user_data.get("best_score", 0)
         is_current_user = session_id == current_session_id
@@ -1,8 +1,11 @@
-from typing import Dict, Any, Tuple, List, Union
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Tuple, List, Union, Callable
 from dash import html, set_props, no_update
 from dash_iconify import DashIconify
 import dash_mantine_components as dmc
 from src.Chat import Chat
+from src.providers.CircuitBreaker import ProviderUnavailableError
 from src.Logger import Logger
 from src.levels.LevelList import levels, max_level
 from cache_manager import get_user_data, update_user_data
@@ -54,15 +57,33 @@ def process_input_and_evaluate(
     level = levels.get(current_level, levels[1])
 
     _update_system_prompt(chat, level)
-    model_response = chat.ask(
-        user_prompt,
-        temperature=temperature,
-        repeat_penalty=repeat_penalty,
-        top_k=top_k,
-        top_p=top_p,
-    )
-    result = level(user_prompt, model_response)
-    _add_score_to_chat(chat, result.total_score)
+    result = level.gate_prompt(user_prompt)
+    if result is not None:
+        # The prompt alone decides the level: the model is not asked
+        model_response = ""
+        chat.add_message(
+            "user", user_prompt, score=result.total_score, degraded=result.degraded
+        )
+    else:
+        profile = level.generation_profile
+        # Score the prompt while the model generates the answer
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            prompt_evaluation = executor.submit(level.evaluate_prompt, user_prompt)
+            try:
+                model_response = chat.ask(
+                    user_prompt,
+                    **level.sampling_params(temperature, repeat_penalty, top_k, top_p),
+                    max_tokens=profile.max_tokens,
+                    stop=profile.stop,
+                    on_token=_stream_to_response(),
+                    # Stop generating once the level is decided, e.g. over 30 words
+                    stop_condition=level.check_partial_answer,
+                )
+            except ProviderUnavailableError as e:
+                logger.error(f"No provider could answer: {str(e)}")
+                return _handle_provider_unavailable(user_prompt)
+            result = level.evaluate_answer(prompt_evaluation.result(), model_response)
+        _add_score_to_chat(chat, result.total_score, result.degraded)
 
     notifications = _create_notifications(current_level, result.messages)
 
@@ -122,9 +143,34 @@ def _update_system_prompt(chat: Chat, level: Any) -> None:
             chat.add_message("system", chat.system_prompt)
 
 
-def _add_score_to_chat(chat: Chat, score: float) -> None:
+def _stream_to_response(min_interval: float = 0.3) -> Callable[[str], None]:
+    """
+    Build a chunk callback pushing the partial answer to the response area.
+
+    The first chunk hides the loading overlay; the text is then pushed at most
+    every ``min_interval`` seconds. Background callbacks keep only the latest
+    ``set_props`` until the browser polls, so ``min_interval`` must exceed the
+    polling interval of the callback. The final answer is rendered by the
+    callback outputs.
+    """
+    state = {"text": "", "pushed_at": None}
+
+    def on_token(chunk: str) -> None:
+        state["text"] += chunk
+        now = time.monotonic()
+        if state["pushed_at"] is None:
+            set_props("loading-overlay", {"visible": False})
+            state["pushed_at"] = now
+        elif now - state["pushed_at"] >= min_interval:
+            set_props("model-response", {"children": state["text"]})
+            state["pushed_at"] = now
+
+    return on_token
+
+
+def _add_score_to_chat(chat: Chat, score: float, degraded: bool = False) -> None:
     """Add score to the last exchange in the chat."""
-    if chat.add_score_to_last_exchange(score):
+    if chat.add_score_to_last_exchange(score, degraded):
         logger.info(f"Added score {score} to last exchange")
     else:
         logger.error("Failed to add score to last exchange")
@@ -362,6 +408,48 @@ def _handle_same_level(
     )
 
 
+def _handle_provider_unavailable(user_prompt: str) -> Tuple[
+    str,
+    str,
+    bool,
+    str,
+    no_update,
+    no_update,
+    no_update,
+    no_update,
+    List[Any],
+    no_update,
+    no_update,
+    bool,
+    no_update,
+]:
+    """Handle the case when no provider could answer, without scoring the prompt."""
+    notification = dmc.Notification(
+        id="provider-unavailable-notification",
+        title="Model unavailable",
+        message="The language models are not responding. Please try again.",
+        color="red",
+        icon=DashIconify(icon="alert-circle"),
+        autoClose=False,
+        action="show",
+    )
+    return (
+        "",
+        user_prompt,
+        False,
+        "trigger_focus",
+        no_update,
+        no_update,
+        no_update,
+        no_update,
+        [notification],
+        no_update,
+        no_update,
+        False,
+        no_update,
+    )
+
+
 def _handle_no_input() -> Tuple[
     no_update,
     str,
@@ -3,18 +3,20 @@ from dash import no_update, html
 from src.Logger import Logger
 from src.levels.LevelList import levels, max_level
 from cache_manager import (
+    find_session,
     generate_session_id,
     get_user_data,
+    register_username,
     update_user_data,
+    update_user_fields,
 )
-import json
 
 logger = Logger(__name__).get_logger()
 
 
 def manage_modal_display(
     session_data: Optional[Dict[str, Any]], cache
-) -> Tuple[bool, Dict[str, str], str, Optional[str]]:
+) -> Tuple[bool, Dict[str, str], str, Optional[str], Optional[str]]:
     """
     Manage modal display based on session data.
 
@@ -23,24 +25,38 @@ def manage_modal_display(
         cache: Cache object.
 
     Returns:
-        Tuple[bool, Dict[str, str], str, Optional[str]]: Modal state, welcome alert style, welcome message, and session ID.
+        Tuple[bool, Dict[str, str], str, Optional[str], Optional[str]]: Modal state, welcome alert style, welcome message, session ID, and username error message.
     """
     if not session_data:
         session_id = generate_session_id()
         get_user_data(cache, session_id)
         logger.info(f"New session created: {session_id}")
-        return True, {"display": "none"}, "", session_id
+        return True, {"display": "none"}, "", session_id, None
     username = session_data.get("username")
     if username:
         logger.debug(f"User {username} logged in")
-        all_sessions = json.loads(cache.get("all_sessions") or "{}")
-        if username not in [data.get("username") for data in all_sessions.values()]:
+        if find_session(cache, username) is None:
             session_id = generate_session_id()
-            _create_session(cache, session_id, username)
-            return False, {"display": "block"}, f"Welcome back, {username}!", session_id
-        return False, {"display": "block"}, f"Welcome, {username}!", no_update
+            if _create_session(cache, session_id, username) is None:
+                # Another session took the username since the lookup
+                logger.warning(f"Username '{username}' is already taken")
+                return (
+                    True,
+                    {"display": "none"},
+                    "",
+                    session_id,
+                    "This username is already taken. Please choose another.",
+                )
+            return (
+                False,
+                {"display": "block"},
+                f"Welcome back, {username}!",
+                session_id,
+                None,
+            )
+        return False, {"display": "block"}, f"Welcome, {username}!", no_update, None
     logger.debug("No username in session, showing modal")
-    return True, {"display": "none"}, "", no_update
+    return True, {"display": "none"}, "", no_update, None
 
 
 def handle_username_input(
@@ -60,19 +76,16 @@ def handle_username_input(
         Tuple[Dict[str, str], Optional[str], bool, str, str]: Updated session data, error message, modal state, instructions, and subtitle.
     """
     if (n_clicks or n_keydowns) and username and session_id:
-        all_sessions = json.loads(cache.get("all_sessions") or "{}")
-        for sid, data in all_sessions.items():
-            if sid != session_id and data.get("username") == username:
-                logger.warning(f"Username '{username}' is already taken")
-                return (
-                    no_update,
-                    "This username is already taken. Please choose another.",
-                    True,
-                    no_update,
-                    no_update,
-                )
-
-        user_data, _ = _create_session(cache, session_id, username)
+        user_data = _create_session(cache, session_id, username)
+        if user_data is None:
+            logger.warning(f"Username '{username}' is already taken")
+            return (
+                no_update,
+                "This username is already taken. Please choose another.",
+                True,
+                no_update,
+                no_update,
+            )
 
         current_level = user_data.get("level", 1)
         level = levels.get(current_level, levels[1])
@@ -129,8 +142,7 @@ def update_level_info(
     game_completed = user_data.get("game_completed", False)
 
     if current_level > max_level or game_completed:
-        user_data["game_completed"] = True
-        update_user_data(cache, session_id, user_data)
+        update_user_fields(cache, session_id, game_completed=True)
         congratulations_message = html.Div(
             [
                 html.H2(
@@ -201,7 +213,7 @@ def update_level_info(
 
 def _create_session(cache, session_id, username):
     """
-    Create a new session for a user.
+    Create a new session for a user, unless another session has the username.
 
     Args:
         cache: Cache object.
@@ -209,15 +221,14 @@ def _create_session(cache, session_id, username):
         username (str): Username.
 
     Returns:
-        Tuple[Dict[str, Any], Dict[str, Any]]: User data and all sessions data.
+        Optional[Dict[str, Any]]: User data, or None if the username is taken.
     """
+    if not register_username(cache, session_id, username):
+        return None
+
     user_data = get_user_data(cache, session_id)
     user_data["username"] = username
     update_user_data(cache, session_id, user_data)
 
-    all_sessions = json.loads(cache.get("all_sessions") or "{}")
-    all_sessions[session_id] = {"username": username}
-    cache.set("all_sessions", json.dumps(all_sessions))
-
     logger.info(f"New session created for user {username}: {session_id}")
-    return user_data, all_sessions
+    return user_data
@@ -0,0 +1,215 @@
+import hashlib
+import os
+import unicodedata
+
+import numpy as np
+
+from src.Logger import Logger
+from src.providers.ResponseCache import (
+    BufferedCounters,
+    DiskTier,
+    MemoryTier,
+    RedisTier,
+)
+
+logger = Logger(__name__).get_logger()
+
+
+class EmbeddingCache:
+    """
+    Cache of the embeddings of prompts and answers.
+
+    Students resubmit the same prompts and models often give the same answers, so
+    embeddings are looked up by a hash of the normalized text in a process-local
+    LRU, then in a persistent tier shared with the other processes. Embeddings
+    are stored as float16, which halves their size without changing the
+    similarity scores noticeably.
+    """
+
+    COUNTERS = ["memory_hits", "persistent_hits", "misses"]
+
+    def __init__(self, model_name: str, memory: MemoryTier, persistent=None):
+        """
+        Initialize the cache.
+
+        Args:
+            model_name (str): Identifier of the embedding model, part of the keys.
+            memory (MemoryTier): The in-process tier.
+            persistent (DiskTier | RedisTier, optional): The shared tier.
+        """
+        self.model_name = model_name
+        self.memory = memory
+        self.persistent = persistent
+        self.counters = BufferedCounters(self.COUNTERS, persistent)
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Normalize the Unicode form and whitespace, which do not change embeddings."""
+        return " ".join(unicodedata.normalize("NFC", text).split())
+
+    def key(self, text: str) -> str:
+        """Key of the embedding of a text."""
+        payload = f"{self.model_name}\0{self.normalize(text)}".encode("utf-8")
+        return hashlib.sha256(payload).hexdigest()
+
+    def _count(self, counter: str):
+        self.counters.count(counter)
+
+    def _lookup(self, key: str):
+        embedding = self.memory.get(key)
+        if embedding is not None:
+            self._count("memory_hits")
+            return embedding
+        if self.persistent is not None:
+            try:
+                value = self.persistent.get(key)
+            except Exception as e:
+                logger.warning(f"Persistent embedding cache unavailable: {str(e)}")
+                value = None
+            if value is not None:
+                embedding = np.frombuffer(value, dtype=np.float16)
+                self.memory.set(key, embedding)
+                self._count("persistent_hits")
+                return embedding
+        self._count("misses")
+        return None
+
+    def _store(self, key: str, embedding: np.ndarray) -> np.ndarray:
+        embedding = embedding.astype(np.float16)
+        self.memory.set(key, embedding)
+        if self.persistent is not None:
+            try:
+                self.persistent.set(key, embedding.tobytes())
+            except Exception as e:
+                logger.warning(f"Persistent embedding cache unavailable: {str(e)}")
+        return embedding
+
+    def encode(self, texts: list, encode) -> np.ndarray:
+        """
+        Get the embeddings of texts, encoding only those missing from the cache.
+
+        Args:
+            texts (list): The texts.
+            encode (callable): Encodes a list of texts into an array of embeddings.
+
+        Returns:
+            np.ndarray: Their embeddings, one row per text.
+        """
+        keys = [self.key(text) for text in texts]
+        embeddings = {}
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key in embeddings or key in missing:
+                continue
+            embedding = self._lookup(key)
+            if embedding is None:
+                missing[key] = text
+            else:
+                embeddings[key] = embedding
+        if missing:
+            encoded = np.asarray(encode(list(missing.values())))
+            # Return the stored values, so that a text gets the same score whether
+            # it was cached or not
+            for key, embedding in zip(missing, encoded):
+                embeddings[key] = self._store(key, embedding)
+        return np.stack([embeddings[key] for key in keys]).astype(np.float32)
+
+    def stats(self) -> dict:
+        """
+        Get the hit and miss counters.
+
+        Returns:
+            dict: The counters of this process under ``"process"``, the counters of
+                every process under ``"shared"`` (when a persistent tier is set),
+                the hit rate of each, and the number of entries of the in-process
+                tier.
+        """
+        stats = {
+            "process": dict(self.counters.local),
+            "memory_entries": len(self.memory),
+        }
+        if self.persistent is not None:
+            stats["shared"] = self.counters.shared()
+        for scope in ("process", "shared"):
+            if scope in stats:
+                counters = stats[scope]
+                total = sum(counters.values())
+                hits = counters["memory_hits"] + counters["persistent_hits"]
+                counters["hit_rate"] = hits / total if total else 0.0
+        return stats
+
+    def usage(self) -> dict:
+        """
+        Get the size of the cached embeddings.
+
+        Returns:
+            dict: The usage of the in-process tier under ``"memory"`` and of the
+                persistent tier under ``"persistent"`` (when it is set).
+        """
+        usage = {"memory": self.memory.usage()}
+        if self.persistent is not None:
+            usage["persistent"] = self.persistent.usage()
+        return usage
+
+    def clear(self):
+        """Drop every cached embedding."""
+        self.memory.clear()
+        if self.persistent is not None:
+            self.persistent.clear()
+
+
+_cache = None
+
+
+def _reset_after_fork():
+    global _cache
+    _cache = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_embedding_cache(model_name: str) -> EmbeddingCache:
+    """
+    Get the embedding cache of the process, or None if it is disabled.
+
+    The persistent tier is Redis when ``REDIS_URL`` is set and diskcache otherwise.
+    ``EMBEDDING_CACHE`` (``on``/``off``), ``EMBEDDING_CACHE_TTL``,
+    ``EMBEDDING_CACHE_MAX_ENTRIES``, ``EMBEDDING_CACHE_MEMORY_LIMIT`` and
+    ``EMBEDDING_CACHE_SIZE_LIMIT`` configure it.
+
+    Args:
+        model_name (str): Identifier of the embedding model, part of the keys.
+
+    Returns:
+        EmbeddingCache: The cache instance.
+    """
+    global _cache
+    if os.getenv("EMBEDDING_CACHE", "on") == "off":
+        return None
+    if _cache is None or _cache.model_name != model_name:
+        ttl = float(os.getenv("EMBEDDING_CACHE_TTL", 7 * 24 * 3600))
+        memory = MemoryTier(
+            int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 4096)),
+            ttl,
+            max_bytes=int(os.getenv("EMBEDDING_CACHE_MEMORY_LIMIT", 16 * 1024**2)),
+        )
+        try:
+            if "REDIS_URL" in os.environ:
+                persistent = RedisTier(
+                    os.environ["REDIS_URL"], ttl, prefix="embedding_cache", binary=True
+                )
+            else:
+                persistent = DiskTier(
+                    ".cache/embedding_cache",
+                    ttl,
+                    size_limit=int(
+                        os.getenv("EMBEDDING_CACHE_SIZE_LIMIT", 64 * 1024**2)
+                    ),
+                )
+        except Exception as e:
+            logger.warning(f"Embedding cache without persistent tier: {str(e)}")
+            persistent = None
+        _cache = EmbeddingCache(model_name, memory, persistent)
+    return _cache
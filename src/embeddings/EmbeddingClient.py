@@ -0,0 +1,126 @@
+import os
+import threading
+import time
+from multiprocessing.connection import Client
+
+import numpy as np
+
+from src.embeddings.EmbeddingServer import DEFAULT_SOCKET
+from src.Logger import Logger
+
+logger = Logger(__name__).get_logger()
+
+
+class EmbeddingClient:
+    """
+    Client of the embedding server of the host.
+
+    Each thread keeps its own connection. When the server cannot be reached,
+    ``encode`` returns None so that the caller encodes locally, and the server is
+    not tried again for ``retry_interval`` seconds.
+
+    Attributes:
+        queue_depth (int): Number of texts waiting on the server after the last
+            answer.
+    """
+
+    def __init__(
+        self, socket_path: str, timeout: float = 10.0, retry_interval: float = 5.0
+    ):
+        """
+        Initialize the client.
+
+        Args:
+            socket_path (str): Path of the unix socket of the server.
+            timeout (float): Seconds to wait for the embeddings of a request.
+            retry_interval (float): Seconds before trying the server again after a
+                failure.
+        """
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self._local = threading.local()
+        self._retry_at = 0.0
+        self.queue_depth = 0
+
+    def _connection(self):
+        # Connections are not shared with forked children
+        if getattr(self._local, "pid", None) != os.getpid():
+            self._local.conn = None
+            self._local.pid = os.getpid()
+        if self._local.conn is None:
+            self._local.conn = Client(self.socket_path, family="AF_UNIX")
+        return self._local.conn
+
+    def _close(self):
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn is not None:
+            try:
+                conn.close()
+            except OSError:
+                pass
+
+    def _request(self, payload, timeout: float):
+        """Send a request to the server, or return None if it is unavailable."""
+        if time.monotonic() < self._retry_at:
+            return None
+        try:
+            conn = self._connection()
+            conn.send(payload)
+            if not conn.poll(timeout):
+                raise TimeoutError(f"No answer after {timeout}s")
+            response, self.queue_depth = conn.recv()
+            if isinstance(response, Exception):
+                raise response
+            return response
+        except Exception as e:
+            logger.warning(f"Embedding server unavailable, encoding locally: {e}")
+            self._close()
+            self._retry_at = time.monotonic() + self.retry_interval
+            return None
+
+    def encode(self, texts: list) -> np.ndarray:
+        """
+        Encode texts on the server.
+
+        Args:
+            texts (list): The texts.
+
+        Returns:
+            np.ndarray: Their embeddings, or None if the server is unavailable.
+        """
+        return self._request(list(texts), self.timeout)
+
+    def status(self) -> dict:
+        """
+        Get the load of the server, shared by every process of the host.
+
+        The server answers without encoding anything, so this costs a round trip
+        on the socket.
+
+        Returns:
+            dict: The status of ``EmbeddingServer.status``, or None if the server
+                is unavailable.
+        """
+        return self._request(None, min(self.timeout, 1.0))
+
+
+_client = None
+
+
+def get_embedding_client() -> EmbeddingClient:
+    """
+    Get the client of the embedding server, or None if ``EMBEDDING_SERVER`` is ``off``.
+
+    The server listens on ``EMBEDDING_SOCKET`` (default: ``scratch/embeddings.sock``).
+
+    Returns:
+        EmbeddingClient: The client.
+    """
+    global _client
+    if os.getenv("EMBEDDING_SERVER", "on") == "off":
+        return None
+    if _client is None:
+        _client = EmbeddingClient(os.getenv("EMBEDDING_SOCKET", DEFAULT_SOCKET))
+    return _client
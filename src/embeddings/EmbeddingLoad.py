@@ -0,0 +1,136 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class EmbeddingLoad:
+    """
+    Latency and queue depth of the embeddings, to detect overload.
+
+    With the embedding server, both come from the server, which sees the
+    encodes of every process of the host: callbacks run in short-lived
+    processes that could not tell otherwise. Without it, they are measured on
+    the encodes of this process: the latency is an exponential moving average,
+    and the queue depth the number of encodes in progress. Samples older than
+    ``stale_after`` seconds are ignored, so that the embeddings are tried again
+    once callers stopped using them.
+    """
+
+    def __init__(
+        self,
+        max_latency: float = 2.0,
+        max_queue_depth: int = 64,
+        smoothing: float = 0.3,
+        stale_after: float = 10.0,
+    ):
+        """
+        Initialize the monitor.
+
+        Args:
+            max_latency (float): Average seconds per encode above which the
+                embeddings are overloaded.
+            max_queue_depth (int): Number of waiting texts above which the
+                embeddings are overloaded.
+            smoothing (float): Weight of the last encode in the average latency.
+            stale_after (float): Seconds after which the samples are ignored.
+        """
+        self.max_latency = max_latency
+        self.max_queue_depth = max_queue_depth
+        self.smoothing = smoothing
+        self.stale_after = stale_after
+        self.latency = None
+        self.queue_depth = 0
+        self.in_flight = 0
+        self._latency_at = 0.0
+        self._queue_depth_at = 0.0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def track(self):
+        """Measure an encode of this process."""
+        with self._lock:
+            self.in_flight += 1
+        start_time = time.monotonic()
+        try:
+            yield
+        finally:
+            latency = time.monotonic() - start_time
+            with self._lock:
+                self.in_flight -= 1
+                if self.latency is None:
+                    self.latency = latency
+                else:
+                    self.latency += self.smoothing * (latency - self.latency)
+                self._latency_at = time.monotonic()
+
+    def report_queue_depth(self, queue_depth: int):
+        """Record the number of texts waiting on the embedding server."""
+        with self._lock:
+            self.queue_depth = queue_depth
+            self._queue_depth_at = time.monotonic()
+
+    def report_status(self, status: dict):
+        """
+        Record the load reported by the embedding server.
+
+        Args:
+            status (dict): The status of ``EmbeddingServer.status``.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self.queue_depth = status["queue_depth"]
+            self._queue_depth_at = now
+            if status["latency"] is not None:
+                self.latency = status["latency"]
+                self._latency_at = now - status["latency_age"]
+
+    def overloaded(self) -> bool:
+        """Whether new encodes should be avoided."""
+        now = time.monotonic()
+        with self._lock:
+            if self.in_flight > self.max_queue_depth:
+                return True
+            if (
+                now - self._queue_depth_at <= self.stale_after
+                and self.queue_depth > self.max_queue_depth
+            ):
+                return True
+            return (
+                now - self._latency_at <= self.stale_after
+                and self.latency is not None
+                and self.latency > self.max_latency
+            )
+
+
+_load = None
+
+
+def _reset_after_fork():
+    global _load
+    _load = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_embedding_load() -> EmbeddingLoad:
+    """
+    Get the load monitor of the process, or None if the lexical fallback is disabled.
+
+    ``LEXICAL_FALLBACK`` (``on``/``off``), ``LEXICAL_FALLBACK_MAX_LATENCY`` and
+    ``LEXICAL_FALLBACK_MAX_QUEUE_DEPTH`` configure it.
+
+    Returns:
+        EmbeddingLoad: The monitor instance.
+    """
+    global _load
+    if os.getenv("LEXICAL_FALLBACK", "on") == "off":
+        return None
+    if _load is None:
+        _load = EmbeddingLoad(
+            max_latency=float(os.getenv("LEXICAL_FALLBACK_MAX_LATENCY", 2.0)),
+            max_queue_depth=int(os.getenv("LEXICAL_FALLBACK_MAX_QUEUE_DEPTH", 64)),
+        )
+    return _load
@@ -0,0 +1,237 @@
+import atexit
+import fcntl
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+
+from src.Logger import Logger
+
+logger = Logger(__name__).get_logger()
+
+DEFAULT_SOCKET = "scratch/embeddings.sock"
+
+# Root of the project, from which the server runs as a module
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class EmbeddingServer:
+    """
+    Encodes the texts of every worker of the host with a single model.
+
+    Clients connect to a unix socket and send lists of texts. Requests arriving
+    within ``batch_window`` seconds of each other are encoded together, up to
+    ``max_batch`` texts, which is much cheaper than encoding them one by one.
+    Each answer is sent with the number of texts still waiting, so that clients
+    can tell when the server is overloaded. A ``None`` request gets the load of
+    the server without encoding anything: its queue depth and the average
+    latency of the requests of every client.
+    """
+
+    # Weight of the last request in the average latency
+    SMOOTHING = 0.3
+
+    def __init__(
+        self,
+        socket_path: str,
+        encode,
+        max_batch: int = 64,
+        batch_window: float = 0.005,
+    ):
+        """
+        Initialize the server.
+
+        Args:
+            socket_path (str): Path of the unix socket.
+            encode (callable): Encodes a list of texts into an array of embeddings.
+            max_batch (int): Maximum number of texts encoded together.
+            batch_window (float): Seconds to wait for more requests before encoding.
+        """
+        self.socket_path = socket_path
+        self.encode = encode
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self._requests = queue.SimpleQueue()
+        self._pending = 0
+        self._latency = None
+        self._latency_at = 0.0
+        self._lock = threading.Lock()
+
+    def serve_forever(self):
+        """Accept connections until the process exits."""
+        os.makedirs(os.path.dirname(self.socket_path) or ".", exist_ok=True)
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        listener = Listener(self.socket_path, family="AF_UNIX")
+        # Requests are pickled: only the user running the server may connect
+        os.chmod(self.socket_path, 0o600)
+        threading.Thread(target=self._batch_loop, daemon=True).start()
+        logger.info(f"Embedding server listening on {self.socket_path}")
+        while True:
+            conn = listener.accept()
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        """Serve the requests of a connection, one at a time."""
+        try:
+            while True:
+                texts = conn.recv()
+                if texts is None:
+                    conn.send((self.status(), self._pending))
+                    continue
+                future = Future()
+                start_time = time.monotonic()
+                with self._lock:
+                    self._pending += len(texts)
+                self._requests.put((texts, future))
+                try:
+                    response = future.result()
+                except Exception as e:
+                    response = e
+                self._record_latency(time.monotonic() - start_time)
+                conn.send((response, self._pending))
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+
+    def _record_latency(self, latency: float):
+        with self._lock:
+            if self._latency is None:
+                self._latency = latency
+            else:
+                self._latency += self.SMOOTHING * (latency - self._latency)
+            self._latency_at = time.monotonic()
+
+    def status(self) -> dict:
+        """
+        Get the load of the server.
+
+        Returns:
+            dict: The number of texts waiting under ``"queue_depth"``, the average
+                seconds per request, waiting included, under ``"latency"`` (None
+                before the first request), and the seconds since the last request
+                under ``"latency_age"``.
+        """
+        with self._lock:
+            return {
+                "queue_depth": self._pending,
+                "latency": self._latency,
+                "latency_age": time.monotonic() - self._latency_at,
+            }
+
+    def _next_batch(self) -> list:
+        """Wait for a request, then gather the ones arriving within the window."""
+        batch = [self._requests.get()]
+        size = len(batch[0][0])
+        deadline = time.monotonic() + self.batch_window
+        while size < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self._requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(request)
+            size += len(request[0])
+        return batch
+
+    def _batch_loop(self):
+        while True:
+            batch = self._next_batch()
+            texts = [text for request_texts, _ in batch for text in request_texts]
+            try:
+                embeddings = np.asarray(self.encode(texts))
+            except Exception as e:
+                with self._lock:
+                    self._pending -= len(texts)
+                logger.error(f"Failed to encode a batch: {str(e)}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            with self._lock:
+                self._pending -= len(texts)
+            logger.debug(f"Encoded {len(texts)} texts for {len(batch)} requests")
+            offset = 0
+            for request_texts, future in batch:
+                future.set_result(embeddings[offset : offset + len(request_texts)])
+                offset += len(request_texts)
+
+
+def run_server(socket_path: str):
+    """Load the embedding model and serve it (entry point of the server process)."""
+    from src.embeddings.Models import load_model
+
+    model = load_model()
+    EmbeddingServer(
+        socket_path,
+        model.encode,
+        max_batch=int(os.getenv("EMBEDDING_MAX_BATCH", 64)),
+        batch_window=float(os.getenv("EMBEDDING_BATCH_WINDOW", 0.005)),
+    ).serve_forever()
+
+
+def server_answers(socket_path: str) -> bool:
+    """Whether an embedding server accepts connections on a socket."""
+    try:
+        Client(socket_path, family="AF_UNIX").close()
+        return True
+    except OSError:
+        return False
+
+
+def start_embedding_server(
+    socket_path: str = None, timeout: float = 120.0
+) -> subprocess.Popen:
+    """
+    Start the embedding server in its own interpreter and wait until it answers.
+
+    The server runs as ``python -m src.embeddings.EmbeddingServer``: unlike a
+    multiprocessing child, it does not re-import the main module of the caller,
+    whose startup code would run again. Nothing is started if a server already
+    answers on the socket, e.g. the one of another worker of the app.
+
+    Args:
+        socket_path (str, optional): Path of the unix socket. Defaults to
+            ``EMBEDDING_SOCKET`` or ``scratch/embeddings.sock``.
+        timeout (float): Seconds to wait for the model to load.
+
+    Returns:
+        subprocess.Popen: The server process, or None if a server was running.
+    """
+    socket_path = os.path.abspath(
+        socket_path or os.getenv("EMBEDDING_SOCKET", DEFAULT_SOCKET)
+    )
+    os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+    # Workers starting together must not start a server each
+    with open(f"{socket_path}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if server_answers(socket_path):
+            logger.info(f"Embedding server already listening on {socket_path}")
+            return None
+        process = subprocess.Popen(
+            [sys.executable, "-m", "src.embeddings.EmbeddingServer"],
+            cwd=ROOT,
+            env={**os.environ, "EMBEDDING_SOCKET": socket_path},
+        )
+        atexit.register(process.terminate)
+        deadline = time.monotonic() + timeout
+        while not server_answers(socket_path):
+            if process.poll() is not None or time.monotonic() > deadline:
+                logger.warning(
+                    "Embedding server not ready, workers will encode locally"
+                )
+                break
+            time.sleep(0.1)
+    return process
+
+
+if __name__ == "__main__":
+    run_server(os.getenv("EMBEDDING_SOCKET", DEFAULT_SOCKET))
@@ -0,0 +1,73 @@
+import math
+import re
+from collections import Counter
+
+
+class TfidfIndex:
+    """
+    TF-IDF vectors of the reference texts of a level, compared by cosine.
+
+    Terms are the character trigrams of the words, so that inflections and typos
+    still partially match. It is far cheaper than the embedding model, but only
+    measures lexical overlap: it replaces the embeddings while they are
+    overloaded.
+    """
+
+    def __init__(self, references: list, ngram: int = 3):
+        """
+        Precompute the vectors of the references.
+
+        Args:
+            references (list): The reference texts.
+            ngram (int): Length of the character n-grams.
+        """
+        self.ngram = ngram
+        counts = [self._terms(text) for text in references]
+        document_frequency = Counter(term for terms in counts for term in terms)
+        # Smoothed IDF, as in scikit-learn: terms of every reference keep a weight
+        self.idf = {
+            term: math.log((1 + len(references)) / (1 + frequency)) + 1
+            for term, frequency in document_frequency.items()
+        }
+        self._default_idf = math.log(1 + len(references)) + 1
+        self._vectors = {
+            text: self._weigh(terms) for text, terms in zip(references, counts)
+        }
+
+    def _terms(self, text: str) -> Counter:
+        terms = Counter()
+        for word in re.findall(r"\w+", text.lower()):
+            padded = f" {word} "
+            for i in range(max(len(padded) - self.ngram + 1, 1)):
+                terms[padded[i : i + self.ngram]] += 1
+        return terms
+
+    def _weigh(self, terms: Counter) -> dict:
+        vector = {
+            term: count * self.idf.get(term, self._default_idf)
+            for term, count in terms.items()
+        }
+        norm = math.sqrt(sum(weight**2 for weight in vector.values()))
+        return {term: weight / norm for term, weight in vector.items()} if norm else {}
+
+    def similarity(self, text: str, reference: str) -> float:
+        """
+        Cosine similarity between a text and a reference.
+
+        Args:
+            text (str): The text.
+            reference (str): A reference text of the index.
+
+        Returns:
+            float: Similarity score between 0 and 1.
+        """
+        reference_vector = self._vectors.get(reference)
+        if reference_vector is None:
+            reference_vector = self._weigh(self._terms(reference))
+        vector = self._weigh(self._terms(text))
+        return float(
+            sum(
+                weight * reference_vector.get(term, 0.0)
+                for term, weight in vector.items()
+            )
+        )
@@ -0,0 +1,67 @@
+import os
+
+from sentence_transformers import SentenceTransformer
+
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+# Exports of the model published in its repository, by backend
+ONNX_FILES = {
+    "onnx": "onnx/model.onnx",
+    "onnx-int8": "onnx/model_quint8_avx2.onnx",
+}
+BACKENDS = ["torch", *ONNX_FILES]
+
+
+def get_backend() -> str:
+    """
+    The backend of the embedding model, read from ``EMBEDDING_BACKEND``.
+
+    ``torch`` (default) runs the PyTorch model, ``onnx`` its ONNX Runtime export
+    and ``onnx-int8`` its int8-quantized export, the fastest on CPU. The ONNX
+    backends require the ``onnx`` extra.
+
+    Returns:
+        str: The backend.
+    """
+    backend = os.getenv("EMBEDDING_BACKEND", "torch")
+    if backend not in BACKENDS:
+        raise ValueError(
+            f"Unknown embedding backend {backend!r}, expected one of {BACKENDS}"
+        )
+    return backend
+
+
+def model_id(backend: str = None) -> str:
+    """
+    Identifier of the model and its backend, whose embeddings differ slightly.
+
+    Args:
+        backend (str, optional): The backend. Defaults to ``get_backend()``.
+
+    Returns:
+        str: The identifier.
+    """
+    backend = backend or get_backend()
+    if backend == "torch":
+        return EMBEDDING_MODEL
+    return f"{EMBEDDING_MODEL}@{backend}"
+
+
+def load_model(backend: str = None) -> SentenceTransformer:
+    """
+    Load the embedding model used to compare prompts and answers to the references.
+
+    Args:
+        backend (str, optional): The backend. Defaults to ``get_backend()``.
+
+    Returns:
+        SentenceTransformer: The model.
+    """
+    backend = backend or get_backend()
+    if backend == "torch":
+        return SentenceTransformer(EMBEDDING_MODEL)
+    return SentenceTransformer(
+        EMBEDDING_MODEL,
+        backend="onnx",
+        model_kwargs={"file_name": ONNX_FILES[backend]},
+    )
@@ -0,0 +1,104 @@
+import hashlib
+import os
+import threading
+
+import numpy as np
+
+from src.Logger import Logger
+
+logger = Logger(__name__).get_logger()
+
+
+class ReferenceEmbeddingStore:
+    """
+    Embeddings of the reference texts of the levels (correct questions and answers).
+
+    Each embedding is computed once, then kept in memory and persisted to disk under
+    a key made of the model name and a hash of the text, so restarting the server or
+    forking a worker does not encode the references again. Changing a reference
+    text or the model simply produces a new key.
+    """
+
+    def __init__(self, model_name: str, encode, directory: str = ".cache/embeddings"):
+        """
+        Initialize the store.
+
+        Args:
+            model_name (str): Name of the embedding model, part of the keys.
+            encode (callable): Encodes a list of texts into an array of embeddings.
+            directory (str): Directory of the persisted embeddings.
+        """
+        self.model_name = model_name
+        self.encode = encode
+        self.directory = directory
+        self._embeddings = {}
+        self._lock = threading.Lock()
+
+    def key(self, text: str) -> str:
+        """Key of the embedding of a text."""
+        payload = f"{self.model_name}\0{text}".encode("utf-8")
+        return hashlib.sha256(payload).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.npy")
+
+    def _load(self, key: str):
+        try:
+            return np.load(self._path(key))
+        except (OSError, ValueError):
+            return None
+
+    def _save(self, key: str, embedding: np.ndarray):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Write then rename, so that concurrent workers never read a partial file
+            tmp_path = f"{self._path(key)}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, embedding)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            logger.warning(f"Failed to persist reference embedding: {str(e)}")
+
+    def get(self, text: str) -> np.ndarray:
+        """
+        Get the embedding of a reference text.
+
+        Args:
+            text (str): The reference text.
+
+        Returns:
+            np.ndarray: Its embedding, as a 1-D array.
+        """
+        key = self.key(text)
+        embedding = self._embeddings.get(key)
+        if embedding is None:
+            self.warm([text])
+            embedding = self._embeddings[key]
+        return embedding
+
+    def warm(self, texts: list):
+        """
+        Load or compute the embeddings of reference texts, encoding the missing
+        ones in a single batch.
+
+        Args:
+            texts (list): The reference texts.
+        """
+        with self._lock:
+            missing = {}
+            for text in texts:
+                key = self.key(text)
+                if key in self._embeddings:
+                    continue
+                embedding = self._load(key)
+                if embedding is None:
+                    missing[key] = text
+                else:
+                    self._embeddings[key] = embedding
+            if not missing:
+                return
+            logger.info(f"Encoding {len(missing)} reference texts")
+            embeddings = np.asarray(self.encode(list(missing.values())))
+            for key, embedding in zip(missing, embeddings):
+                self._embeddings[key] = embedding
+                self._save(key, embedding)
@@ -1,4 +1,5 @@
-from src.Level import Level, CheckResult, LevelResult
+from typing import Optional
+from src.Level import Level, CheckResult, LevelResult, GenerationProfile
 
 
 class ChatterboxLevel(Level):
@@ -32,6 +33,11 @@ class ChatterboxLevel(Level):
         Good luck, and let the prompt engineering begin!
         """
 
+    @property
+    def generation_profile(self) -> GenerationProfile:
+        # Room for 30 words, so that longer answers still fail once cut
+        return GenerationProfile(max_tokens=100)
+
     def check_answer(self, answer: str) -> CheckResult:
         """
         Check if the answer is less than 30 words.
@@ -49,6 +55,20 @@ class ChatterboxLevel(Level):
             0, [f"The response has {word_count} words. It should be less than 30."]
         )
 
+    def check_partial_answer(self, partial_answer: str) -> Optional[CheckResult]:
+        """
+        Fail the answer as soon as it reaches 30 words.
+
+        Args:
+            partial_answer (str): The answer generated so far.
+
+        Returns:
+            Optional[CheckResult]: The failed check, or None while under 30 words.
+        """
+        if len(partial_answer.split()) >= 30:
+            return self.check_answer(partial_answer)
+        return None
+
     def on_success(self, score: float) -> str:
         return "Well done! Okay, this level wasn't particularly challenging, but let's make things a bit more complex..."
 
@@ -1,4 +1,5 @@
-from src.Level import Level, CheckResult
+from typing import Optional
+from src.Level import Level, CheckResult, GenerationProfile, LevelResult
 
 
 class FamilyLevel(Level):
@@ -91,6 +92,26 @@ Use the family description below to determine who John's grand uncle is. Follow
 Write each step as you solve the problem. Conclude with: "John's great uncle is [Name]."
 """
 
+    @property
+    def generation_profile(self) -> GenerationProfile:
+        # A few reasoning steps, then "John's great uncle is <Name>."
+        return GenerationProfile(max_tokens=400, temperature=(0, 1.5))
+
+    def gate_prompt(self, user_prompt: str) -> Optional[LevelResult]:
+        """
+        Reject the prompts giving the answer away.
+
+        Args:
+            user_prompt (str): The user's prompt.
+
+        Returns:
+            Optional[LevelResult]: The result if the prompt decides the level.
+        """
+        result = super().gate_prompt(user_prompt)
+        if result is None and "arthur" in user_prompt.lower():
+            result = self._reject_prompt(user_prompt)
+        return result
+
     def check_prompt(self, prompt: str) -> CheckResult:
         """
         Check if the prompt is correct and doesn't contain the answer.
@@ -1,4 +1,4 @@
-from src.Level import Level, CheckResult
+from src.Level import Level, CheckResult, GenerationProfile
 import re
 
 
@@ -108,6 +108,11 @@ Term 21: 7752 + 12543 = 20295
 Explanation of the Sequence Difference:
 This sequence is similar to the Fibonacci sequence, with each term being the sum of the two preceding terms. However, it differs from the traditional Fibonacci sequence in its initial terms. The traditional Fibonacci sequence starts with 0 and 1, whereas this modified sequence starts with 0 and 3. This change in initial terms alters all subsequent terms in the sequence."""
 
+    @property
+    def generation_profile(self) -> GenerationProfile:
+        # 21 terms with their calculation, and a short explanation
+        return GenerationProfile(max_tokens=600, temperature=(0, 1.5))
+
     def check_prompt(self, prompt: str) -> CheckResult:
         """
         Check if the prompt is correct and doesn't contain the answer.
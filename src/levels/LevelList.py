@@ -1,3 +1,4 @@
+from src.Level import Level
 from src.levels.Chatterbox import ChatterboxLevel
 from src.levels.PrecisionPerformer import PrecisionPerformerLevel
 from src.levels.Fibonacci import FibonacciLevel
@@ -16,3 +17,14 @@ levels = {
     7: FamilyLevel(),
 }
 max_level = max(levels.keys())
+
+
+def warm_reference_embeddings():
+    """
+    Load or compute the reference embeddings of every level in one batch, and the
+    lexical indexes used while the embeddings are overloaded.
+    """
+    texts = [text for level in levels.values() for text in level.reference_texts()]
+    Level.get_reference_store().warm(texts)
+    for level in levels.values():
+        level.get_lexical_index()
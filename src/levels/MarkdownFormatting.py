@@ -1,4 +1,4 @@
-from src.Level import Level, CheckResult
+from src.Level import Level, CheckResult, GenerationProfile
 import re
 
 
@@ -34,6 +34,11 @@ class MarkdownFormattingLevel(Level):
         Good luck, Markdown maestro!
         """
 
+    @property
+    def generation_profile(self) -> GenerationProfile:
+        # The closing code fence must fit, or the answer fails
+        return GenerationProfile(max_tokens=800, temperature=(0, 1.5))
+
     def check_prompt(self, prompt: str) -> CheckResult:
         """
         Check if the prompt contains Markdown elements.
@@ -1,4 +1,5 @@
-from src.Level import Level, CheckResult, LevelResult
+from typing import Optional
+from src.Level import Level, CheckResult, LevelResult, GenerationProfile
 
 
 class PrecisionPerformerLevel(Level):
@@ -27,8 +28,15 @@ class PrecisionPerformerLevel(Level):
         Break a leg! (But not the sentence structure! 😉)
         """
 
+    expected_answer = "This is my answer"
+
+    @property
+    def generation_profile(self) -> GenerationProfile:
+        # The expected phrase is 4 tokens long
+        return GenerationProfile(max_tokens=16)
+
     def check_answer(self, answer: str) -> CheckResult:
-        if answer.strip() == "This is my answer":
+        if answer.strip() == self.expected_answer:
             return CheckResult(100, [])
         return CheckResult(
             0,
@@ -37,6 +45,21 @@ class PrecisionPerformerLevel(Level):
             ],
         )
 
+    def check_partial_answer(self, partial_answer: str) -> Optional[CheckResult]:
+        """
+        Fail the answer as soon as it diverges from the expected phrase.
+
+        Args:
+            partial_answer (str): The answer generated so far.
+
+        Returns:
+            Optional[CheckResult]: The failed check, or None while the answer can
+                still be exactly the expected phrase.
+        """
+        if not self.expected_answer.startswith(partial_answer.strip()):
+            return self.check_answer(partial_answer)
+        return None
+
     def on_success(self, score: float) -> str:
         return "Not bad! This one was a bit more challenging, and you handled it like a pro!"
 
@@ -1,4 +1,5 @@
-from src.Level import Level, CheckResult
+from typing import Optional
+from src.Level import Level, CheckResult, GenerationProfile, LevelResult
 import re
 from xml.etree import ElementTree as ET
 
@@ -41,6 +42,26 @@ class XMLEngineeringLevel(Level):
         Be creative and precise in your prompt crafting!
         """
 
+    @property
+    def generation_profile(self) -> GenerationProfile:
+        # A short story using the required words
+        return GenerationProfile(max_tokens=500, temperature=(0, 1.5))
+
+    def gate_prompt(self, user_prompt: str) -> Optional[LevelResult]:
+        """
+        Reject the prompts missing the required XML tags or words.
+
+        Args:
+            user_prompt (str): The user's prompt.
+
+        Returns:
+            Optional[LevelResult]: The result if the prompt decides the level.
+        """
+        result = super().gate_prompt(user_prompt)
+        if result is None and self.check_prompt(user_prompt).score == 0:
+            result = self._reject_prompt(user_prompt)
+        return result
+
     def check_prompt(self, prompt: str) -> CheckResult:
         """
         Check if the prompt contains required XML tags and words.
@@ -0,0 +1,469 @@
+import json
+import math
+import os
+import struct
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+from src.Logger import Logger
+from src.providers.InterProcess import InterProcessLock, scratch_path, segment_name
+from src.providers.ProviderScheduler import PROVIDERS
+
+logger = Logger(__name__).get_logger()
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call is refused because the circuit of its provider is open."""
+
+    def __init__(self, provider: str):
+        super().__init__(f"Circuit of {provider} is open")
+        self.provider = provider
+
+
+class ProviderUnavailableError(Exception):
+    """Raised when no provider could answer a call."""
+
+    pass
+
+
+def _initial_state() -> dict:
+    return {"state": CLOSED, "opened_at": 0.0, "probe_at": 0.0}
+
+
+# Outcomes are counted in buckets of window / BUCKETS seconds: the window slides
+# one bucket at a time
+BUCKETS = 10
+
+_RECORD_SCRIPT = """
+local bucket = tonumber(ARGV[1])
+local oldest = bucket - tonumber(ARGV[3]) + 1
+redis.call("HINCRBY", KEYS[1], "calls:" .. bucket, 1)
+if ARGV[2] == "0" then
+    redis.call("HINCRBY", KEYS[1], "failures:" .. bucket, 1)
+end
+redis.call("EXPIRE", KEYS[1], ARGV[4])
+local calls, failures = 0, 0
+local fields = redis.call("HGETALL", KEYS[1])
+for i = 1, #fields, 2 do
+    local kind, b = string.match(fields[i], "(%a+):(%d+)")
+    if tonumber(b) < oldest then
+        redis.call("HDEL", KEYS[1], fields[i])
+    elseif kind == "calls" then
+        calls = calls + tonumber(fields[i + 1])
+    else
+        failures = failures + tonumber(fields[i + 1])
+    end
+end
+return {calls, failures}
+"""
+
+
+class SharedMemoryStore:
+    """
+    Breaker states and outcome counters in shared memory, for the processes of the host.
+
+    The segment holds one block per provider: its state and the time it opened
+    and was last probed, then ``BUCKETS`` counters of calls and failures. Each
+    operation takes a short inter-process lock and touches one block, without
+    any disk I/O.
+    """
+
+    _states = [CLOSED, OPEN, HALF_OPEN]
+    _state = struct.Struct("<qdd")
+    _bucket = struct.Struct("<qqq")
+
+    def __init__(
+        self,
+        providers: list = PROVIDERS,
+        name: str = None,
+        lock_path: str = None,
+    ):
+        """
+        Initialize the store.
+
+        Args:
+            providers (list): Names of the providers.
+            name (str, optional): Name of the shared memory segment. Defaults to
+                one of its own per project (see ``segment_name``).
+            lock_path (str, optional): Path of the file used as inter-process
+                mutex. Defaults to ``scratch/circuit_breakers.lock`` in the
+                project.
+        """
+        self.providers = list(providers)
+        self.name = name or segment_name("breakers_v1")
+        self._index = {p: i for i, p in enumerate(self.providers)}
+        self._block_size = self._state.size + self._bucket.size * BUCKETS
+        self._size = self._block_size * len(self.providers)
+        self._lock = InterProcessLock(
+            lock_path or scratch_path("circuit_breakers.lock")
+        )
+        self._shm = None
+
+    def _segment(self) -> shared_memory.SharedMemory:
+        """Attach to the shared memory segment, creating it if needed."""
+        if self._shm is None:
+            with self._lock:
+                try:
+                    shm = shared_memory.SharedMemory(name=self.name)
+                except FileNotFoundError:
+                    shm = shared_memory.SharedMemory(
+                        name=self.name, create=True, size=self._size
+                    )
+                    shm.buf[: self._size] = bytes(self._size)
+            # The states must outlive the processes of the background callbacks
+            resource_tracker.unregister(shm._name, "shared_memory")
+            self._shm = shm
+        return self._shm
+
+    def _offset(self, provider: str) -> int:
+        return self._index[provider] * self._block_size
+
+    def _read(self, buf, provider: str) -> dict:
+        state, opened_at, probe_at = self._state.unpack_from(
+            buf, self._offset(provider)
+        )
+        return {
+            "state": self._states[state],
+            "opened_at": opened_at,
+            "probe_at": probe_at,
+        }
+
+    def get(self, provider: str) -> dict:
+        buf = self._segment().buf
+        with self._lock:
+            return self._read(buf, provider)
+
+    def get_many(self, providers: list) -> list:
+        buf = self._segment().buf
+        with self._lock:
+            return [self._read(buf, provider) for provider in providers]
+
+    def update(self, provider: str, transition):
+        """Apply ``transition(state) -> (state, result)`` atomically."""
+        buf = self._segment().buf
+        with self._lock:
+            state, result = transition(self._read(buf, provider))
+            self._state.pack_into(
+                buf,
+                self._offset(provider),
+                self._states.index(state["state"]),
+                state["opened_at"],
+                state["probe_at"],
+            )
+        return result
+
+    def record(self, provider: str, ok: bool, bucket: int) -> tuple:
+        """
+        Count the outcome of a call in a bucket.
+
+        Args:
+            provider (str): The provider of the call.
+            ok (bool): Whether the call succeeded.
+            bucket (int): Index of the bucket of the call.
+
+        Returns:
+            tuple: The number of calls and failures of the last ``BUCKETS``
+                buckets.
+        """
+        buf = self._segment().buf
+        base = self._offset(provider) + self._state.size
+        calls = failures = 0
+        with self._lock:
+            for slot in range(BUCKETS):
+                offset = base + slot * self._bucket.size
+                index, bucket_calls, bucket_failures = self._bucket.unpack_from(
+                    buf, offset
+                )
+                if slot == bucket % BUCKETS:
+                    if index != bucket:
+                        index, bucket_calls, bucket_failures = bucket, 0, 0
+                    bucket_calls += 1
+                    bucket_failures += 0 if ok else 1
+                    self._bucket.pack_into(
+                        buf, offset, index, bucket_calls, bucket_failures
+                    )
+                if index > bucket - BUCKETS:
+                    calls += bucket_calls
+                    failures += bucket_failures
+        return calls, failures
+
+    def clear_outcomes(self, provider: str):
+        buf = self._segment().buf
+        base = self._offset(provider) + self._state.size
+        with self._lock:
+            buf[base : base + self._bucket.size * BUCKETS] = bytes(
+                self._bucket.size * BUCKETS
+            )
+
+    def reset(self):
+        buf = self._segment().buf
+        with self._lock:
+            buf[: self._size] = bytes(self._size)
+
+
+class RedisStore:
+    """Breaker states and outcome counters in Redis, for every host of the deployment."""
+
+    def __init__(self, url: str, prefix: str = "circuit_breaker"):
+        """
+        Initialize the store.
+
+        Args:
+            url (str): The Redis connection URL.
+            prefix (str): Prefix of the Redis keys.
+        """
+        import redis
+
+        self.prefix = prefix
+        self.client = redis.Redis.from_url(url)
+        self._record_script = self.client.register_script(_RECORD_SCRIPT)
+
+    def _key(self, provider: str) -> str:
+        return f"{self.prefix}:{provider}"
+
+    def _outcomes_key(self, provider: str) -> str:
+        return f"{self.prefix}:{provider}:outcomes"
+
+    def get(self, provider: str) -> dict:
+        raw = self.client.get(self._key(provider))
+        return json.loads(raw) if raw else _initial_state()
+
+    def get_many(self, providers: list) -> list:
+        raws = self.client.mget([self._key(provider) for provider in providers])
+        return [json.loads(raw) if raw else _initial_state() for raw in raws]
+
+    def update(self, provider: str, transition):
+        """Apply ``transition(state) -> (state, result)`` atomically."""
+        key = self._key(provider)
+
+        def run(pipe):
+            raw = pipe.get(key)
+            state, result = transition(json.loads(raw) if raw else _initial_state())
+            pipe.multi()
+            pipe.set(key, json.dumps(state))
+            return result
+
+        return self.client.transaction(run, key, value_from_callable=True)
+
+    def record(self, provider: str, ok: bool, bucket: int, ttl: float = 3600) -> tuple:
+        """
+        Count the outcome of a call in a bucket, in a single round trip.
+
+        Args:
+            provider (str): The provider of the call.
+            ok (bool): Whether the call succeeded.
+            bucket (int): Index of the bucket of the call.
+            ttl (float): Seconds the counters are kept without calls.
+
+        Returns:
+            tuple: The number of calls and failures of the last ``BUCKETS``
+                buckets.
+        """
+        calls, failures = self._record_script(
+            keys=[self._outcomes_key(provider)],
+            args=[bucket, int(ok), BUCKETS, max(1, math.ceil(ttl))],
+        )
+        return int(calls), int(failures)
+
+    def clear_outcomes(self, provider: str):
+        self.client.delete(self._outcomes_key(provider))
+
+    def reset(self):
+        keys = list(self.client.scan_iter(f"{self.prefix}:*"))
+        if keys:
+            self.client.delete(*keys)
+
+
+class CircuitBreakers:
+    """
+    Circuit breakers of the LLM providers.
+
+    A closed circuit lets every call through and tracks the outcomes of the calls
+    of the last ``window`` seconds. It opens when at least ``failure_rate`` of
+    them failed (out of ``min_calls`` or more): calls are then refused for
+    ``open_timeout`` seconds. The circuit then turns half-open and lets a single
+    probe call through, which closes it on success and opens it again on failure.
+    """
+
+    def __init__(
+        self,
+        store,
+        failure_rate: float = 0.5,
+        min_calls: int = 5,
+        window: float = 60.0,
+        open_timeout: float = 30.0,
+    ):
+        """
+        Initialize the breakers.
+
+        Args:
+            store (SharedMemoryStore | RedisStore): Storage of the states.
+            failure_rate (float): Failure rate over the window opening a circuit.
+            min_calls (int): Calls needed in the window to compute the failure rate.
+            window (float): Seconds of outcomes taken into account.
+            open_timeout (float): Seconds a circuit stays open before a probe, and
+                after which a probe that never reported is replaced.
+        """
+        self.store = store
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.open_timeout = open_timeout
+
+    def state(self, provider: str) -> str:
+        """Current state of the circuit of a provider."""
+        return self.store.get(provider)["state"]
+
+    def _accepts(self, state: dict, now: float) -> bool:
+        if state["state"] == CLOSED:
+            return True
+        if state["state"] == OPEN:
+            return now - state["opened_at"] >= self.open_timeout
+        return now - state["probe_at"] >= self.open_timeout
+
+    def available(self, providers: list) -> list:
+        """
+        Filter the providers whose circuit would let a call through.
+
+        Args:
+            providers (list): Candidate providers.
+
+        Returns:
+            list: The candidates in the same order, without those refusing calls.
+        """
+        now = time.time()
+        states = self.store.get_many(providers)
+        return [p for p, state in zip(providers, states) if self._accepts(state, now)]
+
+    def allow(self, provider: str) -> bool:
+        """
+        Ask the permission to call a provider.
+
+        A closed circuit is only read. Otherwise, the first caller after the
+        timeout takes the probe of the half-open circuit, in a transaction.
+
+        Args:
+            provider (str): The provider name.
+
+        Returns:
+            bool: Whether the call may be sent.
+        """
+        state = self.store.get(provider)
+        if state["state"] == CLOSED:
+            return True
+        if not self._accepts(state, time.time()):
+            return False
+
+        def transition(state):
+            now = time.time()
+            if not self._accepts(state, now):
+                return state, False
+            if state["state"] != CLOSED:
+                state["state"] = HALF_OPEN
+                state["probe_at"] = now
+            return state, True
+
+        return self.store.update(provider, transition)
+
+    def _bucket(self, now: float) -> int:
+        return int(now // (self.window / BUCKETS))
+
+    def record(self, provider: str, ok: bool):
+        """
+        Record the outcome of a call.
+
+        Outcomes of a closed circuit only update counters; transactions are
+        taken when the circuit opens or closes.
+
+        Args:
+            provider (str): The provider of the call.
+            ok (bool): Whether the call succeeded.
+        """
+        try:
+            state = self.store.get(provider)
+            if state["state"] == HALF_OPEN:
+                self._end_probe(provider, ok)
+            elif state["state"] == CLOSED:
+                calls, failures = self.store.record(
+                    provider, ok, self._bucket(time.time())
+                )
+                if calls >= self.min_calls and failures / calls >= self.failure_rate:
+                    self._open(provider, calls, failures)
+        except Exception as e:
+            logger.error(f"Failed to record the outcome of a call: {str(e)}")
+
+    def _end_probe(self, provider: str, ok: bool):
+        def transition(state):
+            if state["state"] != HALF_OPEN:
+                return state, False
+            if ok:
+                return _initial_state(), True
+            state.update(state=OPEN, opened_at=time.time())
+            return state, True
+
+        if self.store.update(provider, transition):
+            if ok:
+                logger.info(f"Circuit of {provider} closed")
+                self.store.clear_outcomes(provider)
+            else:
+                logger.warning(f"Circuit of {provider} opened again")
+
+    def _open(self, provider: str, calls: int, failures: int):
+        def transition(state):
+            if state["state"] != CLOSED:
+                return state, False
+            state.update(state=OPEN, opened_at=time.time())
+            return state, True
+
+        if self.store.update(provider, transition):
+            logger.warning(f"Circuit of {provider} opened: {failures}/{calls} failures")
+            self.store.clear_outcomes(provider)
+
+    def reset(self):
+        """Close every circuit."""
+        self.store.reset()
+
+
+_breakers = None
+
+
+def _reset_after_fork():
+    global _breakers
+    _breakers = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_circuit_breakers() -> CircuitBreakers:
+    """
+    Get the circuit breakers, or None if ``CIRCUIT_BREAKER`` is ``off``.
+
+    States live in Redis when ``REDIS_URL`` is set, in shared memory otherwise.
+    ``CIRCUIT_FAILURE_RATE``, ``CIRCUIT_MIN_CALLS``, ``CIRCUIT_WINDOW`` and
+    ``CIRCUIT_OPEN_TIMEOUT`` configure them.
+
+    Returns:
+        CircuitBreakers: The breakers.
+    """
+    global _breakers
+    if os.getenv("CIRCUIT_BREAKER", "on") == "off":
+        return None
+    if _breakers is None:
+        if "REDIS_URL" in os.environ:
+            store = RedisStore(os.environ["REDIS_URL"])
+        else:
+            store = SharedMemoryStore()
+        _breakers = CircuitBreakers(
+            store,
+            failure_rate=float(os.getenv("CIRCUIT_FAILURE_RATE", 0.5)),
+            min_calls=int(os.getenv("CIRCUIT_MIN_CALLS", 5)),
+            window=float(os.getenv("CIRCUIT_WINDOW", 60)),
+            open_timeout=float(os.getenv("CIRCUIT_OPEN_TIMEOUT", 30)),
+        )
+    return _breakers
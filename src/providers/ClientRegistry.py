@@ -0,0 +1,98 @@
+import atexit
+import json
+import os
+import threading
+
+from src.Logger import Logger
+from src.providers.EventLoop import run_sync
+from src.providers.ProviderAdapters import ProviderAdapter, create_adapter
+
+# Number of keep-alive connections per provider. OpenAI and Replicate serve many
+# concurrent calls over HTTPS, while the local Ollama server handles a few at a time.
+DEFAULT_POOL_SIZES = {"openai": 32, "replicate": 32, "ollama": 8}
+
+logger = Logger(__name__).get_logger()
+
+_adapters = {}
+_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    """
+    Drop the adapters inherited from the parent process.
+
+    Their connections (and the event loop they are bound to) belong to the parent,
+    so the child builds its own on first use.
+    """
+    global _lock
+    _adapters.clear()
+    _lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def pool_sizes() -> dict:
+    """
+    Get the size of the connection pool of every provider.
+
+    ``PROVIDER_POOL_SIZES`` may override the defaults with a JSON object, e.g.
+    ``{"openai": 64}``.
+
+    Returns:
+        dict: Pool size per provider.
+    """
+    sizes = dict(DEFAULT_POOL_SIZES)
+    sizes.update(json.loads(os.getenv("PROVIDER_POOL_SIZES", "{}")))
+    return sizes
+
+
+def get_adapter(provider: str, prepare=None) -> ProviderAdapter:
+    """
+    Get the adapter of a provider, shared by every Chat of the process.
+
+    The adapter (and its HTTP connection pool) is created on first use. ``prepare``
+    runs once before that, to load credentials or start a local server.
+
+    Args:
+        provider (str): The provider name.
+        prepare (callable, optional): Setup to run before creating the adapter.
+
+    Returns:
+        ProviderAdapter: The pooled adapter.
+    """
+    adapter = _adapters.get(provider)
+    if adapter is None:
+        with _lock:
+            adapter = _adapters.get(provider)
+            if adapter is None:
+                if prepare is not None:
+                    prepare()
+                size = pool_sizes().get(provider, 10)
+                adapter = create_adapter(provider, pool_size=size)
+                logger.info(f"Created {provider} client with a pool of {size}")
+                _adapters[provider] = adapter
+    return adapter
+
+
+async def aclose_adapters():
+    """Close the connection pools of every adapter of the process."""
+    with _lock:
+        adapters = list(_adapters.values())
+        _adapters.clear()
+    for adapter in adapters:
+        await adapter.aclose()
+
+
+def _close_at_exit():
+    """Close the connection pools on the shared event loop when the process exits."""
+    if not _adapters:
+        return
+    try:
+        run_sync(aclose_adapters(), timeout=5)
+    except Exception as e:
+        logger.warning(f"Failed to close the provider clients: {str(e)}")
+
+
+atexit.register(_close_at_exit)
@@ -0,0 +1,75 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import Future
+
+_loop = None
+_thread = None
+_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    """Forget the parent's loop: its thread does not exist in the child."""
+    global _loop, _thread, _lock
+    _loop = None
+    _thread = None
+    _lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """
+    Get the event loop shared by every LLM call of the process.
+
+    The loop runs forever in a daemon thread, so synchronous callers (Dash
+    callbacks, Celery tasks) can submit coroutines to it and many calls are
+    multiplexed over a single thread.
+
+    Returns:
+        asyncio.AbstractEventLoop: The running event loop.
+    """
+    global _loop, _thread
+    if _loop is None:
+        with _lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                _thread = threading.Thread(
+                    target=loop.run_forever, name="provider-event-loop", daemon=True
+                )
+                _thread.start()
+                _loop = loop
+    return _loop
+
+
+def submit(coro) -> Future:
+    """
+    Schedule a coroutine on the shared event loop without waiting for it.
+
+    Args:
+        coro: The coroutine to run.
+
+    Returns:
+        concurrent.futures.Future: The future of its result.
+    """
+    loop = get_loop()
+    if threading.current_thread() is _thread:
+        coro.close()
+        raise RuntimeError("submit cannot be called from the shared event loop")
+    return asyncio.run_coroutine_threadsafe(coro, loop)
+
+
+def run_sync(coro, timeout: float = None):
+    """
+    Run a coroutine on the shared event loop and wait for its result.
+
+    Args:
+        coro: The coroutine to run.
+        timeout (float, optional): Maximum number of seconds to wait.
+
+    Returns:
+        The result of the coroutine.
+    """
+    return submit(coro).result(timeout)
@@ -0,0 +1,154 @@
+import asyncio
+import os
+
+from src.Logger import Logger
+from src.providers.ProviderScheduler import percentile
+
+logger = Logger(__name__).get_logger()
+
+
+class HedgingPolicy:
+    """
+    Decides when a late LLM call is duplicated on another provider.
+
+    A call is hedged when its provider has not produced a first token (or, without
+    streaming, the whole answer) after a high percentile of its recent latencies.
+    Only the slowest few percents of the calls are duplicated, which cuts the tail
+    latency for a small amount of extra load.
+    """
+
+    def __init__(
+        self,
+        percentile: float = 95,
+        min_delay: float = 1.0,
+        max_delay: float = 15.0,
+        min_samples: int = 10,
+    ):
+        """
+        Initialize the policy.
+
+        Args:
+            percentile (float): Percentile of the recent latencies of the primary
+                provider after which the call is hedged.
+            min_delay (float): Lower bound of the hedging delay in seconds.
+            max_delay (float): Upper bound of the hedging delay in seconds, also
+                used until the provider has ``min_samples`` latencies.
+            min_samples (int): Number of latencies needed to trust the percentile.
+        """
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.min_samples = min_samples
+
+    def delay(self, latencies: list) -> float:
+        """
+        Compute the delay after which a call is hedged.
+
+        Args:
+            latencies (list): Recent latencies of the primary provider in seconds.
+
+        Returns:
+            float: The delay in seconds.
+        """
+        if len(latencies) < self.min_samples:
+            return self.max_delay
+        value = percentile(latencies, self.percentile)
+        return min(self.max_delay, max(self.min_delay, value))
+
+
+async def hedge(primary, make_backup, delay: float, on_token=None) -> str:
+    """
+    Run a call, and a backup call if the first one is late, keeping the fastest.
+
+    Calls are coroutine functions taking a chunk callback (``None`` when the answer
+    is not streamed). When streaming, the first call to produce a chunk wins and
+    the other one is cancelled right away, so the chunks of a single call reach
+    ``on_token``. Otherwise, the first call to succeed wins.
+
+    Args:
+        primary (callable): The call to the primary provider.
+        make_backup (callable): Coroutine function returning the call to a backup
+            provider, or None if none is available. Only invoked once ``delay``
+            has elapsed.
+        delay (float): Seconds to wait for the primary call before hedging.
+        on_token (callable, optional): Called with every chunk of the winner.
+
+    Returns:
+        str: The answer of the winner.
+    """
+    owner = []
+    started = asyncio.Event()
+
+    def emitter(name: str):
+        if on_token is None:
+            return None
+
+        def emit(chunk: str):
+            if not owner:
+                owner.append(name)
+                started.set()
+            if owner[0] == name:
+                on_token(chunk)
+
+        return emit
+
+    tasks = {asyncio.create_task(primary(emitter("primary"))): "primary"}
+    started_task = asyncio.create_task(started.wait())
+    hedged = False
+    error = None
+    try:
+        while True:
+            pending = {task for task in tasks if not task.done()}
+            waiting = pending if started.is_set() else pending | {started_task}
+            done, _ = await asyncio.wait(
+                waiting,
+                timeout=None if hedged else delay,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if not done:
+                hedged = True
+                backup = await make_backup()
+                if backup is not None:
+                    logger.info(f"Hedging a call still pending after {delay:.1f}s")
+                    tasks[asyncio.create_task(backup(emitter("backup")))] = "backup"
+                continue
+
+            if started.is_set():
+                # A stream started: stick to it and drop the other call
+                winner = next(t for t, name in tasks.items() if name == owner[0])
+                for task in tasks:
+                    if task is not winner:
+                        task.cancel()
+                return await winner
+
+            for task in done - {started_task}:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+                logger.warning(f"Hedged {tasks[task]} call failed: {str(error)}")
+            if not hedged or all(task.done() for task in tasks):
+                raise error
+    finally:
+        started_task.cancel()
+        for task in tasks:
+            task.cancel()
+
+
+def get_hedging_policy() -> HedgingPolicy:
+    """
+    Get the hedging policy, or None unless ``HEDGING`` is ``on``.
+
+    ``HEDGE_PERCENTILE``, ``HEDGE_MIN_DELAY``, ``HEDGE_MAX_DELAY`` and
+    ``HEDGE_MIN_SAMPLES`` configure it.
+
+    Returns:
+        HedgingPolicy: The policy.
+    """
+    if os.getenv("HEDGING", "off") != "on":
+        return None
+    return HedgingPolicy(
+        percentile=float(os.getenv("HEDGE_PERCENTILE", 95)),
+        min_delay=float(os.getenv("HEDGE_MIN_DELAY", 1.0)),
+        max_delay=float(os.getenv("HEDGE_MAX_DELAY", 15.0)),
+        min_samples=int(os.getenv("HEDGE_MIN_SAMPLES", 10)),
+    )
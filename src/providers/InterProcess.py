@@ -0,0 +1,75 @@
+import hashlib
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non POSIX platforms
+    fcntl = None
+
+# Root of the project, which the shared state of its processes belongs to
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class InterProcessLock:
+    """
+    Exclusive lock shared by every process of the application.
+
+    The lock file is only used as a mutex (it is never written), and the file
+    descriptor is kept open per process so that acquiring the lock costs a single
+    ``flock`` syscall. The descriptor is reopened after a fork because ``flock``
+    locks are attached to the open file description, which a forked child shares
+    with its parent.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._thread_lock = threading.Lock()
+        self._fd = None
+        self._pid = None
+
+    def _ensure_fd(self):
+        if self._fd is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._pid = os.getpid()
+            # A fresh lock per process: the parent's thread lock may have been
+            # copied in a locked state.
+            self._thread_lock = threading.Lock()
+
+    def __enter__(self):
+        self._ensure_fd()
+        self._thread_lock.acquire()
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._thread_lock.release()
+
+
+def segment_name(name: str) -> str:
+    """
+    Name of a shared memory segment of this deployment.
+
+    Segment names are global to the host: they are prefixed with
+    ``SHARED_MEMORY_NAMESPACE``, or a hash of the path of the project, so that two
+    checkouts of the app on a host do not share their leases and breakers.
+
+    Args:
+        name (str): Name of the segment within the deployment.
+
+    Returns:
+        str: The name of the segment on the host, short enough for macOS.
+    """
+    namespace = os.getenv("SHARED_MEMORY_NAMESPACE")
+    if not namespace:
+        namespace = hashlib.sha1(ROOT.encode()).hexdigest()[:10]
+    return f"pe_{namespace}_{name}"
+
+
+def scratch_path(name: str) -> str:
+    """Path of a file of the scratch directory of the project."""
+    return os.path.join(ROOT, "scratch", name)
@@ -0,0 +1,234 @@
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from typing import AsyncIterator
+
+import httpx
+import ollama
+import replicate
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+# max_tokens is the maximum number of output tokens (None: provider default) and
+# stop the sequences ending the answer.
+GenerationParams = namedtuple(
+    "GenerationParams",
+    ["temperature", "repeat_penalty", "top_k", "top_p", "max_tokens", "stop"],
+    defaults=[None, ()],
+)
+
+
+def pool_limits(pool_size: int) -> httpx.Limits:
+    """
+    Connection pool limits of a provider client.
+
+    Args:
+        pool_size (int): Maximum number of connections, all of them kept alive.
+
+    Returns:
+        httpx.Limits: The limits.
+    """
+    return httpx.Limits(
+        max_connections=pool_size,
+        max_keepalive_connections=pool_size,
+        keepalive_expiry=60.0,
+    )
+
+
+class ProviderAdapter(ABC):
+    """Abstract base class for the asynchronous clients of the LLM providers."""
+
+    name = None
+    model = None
+
+    def __init__(self, pool_size: int = 10):
+        """
+        Initialize the adapter.
+
+        Args:
+            pool_size (int): Size of the HTTP keep-alive connection pool.
+        """
+        self.pool_size = pool_size
+
+    async def aclose(self):
+        """Close the connections of the underlying client."""
+        pass
+
+    @abstractmethod
+    def stream(self, messages: list, params: GenerationParams) -> AsyncIterator[str]:
+        """
+        Generate an answer chunk by chunk.
+
+        Args:
+            messages (list): The messages as ``{"role": ..., "content": ...}`` dicts.
+            params (GenerationParams): The sampling parameters.
+
+        Returns:
+            AsyncIterator[str]: The chunks of the answer.
+        """
+        pass
+
+    async def complete(self, messages: list, params: GenerationParams) -> str:
+        """
+        Generate a whole answer.
+
+        Args:
+            messages (list): The messages as ``{"role": ..., "content": ...}`` dicts.
+            params (GenerationParams): The sampling parameters.
+
+        Returns:
+            str: The answer.
+        """
+        return "".join([chunk async for chunk in self.stream(messages, params)])
+
+
+class OpenAIAdapter(ProviderAdapter):
+    """OpenAI chat completions through ``AsyncOpenAI``."""
+
+    name = "openai"
+    model = "gpt-4o-mini"
+
+    def __init__(self, pool_size: int = 10):
+        super().__init__(pool_size)
+        self.client = AsyncOpenAI(
+            http_client=DefaultAsyncHttpxClient(limits=pool_limits(pool_size))
+        )
+
+    async def aclose(self):
+        await self.client.close()
+
+    def _request(self, messages: list, params: GenerationParams, stream: bool):
+        limits = {}
+        if params.max_tokens is not None:
+            limits["max_tokens"] = params.max_tokens
+        if params.stop:
+            # OpenAI accepts up to 4 stop sequences
+            limits["stop"] = list(params.stop)[:4]
+        return self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=params.temperature,
+            top_p=params.top_p,
+            frequency_penalty=params.repeat_penalty,
+            presence_penalty=0,
+            stream=stream,
+            **limits,
+        )
+
+    async def stream(self, messages: list, params: GenerationParams):
+        completion = await self._request(messages, params, stream=True)
+        async for chunk in completion:
+            if chunk.choices and chunk.choices[0].delta.content is not None:
+                yield chunk.choices[0].delta.content
+
+    async def complete(self, messages: list, params: GenerationParams) -> str:
+        completion = await self._request(messages, params, stream=False)
+        return completion.choices[0].message.content
+
+
+class ReplicateAdapter(ProviderAdapter):
+    """Replicate predictions through the asynchronous API of ``replicate``."""
+
+    name = "replicate"
+    model = "meta/meta-llama-3-8b-instruct"
+
+    def __init__(self, pool_size: int = 10):
+        super().__init__(pool_size)
+        # Extra keyword arguments are forwarded to the httpx clients.
+        self.client = replicate.Client(limits=pool_limits(pool_size))
+
+    @staticmethod
+    def _input(messages: list, params: GenerationParams) -> dict:
+        formatted_prompt = ""
+        for msg in messages:
+            formatted_prompt += f"{msg['role']}: {msg['content']}\n"
+        formatted_prompt += "assistant: "
+        model_input = {
+            "prompt": formatted_prompt,
+            "temperature": params.temperature,
+            "top_p": params.top_p,
+            "max_new_tokens": params.max_tokens or 500,
+            "repetition_penalty": params.repeat_penalty,
+        }
+        if params.stop:
+            model_input["stop_sequences"] = ",".join(params.stop)
+        return model_input
+
+    async def stream(self, messages: list, params: GenerationParams):
+        events = await self.client.async_stream(
+            self.model, input=self._input(messages, params)
+        )
+        async for event in events:
+            # Only output events carry text, the others render as ""
+            text = str(event)
+            if text:
+                yield text
+
+    async def complete(self, messages: list, params: GenerationParams) -> str:
+        output = await self.client.async_run(
+            self.model, input=self._input(messages, params)
+        )
+        if isinstance(output, str):
+            return output
+        if hasattr(output, "__aiter__"):
+            return "".join([chunk async for chunk in output])
+        return "".join(output)
+
+
+class OllamaAdapter(ProviderAdapter):
+    """Local Ollama server through ``ollama.AsyncClient``."""
+
+    name = "ollama"
+    model = "llama3:instruct"
+
+    def __init__(self, pool_size: int = 10):
+        super().__init__(pool_size)
+        # Extra keyword arguments are forwarded to the httpx client.
+        self.client = ollama.AsyncClient(limits=pool_limits(pool_size))
+
+    async def aclose(self):
+        await self.client._client.aclose()
+
+    def _request(self, messages: list, params: GenerationParams, stream: bool):
+        options = {
+            "temperature": params.temperature,
+            "repeat_penalty": params.repeat_penalty,
+            "top_k": params.top_k,
+            "top_p": params.top_p,
+        }
+        if params.max_tokens is not None:
+            options["num_predict"] = params.max_tokens
+        if params.stop:
+            options["stop"] = list(params.stop)
+        return self.client.chat(
+            model=self.model, messages=messages, options=options, stream=stream
+        )
+
+    async def stream(self, messages: list, params: GenerationParams):
+        async for response in await self._request(messages, params, stream=True):
+            yield response["message"]["content"]
+
+    async def complete(self, messages: list, params: GenerationParams) -> str:
+        response = await self._request(messages, params, stream=False)
+        return response["message"]["content"]
+
+
+ADAPTERS = {
+    "openai": OpenAIAdapter,
+    "replicate": ReplicateAdapter,
+    "ollama": OllamaAdapter,
+}
+
+
+def create_adapter(provider: str, pool_size: int = 10) -> ProviderAdapter:
+    """
+    Create the adapter of a provider.
+
+    Args:
+        provider (str): The provider name.
+        pool_size (int): Size of the HTTP keep-alive connection pool.
+
+    Returns:
+        ProviderAdapter: The adapter.
+    """
+    if provider not in ADAPTERS:
+        raise ValueError("Invalid provider. Choose 'ollama', 'replicate', or 'openai'.")
+    return ADAPTERS[provider](pool_size=pool_size)
@@ -0,0 +1,910 @@
+import json
+import math
+import os
+import socket
+import struct
+import threading
+import time
+import uuid
+from collections import namedtuple
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+
+from src.Logger import Logger
+from src.providers.InterProcess import InterProcessLock, scratch_path, segment_name
+from src.providers.RoutingPolicy import ProviderStats, PriorityPolicy, load_policy
+
+PROVIDERS = ["openai", "replicate", "ollama"]
+DEFAULT_CAPACITY = 3
+DEFAULT_LEASE_TTL = 30.0
+DEFAULT_STATS_ALPHA = 0.2
+LATENCY_WINDOW = 64
+
+logger = Logger(__name__).get_logger()
+
+
+Lease = namedtuple(
+    "Lease", ["lease_id", "provider", "pid", "host", "started_at", "expires_at"]
+)
+
+
+def _pid_alive(pid: int) -> bool:
+    """Check whether a process of this host is still running."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def percentile(values: list, q: float) -> float:
+    """
+    Nearest-rank percentile of a list of values.
+
+    Args:
+        values (list): The values.
+        q (float): The percentile, between 0 and 100.
+
+    Returns:
+        float: The percentile, or 0.0 for an empty list.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class SharedMemoryBackend:
+    """
+    In-flight leases and provider statistics stored in a named shared memory segment.
+
+    The segment starts with one signed 64-bit counter per provider, followed by one
+    statistics block per provider (latency and error EWMAs and a ring buffer of the
+    latest latencies), by one ring buffer of the latest first-token latencies per
+    provider and by a fixed table of lease records (provider, pid, generation,
+    start and expiry times). Opening or closing a lease updates one
+    record and one counter under a short inter-process lock, so the Dash server and
+    every background callback process on the host see the same values.
+    """
+
+    _record = struct.Struct("<iiqdd")
+    _counter = struct.Struct("<q")
+    _stats = struct.Struct("<ddqq" + "d" * LATENCY_WINDOW)
+    _ring = struct.Struct("<qq" + "d" * LATENCY_WINDOW)
+
+    def __init__(
+        self,
+        providers: list = PROVIDERS,
+        name: str = None,
+        lock_path: str = None,
+        max_leases: int = 1024,
+    ):
+        """
+        Initialize the backend.
+
+        Args:
+            providers (list): Names of the providers to keep leases for.
+            name (str, optional): Name of the shared memory segment. Defaults to
+                one of its own per project (see ``segment_name``).
+            lock_path (str, optional): Path of the file used as inter-process
+                mutex. Defaults to ``scratch/provider_scheduler.lock`` in the
+                project.
+            max_leases (int): Number of lease records in the table.
+        """
+        self.providers = list(providers)
+        self.name = name or segment_name("providers_v4")
+        self.max_leases = max_leases
+        self._index = {p: i for i, p in enumerate(self.providers)}
+        # Counters, the slot where the next free-record search starts, statistics,
+        # first-token latencies.
+        self._stats_offset = self._counter.size * (len(self.providers) + 1)
+        self._first_tokens_offset = self._stats_offset + self._stats.size * len(
+            self.providers
+        )
+        self._table_offset = self._first_tokens_offset + self._ring.size * len(
+            self.providers
+        )
+        self._size = self._table_offset + self._record.size * max_leases
+        self._lock = InterProcessLock(
+            lock_path or scratch_path("provider_scheduler.lock")
+        )
+        self._host = socket.gethostname()
+        self._shm = None
+
+    def _segment(self) -> shared_memory.SharedMemory:
+        """Attach to the shared memory segment, creating it if needed."""
+        if self._shm is None:
+            with self._lock:
+                try:
+                    shm = shared_memory.SharedMemory(name=self.name)
+                except FileNotFoundError:
+                    shm = shared_memory.SharedMemory(
+                        name=self.name, create=True, size=self._size
+                    )
+                    self._clear(shm.buf)
+            # The segment must outlive the process that created it: background
+            # callback processes come and go while the leases stay valid.
+            resource_tracker.unregister(shm._name, "shared_memory")
+            self._shm = shm
+        return self._shm
+
+    def _clear(self, buf):
+        buf[: self._table_offset] = bytes(self._table_offset)
+        free = self._record.pack(-1, 0, 0, 0.0, 0.0)
+        buf[self._table_offset : self._size] = free * self.max_leases
+
+    def _record_offset(self, slot: int) -> int:
+        return self._table_offset + slot * self._record.size
+
+    def _add_to_counter(self, buf, index: int, delta: int):
+        offset = index * self._counter.size
+        (value,) = self._counter.unpack_from(buf, offset)
+        self._counter.pack_into(buf, offset, max(0, value + delta))
+
+    def _to_lease(self, slot: int, record: tuple) -> Lease:
+        index, pid, generation, started_at, expires_at = record
+        return Lease(
+            f"{slot}:{generation}",
+            self.providers[index],
+            pid,
+            self._host,
+            started_at,
+            expires_at,
+        )
+
+    def open_lease(self, provider: str, ttl: float):
+        """
+        Open a lease on a provider.
+
+        Args:
+            provider (str): The provider name.
+            ttl (float): Seconds before the lease expires without a heartbeat.
+
+        Returns:
+            Lease: The new lease, or None if the lease table is full.
+        """
+        buf = self._segment().buf
+        hint_offset = self._counter.size * len(self.providers)
+        now = time.time()
+        with self._lock:
+            (hint,) = self._counter.unpack_from(buf, hint_offset)
+            for i in range(self.max_leases):
+                slot = (hint + i) % self.max_leases
+                record = self._record.unpack_from(buf, self._record_offset(slot))
+                if record[0] == -1:
+                    break
+            else:
+                return None
+            record = (self._index[provider], os.getpid(), record[2] + 1, now, now + ttl)
+            self._record.pack_into(buf, self._record_offset(slot), *record)
+            self._add_to_counter(buf, record[0], 1)
+            self._counter.pack_into(buf, hint_offset, (slot + 1) % self.max_leases)
+        return self._to_lease(slot, record)
+
+    def _locate(self, buf, lease: Lease):
+        """Return the record of a lease if it is still the owner of its slot."""
+        slot, generation = (int(x) for x in lease.lease_id.split(":"))
+        record = self._record.unpack_from(buf, self._record_offset(slot))
+        if record[0] == -1 or record[2] != generation:
+            return slot, None
+        return slot, record
+
+    def renew_lease(self, lease: Lease, ttl: float) -> bool:
+        """
+        Push back the expiry of a lease.
+
+        Args:
+            lease (Lease): The lease to renew.
+            ttl (float): Seconds before the lease expires without a heartbeat.
+
+        Returns:
+            bool: False if the lease has already been reclaimed.
+        """
+        buf = self._segment().buf
+        with self._lock:
+            slot, record = self._locate(buf, lease)
+            if record is None:
+                return False
+            record = record[:4] + (time.time() + ttl,)
+            self._record.pack_into(buf, self._record_offset(slot), *record)
+        return True
+
+    def _free(self, buf, slot: int, record: tuple):
+        self._record.pack_into(
+            buf, self._record_offset(slot), -1, 0, record[2], 0.0, 0.0
+        )
+        self._add_to_counter(buf, record[0], -1)
+
+    def close_lease(self, lease: Lease):
+        """Close a lease, unless it has already been reclaimed."""
+        buf = self._segment().buf
+        with self._lock:
+            slot, record = self._locate(buf, lease)
+            if record is not None:
+                self._free(buf, slot, record)
+
+    def reap(self) -> list:
+        """
+        Reclaim the leases that expired or whose process is gone.
+
+        Returns:
+            list: The reclaimed leases.
+        """
+        buf = self._segment().buf
+        now = time.time()
+        reaped = []
+        with self._lock:
+            for slot in range(self.max_leases):
+                record = self._record.unpack_from(buf, self._record_offset(slot))
+                if record[0] == -1:
+                    continue
+                if record[4] < now or not _pid_alive(record[1]):
+                    reaped.append(self._to_lease(slot, record))
+                    self._free(buf, slot, record)
+        return reaped
+
+    def leases(self) -> list:
+        """
+        List the open leases.
+
+        Returns:
+            list: Every lease currently in the table.
+        """
+        buf = self._segment().buf
+        leases = []
+        for slot in range(self.max_leases):
+            record = self._record.unpack_from(buf, self._record_offset(slot))
+            if record[0] != -1:
+                leases.append(self._to_lease(slot, record))
+        return leases
+
+    def _stats_offset_of(self, provider: str) -> int:
+        return self._stats_offset + self._index[provider] * self._stats.size
+
+    def _first_tokens_offset_of(self, provider: str) -> int:
+        return self._first_tokens_offset + self._index[provider] * self._ring.size
+
+    def record(
+        self,
+        provider: str,
+        latency: float,
+        ok: bool,
+        alpha: float,
+        first_token: float = None,
+    ):
+        """
+        Add the outcome of a call to the statistics of its provider.
+
+        Args:
+            provider (str): The provider name.
+            latency (float): Duration of the call in seconds.
+            ok (bool): Whether the call succeeded.
+            alpha (float): Smoothing factor of the EWMAs.
+            first_token (float, optional): Seconds until the first token of a
+                streamed call.
+        """
+        buf = self._segment().buf
+        offset = self._stats_offset_of(provider)
+        with self._lock:
+            if ok and first_token is not None:
+                ring_offset = self._first_tokens_offset_of(provider)
+                samples, position, *window = self._ring.unpack_from(buf, ring_offset)
+                window[position] = first_token
+                position = (position + 1) % LATENCY_WINDOW
+                self._ring.pack_into(buf, ring_offset, samples + 1, position, *window)
+            ewma_latency, error_rate, samples, position, *window = (
+                self._stats.unpack_from(buf, offset)
+            )
+            error_rate = (1 - alpha) * error_rate + alpha * (0.0 if ok else 1.0)
+            if ok:
+                ewma_latency = (
+                    latency
+                    if not samples
+                    else (1 - alpha) * ewma_latency + alpha * latency
+                )
+                window[position] = latency
+                position = (position + 1) % LATENCY_WINDOW
+                samples += 1
+            self._stats.pack_into(
+                buf, offset, ewma_latency, error_rate, samples, position, *window
+            )
+
+    def latencies(self, provider: str, first_token: bool = False) -> list:
+        """
+        Get the latest latencies of a provider.
+
+        Args:
+            provider (str): The provider name.
+            first_token (bool): Whether to get the first-token latencies of the
+                streamed calls instead of the durations of the calls.
+
+        Returns:
+            list: Up to LATENCY_WINDOW latencies in seconds.
+        """
+        buf = self._segment().buf
+        if first_token:
+            samples, _, *window = self._ring.unpack_from(
+                buf, self._first_tokens_offset_of(provider)
+            )
+        else:
+            _, _, samples, _, *window = self._stats.unpack_from(
+                buf, self._stats_offset_of(provider)
+            )
+        return window[: min(samples, LATENCY_WINDOW)]
+
+    def stats(self) -> dict:
+        """
+        Read the statistics of every provider.
+
+        Returns:
+            dict: ProviderStats per provider.
+        """
+        buf = self._segment().buf
+        stats = {}
+        for provider in self.providers:
+            ewma_latency, error_rate, samples, _, *window = self._stats.unpack_from(
+                buf, self._stats_offset_of(provider)
+            )
+            stats[provider] = ProviderStats(
+                ewma_latency,
+                percentile(window[: min(samples, LATENCY_WINDOW)], 95),
+                error_rate,
+                samples,
+            )
+        return stats
+
+    def counts(self) -> dict:
+        """
+        Read every counter.
+
+        Returns:
+            dict: Number of open leases per provider.
+        """
+        buf = self._segment().buf
+        return {
+            p: self._counter.unpack_from(buf, i * self._counter.size)[0]
+            for p, i in self._index.items()
+        }
+
+    def reset(self):
+        """Drop every lease."""
+        buf = self._segment().buf
+        with self._lock:
+            self._clear(buf)
+
+
+_RECORD_SCRIPT = """
+local alpha = tonumber(ARGV[3])
+local ok = ARGV[2] == "1"
+local error_rate = tonumber(redis.call("HGET", KEYS[1], "error_rate") or "0")
+local error_value = 1
+if ok then error_value = 0 end
+redis.call("HSET", KEYS[1], "error_rate", (1 - alpha) * error_rate + alpha * error_value)
+if ok then
+    local latency = tonumber(ARGV[1])
+    local samples = tonumber(redis.call("HGET", KEYS[1], "samples") or "0")
+    local ewma = latency
+    if samples > 0 then
+        ewma = (1 - alpha) * tonumber(redis.call("HGET", KEYS[1], "ewma_latency")) + alpha * latency
+    end
+    redis.call("HSET", KEYS[1], "ewma_latency", ewma, "samples", samples + 1)
+    redis.call("LPUSH", KEYS[2], ARGV[1])
+    redis.call("LTRIM", KEYS[2], 0, tonumber(ARGV[4]) - 1)
+    if ARGV[5] ~= "" then
+        redis.call("LPUSH", KEYS[3], ARGV[5])
+        redis.call("LTRIM", KEYS[3], 0, tonumber(ARGV[4]) - 1)
+    end
+end
+"""
+
+
+class RedisBackend:
+    """
+    In-flight leases stored in Redis, shared by every host of the deployment.
+
+    Each provider has a sorted set of lease ids scored by expiry time, so counting
+    the live leases and dropping the expired ones are single range commands. Lease
+    details are kept in a companion hash for inspection.
+    """
+
+    def __init__(
+        self, url: str, providers: list = PROVIDERS, key: str = "provider_scheduler"
+    ):
+        """
+        Initialize the backend.
+
+        Args:
+            url (str): The Redis connection URL.
+            providers (list): Names of the providers to keep leases for.
+            key (str): Prefix of the Redis keys.
+        """
+        import redis
+
+        self.providers = list(providers)
+        self.key = key
+        self.client = redis.Redis.from_url(url)
+        self._host = socket.gethostname()
+        self._record_script = self.client.register_script(_RECORD_SCRIPT)
+
+    def _leases_key(self, provider: str) -> str:
+        return f"{self.key}:leases:{provider}"
+
+    @property
+    def _info_key(self) -> str:
+        return f"{self.key}:lease_info"
+
+    def open_lease(self, provider: str, ttl: float) -> Lease:
+        """
+        Open a lease on a provider.
+
+        Args:
+            provider (str): The provider name.
+            ttl (float): Seconds before the lease expires without a heartbeat.
+
+        Returns:
+            Lease: The new lease.
+        """
+        now = time.time()
+        lease = Lease(
+            uuid.uuid4().hex, provider, os.getpid(), self._host, now, now + ttl
+        )
+        pipe = self.client.pipeline()
+        pipe.zadd(self._leases_key(provider), {lease.lease_id: lease.expires_at})
+        pipe.hset(self._info_key, lease.lease_id, json.dumps(lease._asdict()))
+        pipe.execute()
+        return lease
+
+    def renew_lease(self, lease: Lease, ttl: float) -> bool:
+        """
+        Push back the expiry of a lease.
+
+        Args:
+            lease (Lease): The lease to renew.
+            ttl (float): Seconds before the lease expires without a heartbeat.
+
+        Returns:
+            bool: False if the lease has already been reclaimed.
+        """
+        expires_at = time.time() + ttl
+        updated = self.client.zadd(
+            self._leases_key(lease.provider),
+            {lease.lease_id: expires_at},
+            xx=True,
+            ch=True,
+        )
+        return bool(updated)
+
+    def close_lease(self, lease: Lease):
+        """Close a lease."""
+        pipe = self.client.pipeline()
+        pipe.zrem(self._leases_key(lease.provider), lease.lease_id)
+        pipe.hdel(self._info_key, lease.lease_id)
+        pipe.execute()
+
+    def reap(self) -> list:
+        """
+        Reclaim the expired leases.
+
+        Returns:
+            list: The reclaimed leases.
+        """
+        now = time.time()
+        reaped = []
+        for provider in self.providers:
+            key = self._leases_key(provider)
+            for lease_id in self.client.zrangebyscore(key, "-inf", now):
+                # Only the process whose ZREM succeeds reports the lease.
+                if self.client.zrem(key, lease_id):
+                    info = self.client.hget(self._info_key, lease_id)
+                    self.client.hdel(self._info_key, lease_id)
+                    if info:
+                        reaped.append(Lease(**json.loads(info)))
+        return reaped
+
+    def leases(self) -> list:
+        """
+        List the live leases.
+
+        Returns:
+            list: Every lease that has not expired yet.
+        """
+        now = time.time()
+        leases = []
+        for provider in self.providers:
+            entries = self.client.zrangebyscore(
+                self._leases_key(provider), now, "+inf", withscores=True
+            )
+            if not entries:
+                continue
+            infos = self.client.hmget(self._info_key, [e[0] for e in entries])
+            for (_, expires_at), info in zip(entries, infos):
+                if info:
+                    leases.append(
+                        Lease(**{**json.loads(info), "expires_at": expires_at})
+                    )
+        return leases
+
+    def _stats_key(self, provider: str) -> str:
+        return f"{self.key}:stats:{provider}"
+
+    def _latencies_key(self, provider: str) -> str:
+        return f"{self.key}:latencies:{provider}"
+
+    def _first_tokens_key(self, provider: str) -> str:
+        return f"{self.key}:first_tokens:{provider}"
+
+    def record(
+        self,
+        provider: str,
+        latency: float,
+        ok: bool,
+        alpha: float,
+        first_token: float = None,
+    ):
+        """
+        Add the outcome of a call to the statistics of its provider.
+
+        The EWMAs are updated atomically by a Lua script.
+
+        Args:
+            provider (str): The provider name.
+            latency (float): Duration of the call in seconds.
+            ok (bool): Whether the call succeeded.
+            alpha (float): Smoothing factor of the EWMAs.
+            first_token (float, optional): Seconds until the first token of a
+                streamed call.
+        """
+        self._record_script(
+            keys=[
+                self._stats_key(provider),
+                self._latencies_key(provider),
+                self._first_tokens_key(provider),
+            ],
+            args=[
+                latency,
+                int(ok),
+                alpha,
+                LATENCY_WINDOW,
+                "" if first_token is None else first_token,
+            ],
+        )
+
+    def latencies(self, provider: str, first_token: bool = False) -> list:
+        """
+        Get the latest latencies of a provider.
+
+        Args:
+            provider (str): The provider name.
+            first_token (bool): Whether to get the first-token latencies of the
+                streamed calls instead of the durations of the calls.
+
+        Returns:
+            list: Up to LATENCY_WINDOW latencies in seconds.
+        """
+        key = (
+            self._first_tokens_key(provider)
+            if first_token
+            else self._latencies_key(provider)
+        )
+        return [float(v) for v in self.client.lrange(key, 0, -1)]
+
+    def stats(self) -> dict:
+        """
+        Read the statistics of every provider.
+
+        Returns:
+            dict: ProviderStats per provider.
+        """
+        pipe = self.client.pipeline()
+        for provider in self.providers:
+            pipe.hmget(
+                self._stats_key(provider), ["ewma_latency", "error_rate", "samples"]
+            )
+            pipe.lrange(self._latencies_key(provider), 0, -1)
+        results = pipe.execute()
+        stats = {}
+        for i, provider in enumerate(self.providers):
+            ewma_latency, error_rate, samples = results[2 * i]
+            window = [float(v) for v in results[2 * i + 1]]
+            stats[provider] = ProviderStats(
+                float(ewma_latency or 0.0),
+                percentile(window, 95),
+                float(error_rate or 0.0),
+                int(samples or 0),
+            )
+        return stats
+
+    def counts(self) -> dict:
+        """
+        Count the live leases.
+
+        Expired leases are not counted, even before the reaper removes them.
+
+        Returns:
+            dict: Number of live leases per provider.
+        """
+        now = time.time()
+        pipe = self.client.pipeline()
+        for provider in self.providers:
+            pipe.zcount(self._leases_key(provider), now, "+inf")
+        return dict(zip(self.providers, pipe.execute()))
+
+    def reset(self):
+        """Drop every lease."""
+        self.client.delete(
+            self._info_key,
+            *(self._leases_key(p) for p in self.providers),
+            *(self._stats_key(p) for p in self.providers),
+            *(self._latencies_key(p) for p in self.providers),
+            *(self._first_tokens_key(p) for p in self.providers),
+        )
+
+
+class ProviderScheduler:
+    """
+    Chooses a provider for each LLM call and tracks the calls in flight.
+
+    Every call holds a lease on its provider. Leases are renewed by a heartbeat
+    thread while the call runs and expire otherwise, so a worker that dies in the
+    middle of a call cannot leave a provider looking busy forever. The outcome of
+    every call is recorded so that the routing policy can take the observed
+    latencies and error rates into account.
+    """
+
+    def __init__(
+        self,
+        backend,
+        capacity: int = DEFAULT_CAPACITY,
+        lease_ttl: float = DEFAULT_LEASE_TTL,
+        reap_interval: float = 5.0,
+        policy=None,
+        stats_alpha: float = DEFAULT_STATS_ALPHA,
+    ):
+        """
+        Initialize the scheduler.
+
+        Args:
+            backend: Storage of the leases and statistics (shared memory or Redis).
+            capacity (int): Number of concurrent calls a provider serves without
+                queuing.
+            lease_ttl (float): Seconds a lease stays valid without a heartbeat.
+            reap_interval (float): Minimum delay between two reaps triggered by
+                ``select``.
+            policy (RoutingPolicy, optional): Strategy choosing the provider of a
+                call. Defaults to filling providers in order of preference.
+            stats_alpha (float): Smoothing factor of the latency and error EWMAs.
+        """
+        self.backend = backend
+        self.capacity = capacity
+        self.policy = policy or PriorityPolicy(capacity)
+        self.stats_alpha = stats_alpha
+        self.lease_ttl = lease_ttl
+        self.reap_interval = reap_interval
+        self._last_reap = 0.0
+        self._held = {}
+        self._held_lock = threading.Lock()
+        self._pid = None
+
+    def select(self, providers: list) -> str:
+        """
+        Select the provider for the next call with the routing policy.
+
+        Args:
+            providers (list): Candidate providers, by order of preference.
+
+        Returns:
+            str: The selected provider.
+        """
+        if time.time() - self._last_reap > self.reap_interval:
+            self.reap()
+        counts = self.backend.counts()
+        stats = self.backend.stats() if self.policy.uses_stats else {}
+        return self.policy.choose(providers, counts, stats)
+
+    def record(
+        self, provider: str, latency: float, ok: bool, first_token: float = None
+    ):
+        """
+        Record the outcome of a call.
+
+        Args:
+            provider (str): The provider of the call.
+            latency (float): Duration of the call in seconds.
+            ok (bool): Whether the call succeeded.
+            first_token (float, optional): Seconds until the first token, for a
+                streamed call.
+        """
+        try:
+            self.backend.record(
+                provider, latency, ok, self.stats_alpha, first_token=first_token
+            )
+        except Exception as e:
+            logger.error(f"Failed to record the outcome of a call: {str(e)}")
+
+    def stats(self) -> dict:
+        """Return the ProviderStats of every provider."""
+        return self.backend.stats()
+
+    def latencies(self, provider: str, first_token: bool = False) -> list:
+        """
+        Return the latest latencies observed on ``provider``: durations of the
+        calls, or times to the first token of the streamed calls.
+        """
+        return self.backend.latencies(provider, first_token)
+
+    def acquire(self, provider: str) -> Lease:
+        """
+        Open a lease for a new in-flight call on ``provider``.
+
+        Args:
+            provider (str): The provider name.
+
+        Returns:
+            Lease: The lease, kept alive by the heartbeat until released.
+        """
+        lease = self.backend.open_lease(provider, self.lease_ttl)
+        if lease is None:
+            logger.warning(f"Lease table full, call on {provider} is not tracked")
+            return None
+        self._ensure_heartbeat()
+        with self._held_lock:
+            self._held[lease.lease_id] = lease
+        return lease
+
+    def release(self, lease: Lease):
+        """Close the lease of a finished call."""
+        if lease is None:
+            return
+        with self._held_lock:
+            lease = self._held.pop(lease.lease_id, lease)
+        self.backend.close_lease(lease)
+
+    @contextmanager
+    def lease(self, provider: str):
+        """Hold a lease on ``provider`` for the duration of the block."""
+        lease = self.acquire(provider)
+        try:
+            yield lease
+        finally:
+            self.release(lease)
+
+    def heartbeat(self):
+        """Renew every lease held by this process."""
+        with self._held_lock:
+            held = list(self._held.values())
+        for lease in held:
+            if self.backend.renew_lease(lease, self.lease_ttl):
+                continue
+            # The lease was reclaimed while the call was still running (e.g. the
+            # process was suspended): open a new one so the call is counted again.
+            logger.warning(f"Lease {lease.lease_id} on {lease.provider} was reclaimed")
+            replacement = self.backend.open_lease(lease.provider, self.lease_ttl)
+            with self._held_lock:
+                if self._held.pop(lease.lease_id, None) is None:
+                    # Released in the meantime.
+                    if replacement is not None:
+                        self.backend.close_lease(replacement)
+                elif replacement is not None:
+                    self._held[replacement.lease_id] = replacement
+
+    def _ensure_heartbeat(self):
+        """Start the heartbeat thread of this process if needed."""
+        if self._pid == os.getpid():
+            return
+        with self._held_lock:
+            if self._pid == os.getpid():
+                return
+            # Leases inherited through a fork belong to the parent process.
+            self._held = {}
+            self._pid = os.getpid()
+        thread = threading.Thread(
+            target=self._heartbeat_loop, name="lease-heartbeat", daemon=True
+        )
+        thread.start()
+
+    def _heartbeat_loop(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(self.lease_ttl / 3)
+            try:
+                self.heartbeat()
+            except Exception as e:
+                logger.error(f"Lease heartbeat failed: {str(e)}")
+
+    def reap(self) -> int:
+        """
+        Reclaim the leases of calls that stopped sending heartbeats.
+
+        Returns:
+            int: Number of reclaimed leases.
+        """
+        self._last_reap = time.time()
+        reaped = self.backend.reap()
+        for lease in reaped:
+            logger.warning(
+                f"Reclaimed expired lease {lease.lease_id} on {lease.provider} "
+                f"(pid {lease.pid} on {lease.host})"
+            )
+        return len(reaped)
+
+    def leases(self) -> dict:
+        """
+        List the live leases per provider.
+
+        Returns:
+            dict: For each provider, the list of its leases.
+        """
+        leases = {p: [] for p in self.backend.providers}
+        for lease in self.backend.leases():
+            leases[lease.provider].append(lease)
+        return leases
+
+    def counts(self) -> dict:
+        """Return the number of in-flight calls per provider."""
+        return self.backend.counts()
+
+    def reset(self):
+        """Forget every in-flight call (used at application startup)."""
+        self.backend.reset()
+
+
+_scheduler = None
+
+
+def get_scheduler() -> ProviderScheduler:
+    """
+    Get the process-wide scheduler.
+
+    Leases and statistics live in Redis when ``REDIS_URL`` is set (the same instance
+    Celery uses), and in host-local shared memory otherwise. The routing policy is
+    configured by ``ROUTING_POLICY`` and ``ROUTING_POLICY_OPTIONS`` (see
+    ``load_policy``).
+
+    Returns:
+        ProviderScheduler: The scheduler instance.
+    """
+    global _scheduler
+    if _scheduler is None:
+        capacity = int(os.getenv("PROVIDER_CAPACITY", DEFAULT_CAPACITY))
+        lease_ttl = float(os.getenv("PROVIDER_LEASE_TTL", DEFAULT_LEASE_TTL))
+        if "REDIS_URL" in os.environ:
+            backend = RedisBackend(os.environ["REDIS_URL"])
+        else:
+            backend = SharedMemoryBackend()
+        policy = load_policy(capacity)
+        logger.info(
+            f"Provider scheduler using {type(backend).__name__} "
+            f"and {type(policy).__name__}"
+        )
+        _scheduler = ProviderScheduler(
+            backend, capacity=capacity, lease_ttl=lease_ttl, policy=policy
+        )
+    return _scheduler
+
+
+def start_reaper(interval: float = 5.0) -> threading.Thread:
+    """
+    Start a daemon thread reclaiming expired leases every ``interval`` seconds.
+
+    Args:
+        interval (float): Seconds between two reaps.
+
+    Returns:
+        threading.Thread: The reaper thread.
+    """
+
+    def run():
+        scheduler = get_scheduler()
+        while True:
+            try:
+                scheduler.reap()
+            except Exception as e:
+                logger.error(f"Lease reaper failed: {str(e)}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name="lease-reaper", daemon=True)
+    thread.start()
+    return thread
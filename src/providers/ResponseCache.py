@@ -0,0 +1,460 @@
+import asyncio
+import atexit
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from src.Logger import Logger
+
+logger = Logger(__name__).get_logger()
+
+
+class MemoryTier:
+    """Bounded LRU mapping with a time to live, local to the process."""
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600, max_bytes: int = 0):
+        """
+        Initialize the tier.
+
+        Args:
+            max_entries (int): Number of entries kept before the least recently
+                used ones are evicted.
+            ttl (float): Seconds an entry stays valid.
+            max_bytes (int): Size in bytes of the values above which the least
+                recently used ones are evicted, or 0 for no limit.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _size(value) -> int:
+        # Arrays may be views on a buffer: count their data, not the object
+        return getattr(value, "nbytes", None) or sys.getsizeof(value)
+
+    def _pop(self, key: str):
+        value, _ = self._entries.pop(key)
+        self._bytes -= self._size(value)
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.time():
+                self._pop(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value):
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            self._entries[key] = (value, time.time() + self.ttl)
+            self._bytes += self._size(value)
+            while len(self._entries) > self.max_entries or (
+                self.max_bytes and self._bytes > self.max_bytes
+            ):
+                self._pop(next(iter(self._entries)))
+
+    def usage(self) -> dict:
+        """Number of entries and size of their values, with the limits."""
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskTier:
+    """Persistent tier on diskcache, shared by the processes of the host."""
+
+    def __init__(
+        self, directory: str, ttl: float = 3600, size_limit: int = 256 * 1024**2
+    ):
+        """
+        Initialize the tier.
+
+        Args:
+            directory (str): Directory of the diskcache database.
+            ttl (float): Seconds an entry stays valid.
+            size_limit (int): Size in bytes above which diskcache evicts the least
+                recently stored entries.
+        """
+        import diskcache
+
+        self.ttl = ttl
+        self.cache = diskcache.Cache(
+            directory, size_limit=size_limit, eviction_policy="least-recently-stored"
+        )
+
+    def get(self, key: str):
+        return self.cache.get(key)
+
+    def set(self, key: str, value):
+        self.cache.set(key, value, expire=self.ttl)
+
+    def incr(self, counter: str, amount: int = 1) -> int:
+        return self.cache.incr(f"counter:{counter}", delta=amount, default=0)
+
+    def counters(self, names: list) -> dict:
+        return {name: self.cache.get(f"counter:{name}", 0) for name in names}
+
+    def usage(self) -> dict:
+        """Number of entries and size on disk, with the limit."""
+        return {
+            "entries": len(self.cache),
+            "bytes": self.cache.volume(),
+            "size_limit": self.cache.size_limit,
+        }
+
+    def clear(self):
+        self.cache.clear()
+
+
+class RedisTier:
+    """Persistent tier on Redis, shared by every host of the deployment."""
+
+    def __init__(
+        self,
+        url: str,
+        ttl: float = 3600,
+        prefix: str = "response_cache",
+        binary: bool = False,
+    ):
+        """
+        Initialize the tier.
+
+        Args:
+            url (str): The Redis connection URL.
+            ttl (float): Seconds an entry stays valid. Eviction of older entries
+                follows the ``maxmemory-policy`` of the Redis server.
+            prefix (str): Prefix of the Redis keys.
+            binary (bool): Whether values are returned as bytes instead of text.
+        """
+        import redis
+
+        self.ttl = ttl
+        self.prefix = prefix
+        self.binary = binary
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key: str):
+        value = self.client.get(f"{self.prefix}:{key}")
+        if value is None or self.binary:
+            return value
+        return value.decode("utf-8")
+
+    def set(self, key: str, value):
+        self.client.set(f"{self.prefix}:{key}", value, ex=int(self.ttl))
+
+    def incr(self, counter: str, amount: int = 1) -> int:
+        return self.client.hincrby(f"{self.prefix}:counters", counter, amount)
+
+    def counters(self, names: list) -> dict:
+        values = self.client.hmget(f"{self.prefix}:counters", names)
+        return {name: int(v or 0) for name, v in zip(names, values)}
+
+    def usage(self) -> dict:
+        """Memory of the Redis server, shared with the other tiers and the sessions."""
+        info = self.client.info("memory")
+        return {
+            key: info.get(key)
+            for key in ("used_memory", "maxmemory", "maxmemory_policy")
+        }
+
+    def clear(self):
+        keys = list(self.client.scan_iter(f"{self.prefix}:*"))
+        if keys:
+            self.client.delete(*keys)
+
+
+class BufferedCounters:
+    """
+    Hit and miss counters of a cache, added to its persistent tier in batches.
+
+    Writing to the persistent tier on every lookup would cost a disk write or a
+    Redis round trip per call: counts are kept in the process and flushed at most
+    every ``flush_interval`` seconds, on a thread of their own so that lookups on
+    the event loop never wait for it, when the shared counters are read, and when
+    the process exits.
+
+    Attributes:
+        local (dict): The counts of this process.
+    """
+
+    def __init__(self, names: list, persistent=None, flush_interval: float = 10.0):
+        """
+        Initialize the counters.
+
+        Args:
+            names (list): Names of the counters.
+            persistent (DiskTier | RedisTier, optional): The tier shared by every
+                process.
+            flush_interval (float): Seconds between two flushes.
+        """
+        self.names = list(names)
+        self.persistent = persistent
+        self.flush_interval = flush_interval
+        self.local = dict.fromkeys(self.names, 0)
+        self._pending = dict.fromkeys(self.names, 0)
+        self._flushed_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        atexit.register(self._flush_at_exit)
+
+    def count(self, name: str):
+        """Add one to a counter."""
+        with self._lock:
+            self.local[name] += 1
+            self._pending[name] += 1
+            due = (
+                self.persistent is not None
+                and time.monotonic() - self._flushed_at >= self.flush_interval
+            )
+            if due:
+                self._flushed_at = time.monotonic()
+        if due:
+            threading.Thread(target=self.flush, daemon=True).start()
+
+    def flush(self):
+        """Add the counts of this process since the last flush to the shared tier."""
+        if self.persistent is None:
+            return
+        with self._lock:
+            pending = {name: n for name, n in self._pending.items() if n}
+            self._pending = dict.fromkeys(self.names, 0)
+            self._flushed_at = time.monotonic()
+        for name, amount in pending.items():
+            try:
+                self.persistent.incr(name, amount)
+            except Exception as e:
+                logger.warning(f"Failed to update cache counter {name}: {str(e)}")
+
+    def _flush_at_exit(self):
+        # Forked children inherit the counts of their parent: only it flushes them
+        if os.getpid() == self._pid:
+            self.flush()
+
+    def shared(self) -> dict:
+        """Counters of every process, including the latest counts of this one."""
+        self.flush()
+        return self.persistent.counters(self.names)
+
+
+class ResponseCache:
+    """
+    Cache of LLM answers for deterministic calls.
+
+    Answers are looked up in a process-local LRU first, then in a persistent tier
+    shared with the other processes. Only calls sampled at a temperature up to
+    ``max_temperature`` are cached: above it, students expect varied answers.
+    Lookups and writes are coroutines: the LRU is used on the event loop, the
+    persistent tier on a worker thread.
+    """
+
+    COUNTERS = ["memory_hits", "persistent_hits", "misses", "bypasses"]
+
+    def __init__(
+        self, memory: MemoryTier, persistent=None, max_temperature: float = 0.2
+    ):
+        """
+        Initialize the cache.
+
+        Args:
+            memory (MemoryTier): The in-process tier.
+            persistent (DiskTier | RedisTier, optional): The shared tier.
+            max_temperature (float): Highest temperature of a cacheable call.
+        """
+        self.memory = memory
+        self.persistent = persistent
+        self.max_temperature = max_temperature
+        self.counters = BufferedCounters(self.COUNTERS, persistent)
+
+    @staticmethod
+    def make_key(
+        provider: str, model: str, system_prompt: str, prompt: str, params
+    ) -> str:
+        """
+        Build the cache key of a call.
+
+        Args:
+            provider (str): The provider name.
+            model (str): The model name.
+            system_prompt (str): The system prompt, if any.
+            prompt (str): The user prompt.
+            params (GenerationParams): The sampling parameters.
+
+        Returns:
+            str: A SHA-256 digest identifying the call.
+        """
+        payload = json.dumps(
+            [provider, model, system_prompt or "", prompt, params._asdict()],
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def is_cacheable(self, params) -> bool:
+        """Whether a call with these sampling parameters may be cached."""
+        return params.temperature <= self.max_temperature
+
+    def _count(self, counter: str):
+        self.counters.count(counter)
+
+    async def get(self, key: str, params):
+        """
+        Look up the answer of a call.
+
+        Args:
+            key (str): The key built by ``make_key``.
+            params (GenerationParams): The sampling parameters of the call.
+
+        Returns:
+            str: The cached answer, or None.
+        """
+        if not self.is_cacheable(params):
+            self._count("bypasses")
+            return None
+        value = self.memory.get(key)
+        if value is not None:
+            self._count("memory_hits")
+            return value
+        if self.persistent is not None:
+            try:
+                value = await asyncio.to_thread(self.persistent.get, key)
+            except Exception as e:
+                logger.warning(f"Persistent response cache unavailable: {str(e)}")
+            if value is not None:
+                self.memory.set(key, value)
+                self._count("persistent_hits")
+                return value
+        self._count("misses")
+        return None
+
+    async def set(self, key: str, params, value: str):
+        """
+        Store the answer of a call, if its parameters make it cacheable.
+
+        Args:
+            key (str): The key built by ``make_key``.
+            params (GenerationParams): The sampling parameters of the call.
+            value (str): The answer.
+        """
+        if not self.is_cacheable(params):
+            return
+        self.memory.set(key, value)
+        if self.persistent is not None:
+            try:
+                await asyncio.to_thread(self.persistent.set, key, value)
+            except Exception as e:
+                logger.warning(f"Persistent response cache unavailable: {str(e)}")
+
+    def stats(self) -> dict:
+        """
+        Get the hit and miss counters.
+
+        Returns:
+            dict: The counters of this process under ``"process"``, the counters of
+                every process under ``"shared"`` (when a persistent tier is set),
+                and the number of entries of the in-process tier.
+        """
+        stats = {
+            "process": dict(self.counters.local),
+            "memory_entries": len(self.memory),
+        }
+        if self.persistent is not None:
+            stats["shared"] = self.counters.shared()
+        return stats
+
+    def usage(self) -> dict:
+        """
+        Get the size of the cached answers.
+
+        Returns:
+            dict: The usage of the in-process tier under ``"memory"`` and of the
+                persistent tier under ``"persistent"`` (when it is set).
+        """
+        usage = {"memory": self.memory.usage()}
+        if self.persistent is not None:
+            usage["persistent"] = self.persistent.usage()
+        return usage
+
+    def clear(self):
+        """Drop every cached answer."""
+        self.memory.clear()
+        if self.persistent is not None:
+            self.persistent.clear()
+
+
+_cache = None
+
+
+def _reset_after_fork():
+    global _cache
+    _cache = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_response_cache() -> ResponseCache:
+    """
+    Get the response cache of the process, or None if it is disabled.
+
+    The persistent tier is Redis when ``REDIS_URL`` is set and diskcache otherwise.
+    ``RESPONSE_CACHE`` (``on``/``off``), ``RESPONSE_CACHE_TTL``,
+    ``RESPONSE_CACHE_MAX_ENTRIES``, ``RESPONSE_CACHE_MEMORY_LIMIT``,
+    ``RESPONSE_CACHE_SIZE_LIMIT`` and ``RESPONSE_CACHE_MAX_TEMPERATURE`` configure it.
+
+    Returns:
+        ResponseCache: The cache instance.
+    """
+    global _cache
+    if os.getenv("RESPONSE_CACHE", "on") == "off":
+        return None
+    if _cache is None:
+        ttl = float(os.getenv("RESPONSE_CACHE_TTL", 3600))
+        memory = MemoryTier(
+            int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 1024)),
+            ttl,
+            max_bytes=int(os.getenv("RESPONSE_CACHE_MEMORY_LIMIT", 32 * 1024**2)),
+        )
+        try:
+            if "REDIS_URL" in os.environ:
+                persistent = RedisTier(os.environ["REDIS_URL"], ttl)
+            else:
+                persistent = DiskTier(
+                    ".cache/responses",
+                    ttl,
+                    size_limit=int(
+                        os.getenv("RESPONSE_CACHE_SIZE_LIMIT", 256 * 1024**2)
+                    ),
+                )
+        except Exception as e:
+            logger.warning(f"Response cache without persistent tier: {str(e)}")
+            persistent = None
+        _cache = ResponseCache(
+            memory,
+            persistent,
+            max_temperature=float(os.getenv("RESPONSE_CACHE_MAX_TEMPERATURE", 0.2)),
+        )
+    return _cache
@@ -0,0 +1,193 @@
+import importlib
+import json
+import os
+from abc import ABC, abstractmethod
+from collections import namedtuple
+
+ProviderStats = namedtuple(
+    "ProviderStats", ["ewma_latency", "p95_latency", "error_rate", "samples"]
+)
+EMPTY_STATS = ProviderStats(0.0, 0.0, 0.0, 0)
+
+
+class RoutingPolicy(ABC):
+    """Abstract base class for the strategies choosing the provider of a call."""
+
+    def __init__(self, capacity: int = 3):
+        """
+        Initialize the policy.
+
+        Args:
+            capacity (int): Number of concurrent calls a provider serves without
+                queuing.
+        """
+        self.capacity = capacity
+
+    @abstractmethod
+    def choose(self, providers: list, counts: dict, stats: dict) -> str:
+        """
+        Choose the provider for the next call.
+
+        Args:
+            providers (list): Candidate providers, by order of preference.
+            counts (dict): Number of in-flight calls per provider.
+            stats (dict): ProviderStats per provider.
+
+        Returns:
+            str: The chosen provider.
+        """
+        pass
+
+    @property
+    def uses_stats(self) -> bool:
+        """Whether ``choose`` needs the provider statistics."""
+        return True
+
+
+class PriorityPolicy(RoutingPolicy):
+    """
+    Fill providers in order of preference.
+
+    The first provider with fewer than ``capacity`` calls in flight wins; when every
+    provider is full, the least loaded one is used.
+    """
+
+    def choose(self, providers: list, counts: dict, stats: dict) -> str:
+        for provider in providers:
+            if counts[provider] < self.capacity:
+                return provider
+        return min(providers, key=counts.get)
+
+    @property
+    def uses_stats(self) -> bool:
+        return False
+
+
+class AdaptivePolicy(RoutingPolicy):
+    """
+    Route each call to the provider with the lowest expected completion time.
+
+    The service time of a provider is estimated from its EWMA and p95 latencies
+    (or from a prior until enough calls have been observed). Calls beyond
+    ``capacity`` are assumed to queue, and failed calls to be retried, so the
+    expected completion time is::
+
+        service_time * (1 + max(0, in_flight + 1 - capacity) / capacity)
+                     / (1 - error_rate)
+    """
+
+    def __init__(
+        self,
+        capacity: int = 3,
+        tail_weight: float = 0.25,
+        min_samples: int = 5,
+        max_error_rate: float = 0.9,
+        priors: dict = None,
+    ):
+        """
+        Initialize the policy.
+
+        Args:
+            capacity (int): Number of concurrent calls a provider serves without
+                queuing.
+            tail_weight (float): Weight of the p95 latency in the service time
+                estimate (the EWMA gets the rest).
+            min_samples (int): Number of observed calls before the measured
+                latency fully replaces the prior.
+            max_error_rate (float): Upper bound applied to the error rate, so that a
+                failing provider still gets an occasional probe.
+            priors (dict): Expected latency in seconds per provider before any call
+                has been observed.
+        """
+        super().__init__(capacity)
+        self.tail_weight = tail_weight
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self.priors = {"openai": 3.0, "replicate": 10.0, "ollama": 8.0}
+        self.priors.update(priors or {})
+
+    def service_time(self, provider: str, stats: ProviderStats) -> float:
+        """
+        Estimate the duration of one call on a provider.
+
+        Args:
+            provider (str): The provider name.
+            stats (ProviderStats): The statistics of the provider.
+
+        Returns:
+            float: The estimated duration in seconds.
+        """
+        prior = self.priors.get(provider, max(self.priors.values()))
+        if not stats.samples:
+            return prior
+        measured = (
+            1 - self.tail_weight
+        ) * stats.ewma_latency + self.tail_weight * stats.p95_latency
+        confidence = min(1.0, stats.samples / self.min_samples)
+        return confidence * measured + (1 - confidence) * prior
+
+    def expected_completion(
+        self, provider: str, in_flight: int, stats: ProviderStats
+    ) -> float:
+        """
+        Estimate when a call sent now to a provider would complete.
+
+        Args:
+            provider (str): The provider name.
+            in_flight (int): Number of calls already in flight on the provider.
+            stats (ProviderStats): The statistics of the provider.
+
+        Returns:
+            float: The expected completion time in seconds.
+        """
+        queued = max(0, in_flight + 1 - self.capacity)
+        error_rate = min(stats.error_rate, self.max_error_rate)
+        return (
+            self.service_time(provider, stats)
+            * (1 + queued / self.capacity)
+            / (1 - error_rate)
+        )
+
+    def choose(self, providers: list, counts: dict, stats: dict) -> str:
+        # min() keeps the first provider on ties, preserving the preference order.
+        return min(
+            providers,
+            key=lambda p: self.expected_completion(
+                p, counts[p], stats.get(p, EMPTY_STATS)
+            ),
+        )
+
+
+POLICIES = {
+    "priority": PriorityPolicy,
+    "adaptive": AdaptivePolicy,
+}
+
+
+def load_policy(capacity: int = 3) -> RoutingPolicy:
+    """
+    Build the routing policy configured in the environment.
+
+    ``ROUTING_POLICY`` is either one of the names of ``POLICIES`` or the import
+    path of a RoutingPolicy subclass (``package.module:ClassName``).
+    ``ROUTING_POLICY_OPTIONS`` holds the keyword arguments of the policy as a JSON
+    object.
+
+    Args:
+        capacity (int): Number of concurrent calls a provider serves without
+            queuing.
+
+    Returns:
+        RoutingPolicy: The configured policy.
+    """
+    name = os.getenv("ROUTING_POLICY", "adaptive")
+    options = json.loads(os.getenv("ROUTING_POLICY_OPTIONS", "{}"))
+    if name in POLICIES:
+        policy_class = POLICIES[name]
+    else:
+        module_name, _, class_name = name.partition(":")
+        policy_class = getattr(importlib.import_module(module_name), class_name)
+        if not issubclass(policy_class, RoutingPolicy):
+            raise ValueError(f"{name} is not a RoutingPolicy subclass")
+    options.setdefault("capacity", capacity)
+    return policy_class(**options)
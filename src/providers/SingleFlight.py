@@ -0,0 +1,202 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import uuid
+from concurrent.futures import Future
+
+from src.Logger import Logger
+
+logger = Logger(__name__).get_logger()
+
+
+class SingleFlight:
+    """
+    Coalesce identical LLM calls that are in flight at the same time.
+
+    The first caller of a key (the leader) runs the call; the callers arriving
+    while it runs wait for its result instead of sending the same request upstream.
+    Within a process, waiters share a future. With Redis, the leader of every
+    process also competes for a lock key, and the losers poll for the result the
+    winner publishes.
+    """
+
+    def __init__(
+        self,
+        redis_url: str = None,
+        lock_ttl: float = 120.0,
+        result_ttl: float = 5.0,
+        poll_interval: float = 0.05,
+        prefix: str = "single_flight",
+    ):
+        """
+        Initialize the coalescer.
+
+        Args:
+            redis_url (str, optional): Redis connection URL, to coalesce across
+                processes and hosts.
+            lock_ttl (float): Seconds after which the lock of a leader that died
+                is released.
+            result_ttl (float): Seconds a result stays available to the waiters of
+                other processes.
+            poll_interval (float): Seconds between two checks of a waiter.
+            prefix (str): Prefix of the Redis keys.
+        """
+        self.lock_ttl = lock_ttl
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        self.prefix = prefix
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.client = None
+        if redis_url:
+            import redis
+
+            self.client = redis.Redis.from_url(redis_url)
+
+    @staticmethod
+    def make_key(system_prompt: str, prompt: str, params, variant: str = "") -> str:
+        """
+        Build the key of a call, independent of the provider that will serve it.
+
+        Args:
+            system_prompt (str): The system prompt, if any.
+            prompt (str): The user prompt.
+            params (GenerationParams): The sampling parameters.
+            variant (str): Anything else changing the answer, such as the
+                condition stopping its generation early.
+
+        Returns:
+            str: A SHA-256 digest identifying the call.
+        """
+        payload = json.dumps(
+            [system_prompt or "", prompt, params._asdict(), variant], sort_keys=True
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    async def do(self, key: str, call) -> str:
+        """
+        Run ``call`` unless an identical call is already in flight.
+
+        Args:
+            key (str): The key built by ``make_key``.
+            call (callable): Coroutine function producing the answer.
+
+        Returns:
+            str: The answer, produced by this call or by the one it joined.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+        if not leader:
+            logger.debug(f"Joining in-flight call {key[:12]}")
+            return await asyncio.wrap_future(future)
+
+        try:
+            if self.client is None:
+                result = await call()
+            else:
+                result = await self._do_shared(key, call)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            # Nobody else may be waiting: mark the exception as retrieved.
+            future.exception()
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    async def _do_shared(self, key: str, call) -> str:
+        """Coalesce with the leaders of the other processes through Redis."""
+        lock_key = f"{self.prefix}:lock:{key}"
+        result_key = f"{self.prefix}:result:{key}"
+        token = uuid.uuid4().hex
+        while True:
+            try:
+                acquired = await asyncio.to_thread(
+                    self.client.set,
+                    lock_key,
+                    token,
+                    nx=True,
+                    px=int(self.lock_ttl * 1000),
+                )
+            except Exception as e:
+                logger.warning(f"Single flight unavailable, calling directly: {e}")
+                return await call()
+
+            if acquired:
+                try:
+                    result = await call()
+                    await asyncio.to_thread(
+                        self.client.set,
+                        result_key,
+                        result,
+                        px=int(self.result_ttl * 1000),
+                    )
+                    return result
+                finally:
+                    # Release the lock only if it is still ours.
+                    await asyncio.to_thread(self._release, lock_key, token)
+
+            logger.debug(f"Waiting for the call {key[:12]} of another process")
+            while True:
+                await asyncio.sleep(self.poll_interval)
+                result, locked = await asyncio.to_thread(
+                    self._poll, result_key, lock_key
+                )
+                if result is not None:
+                    return result.decode("utf-8")
+                if not locked:
+                    # The leader failed without a result: compete again.
+                    break
+
+    def _poll(self, result_key: str, lock_key: str):
+        pipe = self.client.pipeline()
+        pipe.get(result_key)
+        pipe.exists(lock_key)
+        result, locked = pipe.execute()
+        return result, bool(locked)
+
+    def _release(self, lock_key: str, token: str):
+        self.client.eval(
+            "if redis.call('GET', KEYS[1]) == ARGV[1] then "
+            "return redis.call('DEL', KEYS[1]) end return 0",
+            1,
+            lock_key,
+            token,
+        )
+
+
+_single_flight = None
+
+
+def _reset_after_fork():
+    global _single_flight
+    _single_flight = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_single_flight() -> SingleFlight:
+    """
+    Get the coalescer of the process, or None if ``SINGLE_FLIGHT`` is ``off``.
+
+    Calls are coalesced across processes when ``REDIS_URL`` is set.
+
+    Returns:
+        SingleFlight: The coalescer.
+    """
+    global _single_flight
+    if os.getenv("SINGLE_FLIGHT", "on") == "off":
+        return None
+    if _single_flight is None:
+        _single_flight = SingleFlight(redis_url=os.getenv("REDIS_URL"))
+    return _single_flight
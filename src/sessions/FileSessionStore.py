@@ -0,0 +1,252 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+from contextlib import contextmanager
+from typing import Optional
+
+from src.Logger import Logger
+from src.sessions.SessionStore import SessionStore
+
+logger = Logger(__name__).get_logger()
+
+
+class FileSessionStore(SessionStore):
+    """
+    Sessions stored as files: a JSON header and a JSON Lines log of messages.
+
+    Messages are appended to the log in a single write, and the most recent ones
+    are read backwards from the end of the file. The position of a message is its
+    line: finding it reads the whole log, and messages are appended and rewritten
+    under a lock of the session. Each registered username is a file naming its
+    session, next to a file naming the username of the session; both are written
+    under a lock shared by the processes of the host.
+    """
+
+    BLOCK_SIZE = 8192
+
+    def __init__(self, directory: str):
+        """
+        Initialize the store.
+
+        Args:
+            directory (str): Directory of the session files.
+        """
+        self.directory = directory
+        self.usernames_directory = os.path.join(directory, "usernames")
+        os.makedirs(self.usernames_directory, exist_ok=True)
+
+    def _path(self, session_id: str, extension: str) -> str:
+        # Session IDs come from the browser: never use them as paths
+        name = hashlib.sha256(session_id.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{name}.{extension}")
+
+    def _username_path(self, username: str) -> str:
+        name = hashlib.sha256(username.encode("utf-8")).hexdigest()
+        return os.path.join(self.usernames_directory, f"{name}.json")
+
+    def _session_username_path(self, session_id: str) -> str:
+        name = hashlib.sha256(session_id.encode("utf-8")).hexdigest()
+        return os.path.join(self.usernames_directory, f"{name}.session")
+
+    @contextmanager
+    def _lock(self, path: str):
+        with open(path, "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _registry_lock(self):
+        return self._lock(os.path.join(self.usernames_directory, ".lock"))
+
+    def _messages_lock(self, session_id: str):
+        return self._lock(self._path(session_id, "lock"))
+
+    def _write_atomic(self, path: str, data: bytes):
+        # Write then rename, so that readers never see a partial file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _encode(messages: list) -> bytes:
+        return b"".join(
+            json.dumps(msg, ensure_ascii=False).encode("utf-8") + b"\n"
+            for msg in messages
+        )
+
+    def get_header(self, session_id: str) -> Optional[dict]:
+        try:
+            with open(self._path(session_id, "json"), "rb") as f:
+                return json.loads(f.read())
+        except FileNotFoundError:
+            return None
+
+    def set_header(self, session_id: str, header: dict):
+        self._write_atomic(
+            self._path(session_id, "json"), json.dumps(header).encode("utf-8")
+        )
+
+    def _tail(self, path: str, last: int) -> list:
+        """Read the last lines of a file, from its end."""
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            position = f.tell()
+            data = b""
+            # One more newline than lines, since the file ends with one
+            while position > 0 and data.count(b"\n") <= last:
+                size = min(self.BLOCK_SIZE, position)
+                position -= size
+                f.seek(position)
+                data = f.read(size) + data
+        lines = data.splitlines()
+        if position > 0:
+            # The first line may be partial
+            lines = lines[1:]
+        return lines[-last:] if last else []
+
+    def get_messages(self, session_id: str, last: Optional[int] = None) -> list:
+        path = self._path(session_id, "jsonl")
+        try:
+            if last is None:
+                with open(path, "rb") as f:
+                    lines = f.read().splitlines()
+            else:
+                lines = self._tail(path, last)
+        except FileNotFoundError:
+            return []
+        return [json.loads(line) for line in lines if line]
+
+    def _read_lines(self, session_id: str) -> list:
+        try:
+            with open(self._path(session_id, "jsonl"), "rb") as f:
+                return [line for line in f.read().splitlines() if line]
+        except FileNotFoundError:
+            return []
+
+    def get_message_window(self, session_id: str, last: Optional[int] = None) -> tuple:
+        lines = self._read_lines(session_id)
+        start = 0 if last is None else max(len(lines) - last, 0)
+        return start, [json.loads(line) for line in lines[start:]]
+
+    def append_messages(self, session_id: str, messages: list) -> int:
+        with self._messages_lock(session_id):
+            position = len(self._read_lines(session_id))
+            if messages:
+                # A single write in append mode: readers never see a partial line
+                with open(self._path(session_id, "jsonl"), "ab") as f:
+                    f.write(self._encode(messages))
+        return position
+
+    def update_messages(self, session_id: str, updates: dict) -> int:
+        if not updates:
+            return 0
+        updated = 0
+        with self._messages_lock(session_id):
+            lines = self._read_lines(session_id)
+            for position, (old, new) in updates.items():
+                if position < len(lines) and json.loads(lines[position]) == old:
+                    lines[position] = json.dumps(new, ensure_ascii=False).encode(
+                        "utf-8"
+                    )
+                    updated += 1
+            if updated:
+                self._write_atomic(
+                    self._path(session_id, "jsonl"),
+                    b"".join(line + b"\n" for line in lines),
+                )
+        return updated
+
+    def replace_messages(
+        self, session_id: str, messages: list, last: Optional[int] = None
+    ):
+        with self._messages_lock(session_id):
+            kept = []
+            if last is not None:
+                kept = self.get_messages(session_id)
+                kept = kept[: max(len(kept) - last, 0)]
+            self._write_atomic(
+                self._path(session_id, "jsonl"), self._encode(kept + messages)
+            )
+
+    def register_username(self, session_id: str, username: str) -> bool:
+        # The check, the registration and the release of the previous username
+        # happen under the lock
+        with self._registry_lock():
+            owner = self.find_session(username)
+            if owner is not None:
+                return owner == session_id
+            previous = self._read_json(self._session_username_path(session_id))
+            self._write_atomic(
+                self._username_path(username),
+                json.dumps({"session_id": session_id, "username": username}).encode(
+                    "utf-8"
+                ),
+            )
+            self._write_atomic(
+                self._session_username_path(session_id),
+                json.dumps(username).encode("utf-8"),
+            )
+            if previous is not None:
+                self._remove(self._username_path(previous))
+            return True
+
+    @staticmethod
+    def _read_json(path: str):
+        try:
+            with open(path, "rb") as f:
+                return json.loads(f.read())
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def find_session(self, username: str) -> Optional[str]:
+        registration = self._read_json(self._username_path(username))
+        return registration["session_id"] if registration else None
+
+    def list_sessions(self, offset: int = 0, limit: int = 100) -> list:
+        # Listing the directory costs a scan per page: use another store for
+        # large deployments
+        entries = sorted(
+            (entry.stat().st_mtime, entry.path)
+            for entry in os.scandir(self.usernames_directory)
+            if entry.name.endswith(".json")
+        )
+        registrations = [
+            self._read_json(path) for _, path in entries[offset : offset + limit]
+        ]
+        return [
+            (registration["session_id"], registration["username"])
+            for registration in registrations
+            if registration
+        ]
+
+    def usage(self) -> dict:
+        sessions = size = 0
+        for entry in os.scandir(self.directory):
+            if not entry.is_file():
+                continue
+            if entry.name.endswith(".json"):
+                sessions += 1
+            size += entry.stat().st_size
+        return {"sessions": sessions, "bytes": size}
+
+    def delete(self, session_id: str):
+        with self._registry_lock():
+            username = self._read_json(self._session_username_path(session_id))
+            if username is not None:
+                self._remove(self._username_path(username))
+                self._remove(self._session_username_path(session_id))
+        for extension in ("json", "jsonl", "lock"):
+            self._remove(self._path(session_id, extension))
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(self.usernames_directory, exist_ok=True)
@@ -0,0 +1,258 @@
+import json
+import time
+from typing import Optional
+
+from src.Logger import Logger
+from src.sessions.SessionStore import SessionStore
+
+logger = Logger(__name__).get_logger()
+
+# Registers a username unless another session has it, releasing the previous
+# username of the session, in a single atomic step.
+# KEYS: usernames, registry, registered; ARGV: session ID, username, time
+REGISTER_USERNAME = """
+local owner = redis.call('HGET', KEYS[1], ARGV[2])
+if owner then
+    return owner == ARGV[1] and 1 or 0
+end
+local previous = redis.call('HGET', KEYS[2], ARGV[1])
+if previous then
+    redis.call('HDEL', KEYS[1], previous)
+end
+redis.call('HSET', KEYS[1], ARGV[2], ARGV[1])
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+redis.call('ZADD', KEYS[3], 'NX', ARGV[3], ARGV[1])
+return 1
+"""
+
+# Replaces messages at their positions, each only if it is still the one it was
+# read as.
+# KEYS: messages; ARGV: position, message as read, new message, ...
+UPDATE_MESSAGES = """
+local updated = 0
+for i = 1, #ARGV, 3 do
+    if redis.call('LINDEX', KEYS[1], ARGV[i]) == ARGV[i + 1] then
+        redis.call('LSET', KEYS[1], ARGV[i], ARGV[i + 2])
+        updated = updated + 1
+    end
+end
+return updated
+"""
+
+# Updates fields of an existing header and the rank of its session together.
+# Values are JSON: tonumber reads the numbers, and null as nil. The rank is
+# passed to ZADD as a string, since Lua numbers become integers.
+# KEYS: header, ranking; ARGV: session ID, field, value, ...
+UPDATE_HEADER = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+for i = 2, #ARGV, 2 do
+    redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+local level = tonumber(redis.call('HGET', KEYS[1], 'level') or '') or 1
+local best_score = tonumber(redis.call('HGET', KEYS[1], 'best_score') or '') or 0
+redis.call('ZADD', KEYS[2], tostring(level * 1000 + best_score), ARGV[1])
+return 1
+"""
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Sessions stored in Redis, shared by every process and host of the deployment.
+
+    The header of a session is a hash with one JSON-encoded field per entry, its
+    messages a list, and the sessions are indexed in a set and in a sorted set
+    ranking them by level, then best score. Usernames are registered in a hash
+    mapping them to their session, its reverse, and a sorted set ordering the
+    sessions by registration.
+    """
+
+    def __init__(self, url: str, prefix: str = "session"):
+        """
+        Initialize the store.
+
+        Args:
+            url (str): The Redis connection URL.
+            prefix (str): Prefix of the Redis keys.
+        """
+        import redis
+
+        self.prefix = prefix
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self._register_username = self.client.register_script(REGISTER_USERNAME)
+        self._update_messages = self.client.register_script(UPDATE_MESSAGES)
+        self._update_header = self.client.register_script(UPDATE_HEADER)
+
+    def _header_key(self, session_id: str) -> str:
+        return f"{self.prefix}:{session_id}:header"
+
+    def _messages_key(self, session_id: str) -> str:
+        return f"{self.prefix}:{session_id}:messages"
+
+    @property
+    def _index_key(self) -> str:
+        return f"{self.prefix}:index"
+
+    @property
+    def _ranking_key(self) -> str:
+        return f"{self.prefix}:ranking"
+
+    @property
+    def _usernames_key(self) -> str:
+        return f"{self.prefix}:usernames"
+
+    @property
+    def _registry_key(self) -> str:
+        return f"{self.prefix}:registry"
+
+    @property
+    def _registered_key(self) -> str:
+        return f"{self.prefix}:registered"
+
+    @staticmethod
+    def _decode_header(fields: dict) -> Optional[dict]:
+        if not fields:
+            return None
+        return {key: json.loads(value) for key, value in fields.items()}
+
+    @staticmethod
+    def _rank(header: dict) -> float:
+        # Best scores are at most 100: the level comes first
+        return header.get("level", 1) * 1000 + (header.get("best_score") or 0)
+
+    def get_header(self, session_id: str) -> Optional[dict]:
+        return self._decode_header(self.client.hgetall(self._header_key(session_id)))
+
+    def get_headers(self, session_ids: list) -> list:
+        pipeline = self.client.pipeline(transaction=False)
+        for session_id in session_ids:
+            pipeline.hgetall(self._header_key(session_id))
+        return [self._decode_header(fields) for fields in pipeline.execute()]
+
+    def set_header(self, session_id: str, header: dict):
+        key = self._header_key(session_id)
+        pipeline = self.client.pipeline()
+        pipeline.delete(key)
+        pipeline.hset(
+            key, mapping={field: json.dumps(value) for field, value in header.items()}
+        )
+        pipeline.sadd(self._index_key, session_id)
+        pipeline.zadd(self._ranking_key, {session_id: self._rank(header)})
+        pipeline.execute()
+
+    def update_header(self, session_id: str, **fields):
+        # The fields and the rank are updated atomically, without reading the
+        # header, and only if the session exists
+        args = [session_id]
+        for field, value in fields.items():
+            args += [field, json.dumps(value)]
+        self._update_header(
+            keys=[self._header_key(session_id), self._ranking_key], args=args
+        )
+
+    def ranked_sessions(self, offset: int = 0, limit: int = 100) -> list:
+        return self.client.zrevrange(self._ranking_key, offset, offset + limit - 1)
+
+    def get_messages(self, session_id: str, last: Optional[int] = None) -> list:
+        if last == 0:
+            return []
+        start = 0 if last is None else -last
+        return [
+            json.loads(msg)
+            for msg in self.client.lrange(self._messages_key(session_id), start, -1)
+        ]
+
+    def get_message_window(self, session_id: str, last: Optional[int] = None) -> tuple:
+        key = self._messages_key(session_id)
+        # In a transaction: the length is the one of the messages read
+        pipeline = self.client.pipeline()
+        pipeline.llen(key)
+        pipeline.lrange(key, 0 if last is None else -last, -1)
+        length, messages = pipeline.execute()
+        if last == 0:
+            messages = []
+        return length - len(messages), [json.loads(msg) for msg in messages]
+
+    def append_messages(self, session_id: str, messages: list) -> int:
+        key = self._messages_key(session_id)
+        if not messages:
+            return self.client.llen(key)
+        length = self.client.rpush(
+            key, *[json.dumps(msg, ensure_ascii=False) for msg in messages]
+        )
+        return length - len(messages)
+
+    def update_messages(self, session_id: str, updates: dict) -> int:
+        if not updates:
+            return 0
+        args = []
+        for position, (old, new) in updates.items():
+            args += [
+                position,
+                json.dumps(old, ensure_ascii=False),
+                json.dumps(new, ensure_ascii=False),
+            ]
+        return self._update_messages(keys=[self._messages_key(session_id)], args=args)
+
+    def replace_messages(
+        self, session_id: str, messages: list, last: Optional[int] = None
+    ):
+        key = self._messages_key(session_id)
+        pipeline = self.client.pipeline()
+        if last is None:
+            pipeline.delete(key)
+        elif last > 0:
+            # Keeps nothing when the list has at most ``last`` messages
+            pipeline.ltrim(key, 0, -last - 1)
+        if messages:
+            pipeline.rpush(
+                key, *[json.dumps(msg, ensure_ascii=False) for msg in messages]
+            )
+        pipeline.execute()
+
+    def register_username(self, session_id: str, username: str) -> bool:
+        keys = [self._usernames_key, self._registry_key, self._registered_key]
+        return bool(
+            self._register_username(keys=keys, args=[session_id, username, time.time()])
+        )
+
+    def find_session(self, username: str) -> Optional[str]:
+        return self.client.hget(self._usernames_key, username)
+
+    def list_sessions(self, offset: int = 0, limit: int = 100) -> list:
+        session_ids = self.client.zrange(
+            self._registered_key, offset, offset + limit - 1
+        )
+        if not session_ids:
+            return []
+        usernames = self.client.hmget(self._registry_key, session_ids)
+        return list(zip(session_ids, usernames))
+
+    def usage(self) -> dict:
+        session_ids = self.client.smembers(self._index_key)
+        pipeline = self.client.pipeline(transaction=False)
+        for session_id in session_ids:
+            pipeline.memory_usage(self._header_key(session_id))
+            pipeline.memory_usage(self._messages_key(session_id))
+        size = sum(value or 0 for value in pipeline.execute())
+        # Sessions have no expiry: only a volatile-* policy never evicts them
+        policy = self.client.info("memory").get("maxmemory_policy")
+        return {"sessions": len(session_ids), "bytes": size, "maxmemory_policy": policy}
+
+    def delete(self, session_id: str):
+        username = self.client.hget(self._registry_key, session_id)
+        pipeline = self.client.pipeline()
+        if username is not None:
+            pipeline.hdel(self._usernames_key, username)
+            pipeline.hdel(self._registry_key, session_id)
+            pipeline.zrem(self._registered_key, session_id)
+        pipeline.delete(self._header_key(session_id), self._messages_key(session_id))
+        pipeline.srem(self._index_key, session_id)
+        pipeline.zrem(self._ranking_key, session_id)
+        pipeline.execute()
+
+    def clear(self):
+        keys = list(self.client.scan_iter(f"{self.prefix}:*"))
+        if keys:
+            self.client.delete(*keys)
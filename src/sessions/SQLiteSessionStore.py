@@ -0,0 +1,295 @@
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Optional
+
+from src.Logger import Logger
+from src.sessions.SessionStore import SessionStore
+
+logger = Logger(__name__).get_logger()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    username TEXT,
+    level INTEGER NOT NULL DEFAULT 1,
+    best_score REAL NOT NULL DEFAULT 0,
+    header TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_by_rank ON sessions (level, best_score);
+CREATE INDEX IF NOT EXISTS sessions_by_best_score ON sessions (best_score);
+CREATE INDEX IF NOT EXISTS sessions_by_username ON sessions (username);
+CREATE TABLE IF NOT EXISTS messages (
+    session_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    message TEXT NOT NULL,
+    PRIMARY KEY (session_id, position)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS usernames (
+    username TEXT PRIMARY KEY,
+    session_id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS usernames_by_session ON usernames (session_id);
+"""
+
+# Constant statements, prepared once per connection by its statement cache
+UPSERT_SESSION = """
+INSERT INTO sessions (session_id, username, level, best_score, header)
+VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (session_id) DO UPDATE SET
+    username = excluded.username,
+    level = excluded.level,
+    best_score = excluded.best_score,
+    header = excluded.header
+"""
+UPDATE_SESSION = """
+UPDATE sessions SET
+    header = json_patch(header, :fields),
+    username = coalesce(json_extract(:fields, '$.username'), username),
+    level = coalesce(json_extract(:fields, '$.level'), level),
+    best_score = coalesce(json_extract(:fields, '$.best_score'), best_score)
+WHERE session_id = :session_id
+"""
+SELECT_HEADER = "SELECT header FROM sessions WHERE session_id = ?"
+SELECT_RANKED = """
+SELECT session_id FROM sessions
+ORDER BY level DESC, best_score DESC
+LIMIT ? OFFSET ?
+"""
+SELECT_MESSAGES = """
+SELECT message FROM messages WHERE session_id = ? ORDER BY position
+"""
+SELECT_LAST_MESSAGES = """
+SELECT message FROM messages WHERE session_id = ? ORDER BY position DESC LIMIT ?
+"""
+SELECT_WINDOW = """
+SELECT position, message FROM messages WHERE session_id = ?
+ORDER BY position DESC LIMIT ?
+"""
+SELECT_NEXT_POSITION = """
+SELECT coalesce(max(position), -1) + 1 FROM messages WHERE session_id = ?
+"""
+INSERT_MESSAGE = "INSERT INTO messages (session_id, position, message) VALUES (?, ?, ?)"
+UPDATE_MESSAGE = """
+UPDATE messages SET message = ? WHERE session_id = ? AND position = ? AND message = ?
+"""
+DELETE_MESSAGES = "DELETE FROM messages WHERE session_id = ?"
+DELETE_LAST_MESSAGES = "DELETE FROM messages WHERE session_id = ? AND position >= ?"
+DELETE_SESSION = "DELETE FROM sessions WHERE session_id = ?"
+COUNT_SESSIONS = "SELECT count(*) FROM sessions"
+INSERT_USERNAME = """
+INSERT INTO usernames (username, session_id) VALUES (?, ?)
+ON CONFLICT (username) DO NOTHING
+"""
+SELECT_USERNAME = "SELECT session_id FROM usernames WHERE username = ?"
+# Usernames are never updated: their rowid follows the order of registration
+SELECT_USERNAMES = """
+SELECT session_id, username FROM usernames ORDER BY rowid LIMIT ? OFFSET ?
+"""
+DELETE_USERNAMES = "DELETE FROM usernames WHERE session_id = ?"
+DELETE_OTHER_USERNAMES = """
+DELETE FROM usernames WHERE session_id = ? AND username <> ?
+"""
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Sessions stored in an SQLite database in WAL mode, for single-node deployments.
+
+    Sessions are rows indexed by level, best score and username, with their full
+    header as JSON, and messages are rows keyed by session and position. Each
+    thread of each process has its own connection; WAL lets readers proceed while
+    a writer appends.
+    """
+
+    def __init__(self, path: str, timeout: float = 30.0):
+        """
+        Initialize the store, creating the database if needed.
+
+        Args:
+            path (str): Path of the database file.
+            timeout (float): Seconds to wait for the lock of another writer.
+        """
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        # Connections are not shared with other threads, nor with forked children
+        if getattr(self._local, "pid", None) != os.getpid():
+            self._local.pid = os.getpid()
+            connection = sqlite3.connect(
+                self.path,
+                timeout=self.timeout,
+                isolation_level=None,
+                check_same_thread=False,
+                cached_statements=64,
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return self._local.connection
+
+    @contextmanager
+    def _transaction(self):
+        """Run statements in a write transaction, taking the lock up front."""
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def get_header(self, session_id: str) -> Optional[dict]:
+        row = self._connection().execute(SELECT_HEADER, (session_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_headers(self, session_ids: list) -> list:
+        headers = {}
+        connection = self._connection()
+        # Stay below the limit of parameters of a statement
+        for i in range(0, len(session_ids), 500):
+            chunk = session_ids[i : i + 500]
+            placeholders = ", ".join("?" * len(chunk))
+            rows = connection.execute(
+                "SELECT session_id, header FROM sessions "
+                f"WHERE session_id IN ({placeholders})",
+                chunk,
+            )
+            headers.update((session_id, json.loads(h)) for session_id, h in rows)
+        return [headers.get(session_id) for session_id in session_ids]
+
+    def set_header(self, session_id: str, header: dict):
+        self._connection().execute(
+            UPSERT_SESSION,
+            (
+                session_id,
+                header.get("username"),
+                header.get("level", 1),
+                header.get("best_score") or 0,
+                json.dumps(header),
+            ),
+        )
+
+    def update_header(self, session_id: str, **fields):
+        # A single statement: the fields are updated atomically
+        self._connection().execute(
+            UPDATE_SESSION, {"fields": json.dumps(fields), "session_id": session_id}
+        )
+
+    def ranked_sessions(self, offset: int = 0, limit: int = 100) -> list:
+        rows = self._connection().execute(SELECT_RANKED, (limit, offset))
+        return [session_id for (session_id,) in rows]
+
+    def get_messages(self, session_id: str, last: Optional[int] = None) -> list:
+        connection = self._connection()
+        if last is None:
+            rows = connection.execute(SELECT_MESSAGES, (session_id,)).fetchall()
+        else:
+            rows = connection.execute(
+                SELECT_LAST_MESSAGES, (session_id, last)
+            ).fetchall()[::-1]
+        return [json.loads(message) for (message,) in rows]
+
+    def get_message_window(self, session_id: str, last: Optional[int] = None) -> tuple:
+        # A single statement: positions and messages are read together; a
+        # negative limit has none
+        rows = self._connection().execute(
+            SELECT_WINDOW, (session_id, -1 if last is None else last)
+        )
+        rows = rows.fetchall()[::-1]
+        start = rows[0][0] if rows else 0
+        return start, [json.loads(message) for _, message in rows]
+
+    def _insert(self, connection, session_id: str, messages: list) -> int:
+        (position,) = connection.execute(SELECT_NEXT_POSITION, (session_id,)).fetchone()
+        connection.executemany(
+            INSERT_MESSAGE,
+            [
+                (session_id, position + i, json.dumps(msg, ensure_ascii=False))
+                for i, msg in enumerate(messages)
+            ],
+        )
+        return position
+
+    def append_messages(self, session_id: str, messages: list) -> int:
+        if not messages:
+            connection = self._connection()
+            return connection.execute(SELECT_NEXT_POSITION, (session_id,)).fetchone()[0]
+        with self._transaction() as connection:
+            return self._insert(connection, session_id, messages)
+
+    def update_messages(self, session_id: str, updates: dict) -> int:
+        if not updates:
+            return 0
+        with self._transaction() as connection:
+            cursor = connection.executemany(
+                UPDATE_MESSAGE,
+                [
+                    (
+                        json.dumps(new, ensure_ascii=False),
+                        session_id,
+                        position,
+                        json.dumps(old, ensure_ascii=False),
+                    )
+                    for position, (old, new) in updates.items()
+                ],
+            )
+        return cursor.rowcount
+
+    def replace_messages(
+        self, session_id: str, messages: list, last: Optional[int] = None
+    ):
+        with self._transaction() as connection:
+            if last is None:
+                connection.execute(DELETE_MESSAGES, (session_id,))
+            elif last > 0:
+                (end,) = connection.execute(
+                    SELECT_NEXT_POSITION, (session_id,)
+                ).fetchone()
+                connection.execute(DELETE_LAST_MESSAGES, (session_id, end - last))
+            self._insert(connection, session_id, messages)
+
+    def register_username(self, session_id: str, username: str) -> bool:
+        with self._transaction() as connection:
+            connection.execute(INSERT_USERNAME, (username, session_id))
+            (owner,) = connection.execute(SELECT_USERNAME, (username,)).fetchone()
+            if owner == session_id:
+                connection.execute(DELETE_OTHER_USERNAMES, (session_id, username))
+        return owner == session_id
+
+    def find_session(self, username: str) -> Optional[str]:
+        row = self._connection().execute(SELECT_USERNAME, (username,)).fetchone()
+        return row[0] if row else None
+
+    def list_sessions(self, offset: int = 0, limit: int = 100) -> list:
+        rows = self._connection().execute(SELECT_USERNAMES, (limit, offset))
+        return [tuple(row) for row in rows]
+
+    def usage(self) -> dict:
+        connection = self._connection()
+        (sessions,) = connection.execute(COUNT_SESSIONS).fetchone()
+        (pages,) = connection.execute("PRAGMA page_count").fetchone()
+        (page_size,) = connection.execute("PRAGMA page_size").fetchone()
+        size = pages * page_size
+        if os.path.exists(f"{self.path}-wal"):
+            size += os.path.getsize(f"{self.path}-wal")
+        return {"sessions": sessions, "bytes": size}
+
+    def delete(self, session_id: str):
+        with self._transaction() as connection:
+            connection.execute(DELETE_MESSAGES, (session_id,))
+            connection.execute(DELETE_SESSION, (session_id,))
+            connection.execute(DELETE_USERNAMES, (session_id,))
+
+    def clear(self):
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM messages")
+            connection.execute("DELETE FROM sessions")
+            connection.execute("DELETE FROM usernames")
@@ -0,0 +1,265 @@
+import os
+from abc import ABC, abstractmethod
+from typing import Optional
+
+from src.Logger import Logger
+
+logger = Logger(__name__).get_logger()
+
+
+class SessionStore(ABC):
+    """
+    Storage of the sessions of the users.
+
+    A session is a small header (username, level, chat settings...), rewritten
+    when it changes, and an append-only log of the messages of its chat, so that
+    saving an exchange costs the same whatever the length of the history, and
+    the recent messages can be read without the older ones.
+    """
+
+    @abstractmethod
+    def get_header(self, session_id: str) -> Optional[dict]:
+        """
+        Get the header of a session.
+
+        Args:
+            session_id (str): The session ID.
+
+        Returns:
+            dict: The header, or None if the session does not exist.
+        """
+
+    def get_headers(self, session_ids: list) -> list:
+        """
+        Get the headers of several sessions.
+
+        Args:
+            session_ids (list): The session IDs.
+
+        Returns:
+            list: The header of each session, or None if it does not exist.
+        """
+        return [self.get_header(session_id) for session_id in session_ids]
+
+    @abstractmethod
+    def set_header(self, session_id: str, header: dict):
+        """
+        Replace the header of a session, creating the session if needed.
+
+        Args:
+            session_id (str): The session ID.
+            header (dict): The header, serializable to JSON.
+        """
+
+    def update_header(self, session_id: str, **fields):
+        """
+        Update fields of the header of an existing session.
+
+        Args:
+            session_id (str): The session ID.
+            **fields: The fields to set.
+        """
+        header = self.get_header(session_id)
+        if header is not None:
+            self.set_header(session_id, {**header, **fields})
+
+    @abstractmethod
+    def get_messages(self, session_id: str, last: Optional[int] = None) -> list:
+        """
+        Get the messages of a session, oldest first.
+
+        Args:
+            session_id (str): The session ID.
+            last (int, optional): Number of most recent messages to get. Defaults to
+                every message.
+
+        Returns:
+            list: The messages, as dictionaries.
+        """
+
+    @abstractmethod
+    def get_message_window(self, session_id: str, last: Optional[int] = None) -> tuple:
+        """
+        Get the messages of a session, oldest first, with the position of the first.
+
+        Positions count the messages from the start of the log, so that loaded
+        messages can be updated where they are, whatever was appended since.
+
+        Args:
+            session_id (str): The session ID.
+            last (int, optional): Number of most recent messages to get. Defaults to
+                every message.
+
+        Returns:
+            tuple: The position of the first message and the messages, as
+                dictionaries.
+        """
+
+    @abstractmethod
+    def append_messages(self, session_id: str, messages: list) -> int:
+        """
+        Append messages to the log of a session.
+
+        Args:
+            session_id (str): The session ID.
+            messages (list): The messages, as dictionaries.
+
+        Returns:
+            int: The position of the first appended message.
+        """
+
+    @abstractmethod
+    def update_messages(self, session_id: str, updates: dict) -> int:
+        """
+        Replace messages of a session at their positions, if they did not change.
+
+        Each message is only replaced if it is still the one it was read as, e.g.
+        not after the chat was cleaned. The other messages, including those
+        appended meanwhile, are left as they are.
+
+        Args:
+            session_id (str): The session ID.
+            updates (dict): The message as it was read and the new message, by
+                position, as dictionaries.
+
+        Returns:
+            int: The number of messages replaced.
+        """
+
+    @abstractmethod
+    def replace_messages(
+        self, session_id: str, messages: list, last: Optional[int] = None
+    ):
+        """
+        Replace the most recent messages of a session.
+
+        Args:
+            session_id (str): The session ID.
+            messages (list): The new messages, as dictionaries.
+            last (int, optional): Number of most recent messages replaced. Defaults
+                to every message.
+        """
+
+    @abstractmethod
+    def register_username(self, session_id: str, username: str) -> bool:
+        """
+        Register the username of a session, unless another session has it.
+
+        The check and the registration are atomic, so that two sessions cannot
+        take the same username concurrently. A previous username of the session
+        is released in the same step.
+
+        Args:
+            session_id (str): The session ID.
+            username (str): The username.
+
+        Returns:
+            bool: Whether the username belongs to the session.
+        """
+
+    @abstractmethod
+    def find_session(self, username: str) -> Optional[str]:
+        """
+        Get the session registered with a username.
+
+        Args:
+            username (str): The username.
+
+        Returns:
+            str: The session ID, or None if the username is free.
+        """
+
+    @abstractmethod
+    def list_sessions(self, offset: int = 0, limit: int = 100) -> list:
+        """
+        Get a page of the registered sessions, in order of registration.
+
+        Args:
+            offset (int): Number of sessions skipped.
+            limit (int): Maximum number of sessions returned.
+
+        Returns:
+            list: The session ID and username of each session.
+        """
+
+    def ranked_sessions(self, offset: int = 0, limit: int = 100) -> list:
+        """
+        Get a page of the registered sessions, by decreasing level then best score.
+
+        This default reads the header of every session: stores keep an index.
+
+        Args:
+            offset (int): Number of sessions skipped.
+            limit (int): Maximum number of sessions returned.
+
+        Returns:
+            list: The session IDs.
+        """
+        session_ids = []
+        while True:
+            page = self.list_sessions(len(session_ids), 500)
+            session_ids.extend(session_id for session_id, _ in page)
+            if len(page) < 500:
+                break
+        headers = [header or {} for header in self.get_headers(session_ids)]
+        ranked = sorted(
+            zip(session_ids, headers),
+            key=lambda item: (item[1].get("level", 1), item[1].get("best_score", 0)),
+            reverse=True,
+        )
+        return [session_id for session_id, _ in ranked[offset : offset + limit]]
+
+    @abstractmethod
+    def usage(self) -> dict:
+        """
+        Get the size of the store.
+
+        Returns:
+            dict: The number of sessions under ``"sessions"`` and their size in
+                bytes under ``"bytes"``.
+        """
+
+    @abstractmethod
+    def delete(self, session_id: str):
+        """Delete a session."""
+
+    @abstractmethod
+    def clear(self):
+        """Delete every session."""
+
+
+_store = None
+
+
+def get_session_store() -> SessionStore:
+    """
+    Get the session store of the process.
+
+    ``SESSION_STORE`` selects it: ``redis`` (default when ``REDIS_URL`` is set),
+    ``sqlite`` (default otherwise, in ``SESSION_DB``, default:
+    ``.cache/sessions.db``) or ``file`` (under ``SESSION_DIR``, default:
+    ``.cache/sessions``).
+
+    Returns:
+        SessionStore: The store instance.
+    """
+    global _store
+    if _store is None:
+        backend = os.getenv(
+            "SESSION_STORE", "redis" if "REDIS_URL" in os.environ else "sqlite"
+        )
+        if backend == "redis":
+            from src.sessions.RedisSessionStore import RedisSessionStore
+
+            _store = RedisSessionStore(os.environ["REDIS_URL"])
+        elif backend == "sqlite":
+            from src.sessions.SQLiteSessionStore import SQLiteSessionStore
+
+            _store = SQLiteSessionStore(os.getenv("SESSION_DB", ".cache/sessions.db"))
+        elif backend == "file":
+            from src.sessions.FileSessionStore import FileSessionStore
+
+            _store = FileSessionStore(os.getenv("SESSION_DIR", ".cache/sessions"))
+        else:
+            raise ValueError(f"Unknown session store {backend!r}")
+    return _store
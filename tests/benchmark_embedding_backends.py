@@ -0,0 +1,114 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import multiprocessing
+import time
+from datetime import datetime
+from statistics import mean, median, quantiles
+
+import psutil
+
+from src.embeddings.Models import BACKENDS, load_model
+
+SENTENCES = [
+    "Can you write a haiku about the art of programming?",
+    "What is the 20th number of the Fibonacci sequence?",
+    "Answer only with yes or no: is the sky blue?",
+    "Format the list of planets as a markdown table with their diameter.",
+    "This is my answer",
+]
+
+
+def benchmark_backend(backend, num_requests, batch_size):
+    """
+    Mesure les performances d'un backend dans un processus dédié.
+
+    Args:
+        backend (str): Backend du modèle d'embeddings.
+        num_requests (int): Nombre d'encodages d'une seule phrase.
+        batch_size (int): Taille du lot pour mesurer le débit.
+
+    Returns:
+        dict: Statistiques du backend.
+    """
+    process = psutil.Process()
+    rss_before = process.memory_info().rss
+
+    start_time = time.perf_counter()
+    model = load_model(backend)
+    load_time = time.perf_counter() - start_time
+    model.encode(SENTENCES)  # Warm-up
+
+    latencies = []
+    for i in range(num_requests):
+        start_time = time.perf_counter()
+        model.encode([SENTENCES[i % len(SENTENCES)]])
+        latencies.append((time.perf_counter() - start_time) * 1000)
+
+    batch = [SENTENCES[i % len(SENTENCES)] for i in range(batch_size)]
+    start_time = time.perf_counter()
+    model.encode(batch, batch_size=batch_size)
+    throughput = batch_size / (time.perf_counter() - start_time)
+
+    return {
+        "backend": backend,
+        "load_time": load_time,
+        "latency": {
+            "mean": mean(latencies),
+            "median": median(latencies),
+            "p95": quantiles(latencies, n=20)[-1],
+        },
+        "throughput": throughput,
+        "rss": (process.memory_info().rss - rss_before) / 2**20,
+    }
+
+
+def generate_markdown_report(results):
+    """
+    Génère un rapport Markdown à partir des résultats des backends.
+
+    Args:
+        results (list): Liste des statistiques de chaque backend.
+
+    Returns:
+        str: Rapport au format Markdown.
+    """
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    markdown = f"# Embedding Backends Benchmark\n\nDate: {now}\n\n"
+    markdown += (
+        "| Backend | Load (s) | Mean (ms) | Median (ms) | P95 (ms) "
+        "| Batch (texts/s) | RSS (MiB) |\n"
+        "|---------|----------|-----------|-------------|----------"
+        "|-----------------|-----------|\n"
+    )
+    for stats in results:
+        latency = stats["latency"]
+        markdown += (
+            f"| {stats['backend']} | {stats['load_time']:.2f} "
+            f"| {latency['mean']:.2f} | {latency['median']:.2f} "
+            f"| {latency['p95']:.2f} | {stats['throughput']:.0f} "
+            f"| {stats['rss']:.0f} |\n"
+        )
+    return markdown
+
+
+if __name__ == "__main__":
+    results = []
+    # Un processus neuf par backend, pour ne mesurer que sa propre mémoire
+    context = multiprocessing.get_context("spawn")
+    for backend in BACKENDS:
+        print(f"Benchmarking the {backend} backend")
+        with context.Pool(processes=1) as pool:
+            try:
+                results.append(pool.apply(benchmark_backend, (backend, 200, 64)))
+            except ImportError as e:
+                print(f"Skipping the {backend} backend: {str(e)}")
+
+    markdown_report = generate_markdown_report(results)
+
+    with open("tests/embedding_results.md", "w") as f:
+        f.write(markdown_report)
+
+    print("Benchmark results have been saved to tests/embedding_results.md")
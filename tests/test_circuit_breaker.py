@@ -0,0 +1,142 @@
+import os
+import sys
+import time
+import uuid
+from multiprocessing import resource_tracker
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from src.providers.CircuitBreaker import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreakers,
+    RedisStore,
+    SharedMemoryStore,
+)
+
+OPEN_TIMEOUT = 0.2
+
+
+def _redis_store(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    import redis
+
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(
+        redis.Redis,
+        "from_url",
+        lambda url, **kwargs: fakeredis.FakeRedis(server=server, **kwargs),
+    )
+    return RedisStore("redis://localhost")
+
+
+@pytest.fixture(params=["shared_memory", "redis"])
+def store(request, tmp_path, monkeypatch):
+    if request.param == "redis":
+        yield _redis_store(monkeypatch)
+        return
+    # Un segment propre à chaque test, supprimé à la fin
+    store = SharedMemoryStore(
+        name=f"test_{uuid.uuid4().hex[:12]}",
+        lock_path=str(tmp_path / "breakers.lock"),
+    )
+    yield store
+    if store._shm is not None:
+        resource_tracker.register(store._shm._name, "shared_memory")
+        store._shm.close()
+        store._shm.unlink()
+
+
+@pytest.fixture
+def breakers(store):
+    return CircuitBreakers(
+        store, failure_rate=0.5, min_calls=4, open_timeout=OPEN_TIMEOUT
+    )
+
+
+def _open(breakers, provider="openai"):
+    for ok in [True, False, False, False]:
+        breakers.record(provider, ok)
+
+
+def test_circuit_stays_closed_below_the_failure_rate(breakers):
+    for ok in [True, False, True, True, False, True]:
+        assert breakers.allow("openai")
+        breakers.record("openai", ok)
+
+    assert breakers.state("openai") == CLOSED
+
+
+def test_circuit_needs_enough_calls_to_open(breakers):
+    for _ in range(3):
+        breakers.record("openai", False)
+
+    assert breakers.state("openai") == CLOSED
+
+
+def test_open_circuit_refuses_calls(breakers):
+    _open(breakers)
+
+    assert breakers.state("openai") == OPEN
+    assert not breakers.allow("openai")
+    assert breakers.available(["openai", "replicate"]) == ["replicate"]
+
+
+def test_successful_probe_closes_the_circuit(breakers):
+    _open(breakers)
+    time.sleep(OPEN_TIMEOUT)
+
+    assert breakers.available(["openai"]) == ["openai"]
+    assert breakers.allow("openai")
+    assert breakers.state("openai") == HALF_OPEN
+    # Un seul appel de test à la fois
+    assert not breakers.allow("openai")
+
+    breakers.record("openai", True)
+
+    assert breakers.state("openai") == CLOSED
+    # Les échecs d'avant l'ouverture sont oubliés
+    breakers.record("openai", False)
+    assert breakers.state("openai") == CLOSED
+
+
+def test_failed_probe_opens_the_circuit_again(breakers):
+    _open(breakers)
+    time.sleep(OPEN_TIMEOUT)
+    assert breakers.allow("openai")
+
+    breakers.record("openai", False)
+
+    assert breakers.state("openai") == OPEN
+    assert not breakers.allow("openai")
+
+
+def test_lost_probe_is_replaced(breakers):
+    _open(breakers)
+    time.sleep(OPEN_TIMEOUT)
+    assert breakers.allow("openai")
+
+    # L'appel de test n'a jamais rendu compte de son résultat
+    time.sleep(OPEN_TIMEOUT)
+
+    assert breakers.allow("openai")
+
+
+def test_circuits_are_independent(breakers):
+    _open(breakers, "openai")
+
+    assert breakers.state("replicate") == CLOSED
+    assert breakers.allow("replicate")
+
+
+def test_reset_closes_every_circuit(breakers):
+    _open(breakers, "openai")
+    _open(breakers, "ollama")
+
+    breakers.reset()
+
+    assert breakers.available(["openai", "ollama"]) == ["openai", "ollama"]
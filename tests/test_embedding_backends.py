@@ -0,0 +1,50 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pytest
+
+pytest.importorskip("sentence_transformers")
+pytest.importorskip("optimum.onnxruntime")
+
+from src.embeddings.Models import load_model
+
+# Références des niveaux et prompts typiques des étudiants
+SENTENCES = [
+    "Can you write a haiku about the art of programming?",
+    "Fingers on keyboard\nLogic flows through lines of code\nBugs emerge, then flee",
+    "What is the 20th number of the Fibonacci sequence?",
+    "Answer only with yes or no: is the sky blue?",
+    "Format the list of planets as a markdown table with their diameter.",
+    "<answer><name>Arthur</name><age>42</age></answer>",
+    "This is my answer",
+    "Réponds en une phrase : qui est le père d'Arthur ?",
+]
+
+# Écart maximal de similarité cosinus avec le modèle PyTorch
+MAX_DRIFT = {"onnx": 1e-3, "onnx-int8": 3e-2}
+
+
+def _normalize(embeddings):
+    embeddings = np.asarray(embeddings, dtype=np.float64)
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+@pytest.fixture(scope="module")
+def torch_embeddings():
+    return _normalize(load_model("torch").encode(SENTENCES))
+
+
+@pytest.mark.parametrize("backend", sorted(MAX_DRIFT))
+def test_embeddings_match_torch(backend, torch_embeddings):
+    embeddings = _normalize(load_model(backend).encode(SENTENCES))
+
+    # Each embedding points in the same direction as the PyTorch one
+    cosines = np.sum(embeddings * torch_embeddings, axis=1)
+    assert np.all(1 - cosines <= MAX_DRIFT[backend])
+
+    # The similarities used to score the levels barely change
+    drift = np.abs(embeddings @ embeddings.T - torch_embeddings @ torch_embeddings.T)
+    assert drift.max() <= MAX_DRIFT[backend]
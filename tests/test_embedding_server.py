@@ -0,0 +1,172 @@
+import os
+import sys
+import threading
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pytest
+
+from src.embeddings.EmbeddingClient import EmbeddingClient
+from src.embeddings.EmbeddingServer import (
+    EmbeddingServer,
+    server_answers,
+    start_embedding_server,
+)
+
+
+class FakeModel:
+    """Encode chaque texte par sa longueur, en notant la taille des lots."""
+
+    def __init__(self):
+        self.batches = []
+        self.failing = False
+
+    def encode(self, texts):
+        self.batches.append(len(texts))
+        if self.failing:
+            raise RuntimeError("encode failed")
+        return np.array([[len(text)] for text in texts], dtype=float)
+
+
+def _start_server(socket_path, model, **kwargs):
+    server = EmbeddingServer(socket_path, model.encode, **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    for _ in range(100):
+        if server_answers(socket_path):
+            return server
+        threading.Event().wait(0.05)
+    raise RuntimeError("Embedding server not ready")
+
+
+@pytest.fixture
+def socket_path(tmp_path_factory):
+    # Les chemins des sockets unix sont limités à ~100 caractères
+    return str(tmp_path_factory.mktemp("emb") / "embeddings.sock")
+
+
+@pytest.fixture
+def model():
+    return FakeModel()
+
+
+@pytest.fixture
+def server(socket_path, model):
+    return _start_server(socket_path, model, batch_window=0.2)
+
+
+def test_client_gets_the_embeddings_of_its_texts(server, socket_path):
+    embeddings = EmbeddingClient(socket_path).encode(["a", "bbb", "cc"])
+
+    assert embeddings.tolist() == [[1.0], [3.0], [2.0]]
+
+
+def test_concurrent_requests_are_encoded_together(server, socket_path, model):
+    client = EmbeddingClient(socket_path)
+    # Chaque thread a sa connexion : on l'ouvre avant de lancer les requêtes
+    texts = [["x" * (i + 1)] * 2 for i in range(4)]
+    results = [None] * len(texts)
+    barrier = threading.Barrier(len(texts))
+
+    def request(i):
+        client._connection()
+        barrier.wait()
+        results[i] = client.encode(texts[i])
+
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sum(model.batches) == 8
+    assert len(model.batches) < len(texts)
+    for i, embeddings in enumerate(results):
+        assert embeddings.tolist() == [[i + 1.0]] * 2
+
+
+def test_batches_are_capped(socket_path, model):
+    _start_server(socket_path, model, max_batch=3, batch_window=0.2)
+    client = EmbeddingClient(socket_path)
+    barrier = threading.Barrier(4)
+
+    def request():
+        client._connection()
+        barrier.wait()
+        client.encode(["a", "b"])
+
+    threads = [threading.Thread(target=request) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Une requête n'est jamais coupée : un lot dépasse d'au plus une requête
+    assert sum(model.batches) == 8
+    assert all(size <= 3 + 1 for size in model.batches)
+
+
+def test_status_does_not_encode(server, socket_path, model):
+    client = EmbeddingClient(socket_path)
+    client.encode(["a"])
+
+    status = client.status()
+
+    assert status["queue_depth"] == 0
+    assert status["latency"] is not None
+    assert model.batches == [1]
+
+
+def test_client_without_server_falls_back(socket_path):
+    client = EmbeddingClient(socket_path, retry_interval=60)
+
+    assert client.encode(["a"]) is None
+    assert client.status() is None
+
+
+def test_client_does_not_retry_a_failing_server_at_once(server, socket_path, model):
+    client = EmbeddingClient(socket_path, retry_interval=60)
+    model.failing = True
+
+    assert client.encode(["a"]) is None
+    model.failing = False
+    # Le serveur n'est pas réessayé avant retry_interval
+    assert client.encode(["a"]) is None
+    assert model.batches == [1]
+
+
+def test_level_encodes_locally_without_server(socket_path, monkeypatch):
+    pytest.importorskip("torch")
+    pytest.importorskip("sentence_transformers")
+    import src.Level as level_module
+
+    local = FakeModel()
+    monkeypatch.setattr(
+        level_module, "get_embedding_client", lambda: EmbeddingClient(socket_path)
+    )
+    monkeypatch.setattr(level_module.Level, "_model", local)
+
+    embeddings = level_module.Level._encode_now(["ab"])
+
+    assert embeddings.tolist() == [[2.0]]
+    assert local.batches == [1]
+
+
+def test_workers_reuse_the_running_server(server, socket_path, monkeypatch):
+    # Aucun processus ne doit être lancé : le serveur répond déjà
+    monkeypatch.setattr(
+        "subprocess.Popen", lambda *args, **kwargs: pytest.fail("server started")
+    )
+
+    assert start_embedding_server(socket_path) is None
+    assert EmbeddingClient(socket_path).encode(["a"]).tolist() == [[1.0]]
+
+
+def test_client_reconnects_after_a_failed_request(server, socket_path, model):
+    client = EmbeddingClient(socket_path, retry_interval=0)
+    model.failing = True
+    assert client.encode(["a"]) is None
+
+    model.failing = False
+    # La connexion est rouverte après l'échec
+    assert client.encode(["ab"]).tolist() == [[2.0]]
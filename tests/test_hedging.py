@@ -0,0 +1,114 @@
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from src.providers.Hedging import HedgingPolicy, hedge
+
+
+class Call:
+    """Appel simulé à un provider, qui note s'il a été annulé."""
+
+    def __init__(self, answer, delay, chunks=1, error=None):
+        self.answer = answer
+        self.delay = delay
+        self.chunks = chunks
+        self.error = error
+        self.started = False
+        self.cancelled = False
+
+    async def __call__(self, emit):
+        self.started = True
+        try:
+            await asyncio.sleep(self.delay)
+            if self.error is not None:
+                raise self.error
+            for i in range(self.chunks):
+                if emit is not None:
+                    emit(f"{self.answer}{i}")
+                await asyncio.sleep(0.01)
+            return self.answer
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+
+def _backup(call):
+    async def make_backup():
+        return call
+
+    return make_backup
+
+
+def test_delay_waits_for_enough_samples():
+    policy = HedgingPolicy(percentile=95, min_delay=1.0, max_delay=15.0, min_samples=3)
+
+    assert policy.delay([2.0, 3.0]) == 15.0
+    assert policy.delay([2.0, 3.0, 4.0]) == 4.0
+    assert policy.delay([0.1, 0.2, 0.3]) == 1.0
+    assert policy.delay([20.0, 30.0, 40.0]) == 15.0
+
+
+def test_fast_primary_is_not_hedged():
+    primary = Call("primary", 0.01)
+    backup = Call("backup", 0.01)
+
+    assert asyncio.run(hedge(primary, _backup(backup), 0.2)) == "primary"
+    assert not backup.started
+
+
+def test_late_primary_is_hedged_and_cancelled():
+    primary = Call("primary", 1.0)
+    backup = Call("backup", 0.01)
+
+    assert asyncio.run(hedge(primary, _backup(backup), 0.05)) == "backup"
+    assert primary.cancelled
+
+
+def test_primary_is_awaited_without_backup():
+    primary = Call("primary", 0.1)
+
+    async def no_backup():
+        return None
+
+    assert asyncio.run(hedge(primary, no_backup, 0.02)) == "primary"
+
+
+def test_failed_call_leaves_the_other_one_answer():
+    primary = Call("primary", 0.1, error=RuntimeError("provider down"))
+    backup = Call("backup", 0.2)
+
+    assert asyncio.run(hedge(primary, _backup(backup), 0.02)) == "backup"
+
+
+def test_error_is_raised_when_every_call_failed():
+    primary = Call("primary", 0.1, error=RuntimeError("primary down"))
+    backup = Call("backup", 0.05, error=RuntimeError("backup down"))
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(hedge(primary, _backup(backup), 0.02))
+
+
+def test_error_of_an_unhedged_call_is_raised():
+    primary = Call("primary", 0.01, error=RuntimeError("provider down"))
+    backup = Call("backup", 0.01)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(hedge(primary, _backup(backup), 0.2))
+    assert not backup.started
+
+
+def test_first_stream_to_start_wins():
+    # Le backup donne son premier token avant le primaire, mais finit après
+    primary = Call("primary", 0.15, chunks=1)
+    backup = Call("backup", 0.01, chunks=20)
+    chunks = []
+
+    answer = asyncio.run(hedge(primary, _backup(backup), 0.05, chunks.append))
+
+    assert answer == "backup"
+    assert chunks == [f"backup{i}" for i in range(20)]
+    assert primary.cancelled
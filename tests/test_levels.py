@@ -0,0 +1,128 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("sentence_transformers")
+
+from src.Level import GenerationProfile, Level
+from src.levels.LevelList import levels
+
+
+@pytest.fixture
+def perfect_similarity(monkeypatch):
+    # Les similarités sont au maximum : seul le contrôle du prompt fait échouer
+    monkeypatch.setattr(Level, "embeddings_overloaded", classmethod(lambda cls: False))
+    monkeypatch.setattr(
+        Level, "check_prompt_similarity", lambda self, prompt, lexical=False: 1.0
+    )
+    monkeypatch.setattr(
+        Level, "check_answer_similarity", lambda self, answer, lexical=False: 1.0
+    )
+
+
+@pytest.mark.parametrize(
+    "number, prompt",
+    [(4, "Write a short story."), (7, "Is Arthur John's great uncle?")],
+)
+def test_gated_prompt_cannot_pass(number, prompt, perfect_similarity):
+    level = levels[number]
+
+    result = level.gate_prompt(prompt)
+
+    assert result is not None
+    assert result.individual_scores["answer_check"] == 10
+    # Even a perfect answer would stay under the pass mark
+    best = (result.individual_scores["prompt_check"] + 300) / 4
+    assert best < level.min_score_to_pass
+
+
+def test_fibonacci_prompt_with_answer_still_calls_the_model(perfect_similarity):
+    level = levels[5]
+    prompt = "Compute the 21st term of the Fibonacci sequence starting with 0, 3: 20295"
+
+    assert level.gate_prompt(prompt) is None
+    # The prompt check floored at 10 still lets a perfect answer pass
+    result = level(prompt, "The 21st term is 20295.")
+    assert result.individual_scores["prompt_check"] == 10
+    assert result.total_score >= level.min_score_to_pass
+
+
+def test_cheat_code_passes_every_level():
+    for level in levels.values():
+        assert level.gate_prompt(" CheatCode42 ").total_score == 100
+
+
+def test_levels_gate_only_when_a_failed_prompt_fails_the_level():
+    for level in levels.values():
+        assert level.failed_prompt_fails_level == (77.5 < level.min_score_to_pass)
+
+
+@pytest.mark.parametrize(
+    "number, partial_answer, decided",
+    [
+        (1, " ".join(["word"] * 29), False),
+        (1, " ".join(["word"] * 30), True),
+        (2, "This is my", False),
+        (2, "This is my answer", False),
+        (2, "This is your", True),
+        (2, "Sure! This", True),
+        (6, "Nothing to say", False),
+        (6, "no", False),
+        (6, "No, I", True),
+        (6, "I'd say yes.", True),
+    ],
+)
+def test_partial_answer_verdict(number, partial_answer, decided):
+    level = levels[number]
+
+    verdict = level.check_partial_answer(partial_answer)
+
+    assert (verdict is not None) == decided
+    if decided:
+        # Le verdict est celui de la réponse complète, quelle que soit la suite
+        for continuation in ["", " and more words.", "\nThis is my answer"]:
+            assert (
+                verdict.score == level.check_answer(partial_answer + continuation).score
+            )
+
+
+@pytest.mark.parametrize("number", [3, 4, 5, 7])
+def test_levels_scored_on_whole_answers_never_stop_early(number):
+    answer = "Yes, no. " + " ".join(["word"] * 100)
+
+    assert levels[number].check_partial_answer(answer) is None
+
+
+def test_sampling_params_are_clamped_to_the_profile():
+    # Le niveau 5 limite la température à 1.5
+    params = levels[5].sampling_params(2.0, 0.5, 400, 1.5)
+
+    assert params == {"temperature": 1.5, "repeat_penalty": 1, "top_k": 100, "top_p": 1}
+    assert levels[5].sampling_params(0.7, 1.1, 40, 0.95) == {
+        "temperature": 0.7,
+        "repeat_penalty": 1.1,
+        "top_k": 40,
+        "top_p": 0.95,
+    }
+
+
+def test_generation_profiles_are_consistent():
+    defaults = GenerationProfile()
+    for level in levels.values():
+        profile = level.generation_profile
+        assert profile.max_tokens > 0
+        assert isinstance(profile.stop, tuple)
+        for name in ["temperature", "repeat_penalty", "top_k", "top_p"]:
+            low, high = getattr(profile, name)
+            default_low, default_high = getattr(defaults, name)
+            assert default_low <= low <= high <= default_high
+
+
+def test_short_answers_get_few_tokens():
+    # 30 mots au niveau 1, une phrase de 4 mots au niveau 2
+    assert levels[1].generation_profile.max_tokens <= 100
+    assert levels[2].generation_profile.max_tokens <= 16
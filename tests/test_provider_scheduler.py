@@ -0,0 +1,250 @@
+import multiprocessing
+import os
+import sys
+import uuid
+from multiprocessing import resource_tracker
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from src.providers.ProviderScheduler import (
+    ProviderScheduler,
+    RedisBackend,
+    SharedMemoryBackend,
+)
+from src.providers.RoutingPolicy import (
+    AdaptivePolicy,
+    PriorityPolicy,
+    ProviderStats,
+    load_policy,
+)
+
+
+def _shared_memory_backend(tmp_path, **kwargs):
+    # Un segment propre à chaque test, supprimé à la fin
+    return SharedMemoryBackend(
+        name=f"test_{uuid.uuid4().hex[:12]}",
+        lock_path=str(tmp_path / "scheduler.lock"),
+        **kwargs,
+    )
+
+
+def _unlink(backend):
+    if backend._shm is not None:
+        # Le segment a été retiré du resource tracker à sa création
+        resource_tracker.register(backend._shm._name, "shared_memory")
+        backend._shm.close()
+        backend._shm.unlink()
+
+
+def _redis_backend(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    import redis
+
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(
+        redis.Redis,
+        "from_url",
+        lambda url, **kwargs: fakeredis.FakeRedis(server=server, **kwargs),
+    )
+    return RedisBackend("redis://localhost")
+
+
+@pytest.fixture(params=["shared_memory", "redis"])
+def backend(request, tmp_path, monkeypatch):
+    if request.param == "redis":
+        yield _redis_backend(monkeypatch)
+        return
+    backend = _shared_memory_backend(tmp_path)
+    yield backend
+    _unlink(backend)
+
+
+@pytest.fixture
+def scheduler(backend):
+    return ProviderScheduler(backend, capacity=2)
+
+
+def test_leases_are_counted_until_released(scheduler):
+    first = scheduler.acquire("openai")
+    second = scheduler.acquire("openai")
+    scheduler.acquire("ollama")
+
+    assert scheduler.counts() == {"openai": 2, "replicate": 0, "ollama": 1}
+    assert len(scheduler.leases()["openai"]) == 2
+
+    scheduler.release(first)
+    scheduler.release(second)
+
+    assert scheduler.counts() == {"openai": 0, "replicate": 0, "ollama": 1}
+
+
+def test_lease_context_releases_on_error(scheduler):
+    with pytest.raises(RuntimeError):
+        with scheduler.lease("replicate"):
+            assert scheduler.counts()["replicate"] == 1
+            raise RuntimeError("call failed")
+
+    assert scheduler.counts()["replicate"] == 0
+
+
+def test_reap_reclaims_expired_leases_only(scheduler, backend):
+    live = scheduler.acquire("openai")
+    # Un appel dont le heartbeat s'est arrêté
+    backend.open_lease("openai", -1.0)
+
+    assert scheduler.reap() == 1
+    assert scheduler.counts()["openai"] == 1
+    assert [lease.lease_id for lease in scheduler.leases()["openai"]] == [live.lease_id]
+
+
+def test_release_after_reap_does_not_count_twice(scheduler, backend):
+    lease = backend.open_lease("openai", -1.0)
+    scheduler.reap()
+
+    scheduler.release(lease)
+
+    assert scheduler.counts()["openai"] == 0
+
+
+def test_heartbeat_renews_held_leases(scheduler, backend):
+    lease = scheduler.acquire("openai")
+    scheduler.lease_ttl = 60.0
+
+    scheduler.heartbeat()
+
+    (renewed,) = scheduler.leases()["openai"]
+    assert renewed.expires_at > lease.expires_at
+
+
+def test_reap_reclaims_leases_of_dead_processes(tmp_path):
+    backend = _shared_memory_backend(tmp_path)
+    try:
+        scheduler = ProviderScheduler(backend)
+        backend.counts()
+        # Le processus meurt au milieu de l'appel, sans libérer son lease
+        context = multiprocessing.get_context("fork")
+        process = context.Process(target=backend.open_lease, args=("openai", 60.0))
+        process.start()
+        process.join()
+
+        assert scheduler.counts()["openai"] == 1
+        assert scheduler.reap() == 1
+        assert scheduler.counts()["openai"] == 0
+    finally:
+        _unlink(backend)
+
+
+def test_full_lease_table_does_not_block_calls(tmp_path):
+    backend = _shared_memory_backend(tmp_path, max_leases=1)
+    try:
+        scheduler = ProviderScheduler(backend)
+        held = scheduler.acquire("openai")
+
+        assert scheduler.acquire("openai") is None
+        scheduler.release(None)
+        scheduler.release(held)
+        assert scheduler.acquire("openai") is not None
+    finally:
+        _unlink(backend)
+
+
+def test_select_fills_providers_in_order(scheduler):
+    scheduler.policy = PriorityPolicy(capacity=2)
+    providers = ["openai", "replicate"]
+
+    assert scheduler.select(providers) == "openai"
+    scheduler.acquire("openai")
+    scheduler.acquire("openai")
+    assert scheduler.select(providers) == "replicate"
+
+
+def test_records_feed_the_statistics(scheduler):
+    scheduler.record("openai", 2.0, True)
+    scheduler.record("openai", 4.0, True, first_token=0.5)
+    scheduler.record("openai", 9.0, False)
+
+    stats = scheduler.stats()["openai"]
+    assert stats.samples == 2
+    assert stats.p95_latency == 4.0
+    assert 0 < stats.error_rate < 1
+    assert sorted(scheduler.latencies("openai")) == [2.0, 4.0]
+    assert scheduler.latencies("openai", first_token=True) == [0.5]
+
+
+def _stats(ewma, error_rate=0.0, samples=10):
+    return ProviderStats(ewma, ewma, error_rate, samples)
+
+
+def test_priority_policy_uses_the_least_loaded_when_all_are_full():
+    policy = PriorityPolicy(capacity=1)
+    providers = ["openai", "replicate", "ollama"]
+
+    assert policy.choose(providers, {"openai": 0, "replicate": 0, "ollama": 0}, {}) == (
+        "openai"
+    )
+    assert policy.choose(providers, {"openai": 1, "replicate": 0, "ollama": 0}, {}) == (
+        "replicate"
+    )
+    assert policy.choose(providers, {"openai": 3, "replicate": 2, "ollama": 4}, {}) == (
+        "replicate"
+    )
+
+
+def test_adaptive_policy_uses_the_priors_without_samples():
+    policy = AdaptivePolicy(capacity=2)
+    counts = {"openai": 0, "replicate": 0, "ollama": 0}
+
+    assert policy.choose(["replicate", "ollama", "openai"], counts, {}) == "openai"
+    assert policy.service_time("openai", _stats(0.0, samples=0)) == 3.0
+
+
+def test_adaptive_policy_prefers_the_fastest_provider():
+    policy = AdaptivePolicy(capacity=2)
+    counts = {"openai": 0, "replicate": 0}
+    stats = {"openai": _stats(6.0), "replicate": _stats(2.0)}
+
+    assert policy.choose(["openai", "replicate"], counts, stats) == "replicate"
+
+
+def test_adaptive_policy_accounts_for_queuing_and_errors():
+    policy = AdaptivePolicy(capacity=2)
+    stats = {"openai": _stats(2.0), "replicate": _stats(3.0)}
+
+    # 4 appels en cours sur openai : le suivant y attendrait
+    assert (
+        policy.choose(["openai", "replicate"], {"openai": 4, "replicate": 0}, stats)
+        == "replicate"
+    )
+    stats["openai"] = _stats(2.0, error_rate=0.6)
+    assert (
+        policy.choose(["openai", "replicate"], {"openai": 0, "replicate": 0}, stats)
+        == "replicate"
+    )
+
+
+def test_adaptive_policy_keeps_the_order_of_preference_on_ties():
+    policy = AdaptivePolicy(capacity=2, priors={"a": 1.0, "b": 1.0})
+
+    assert policy.choose(["b", "a"], {"a": 0, "b": 0}, {}) == "b"
+
+
+def test_load_policy_from_the_environment(monkeypatch):
+    monkeypatch.setenv("ROUTING_POLICY", "priority")
+    monkeypatch.setenv("ROUTING_POLICY_OPTIONS", '{"capacity": 5}')
+    policy = load_policy(capacity=2)
+    assert isinstance(policy, PriorityPolicy)
+    assert policy.capacity == 5
+
+    monkeypatch.setenv("ROUTING_POLICY", "src.providers.RoutingPolicy:AdaptivePolicy")
+    monkeypatch.setenv("ROUTING_POLICY_OPTIONS", '{"tail_weight": 0.5}')
+    policy = load_policy(capacity=2)
+    assert isinstance(policy, AdaptivePolicy)
+    assert (policy.capacity, policy.tail_weight) == (2, 0.5)
+
+    monkeypatch.setenv("ROUTING_POLICY", "src.providers.RoutingPolicy:ProviderStats")
+    monkeypatch.setenv("ROUTING_POLICY_OPTIONS", "{}")
+    with pytest.raises(ValueError):
+        load_policy()
@@ -0,0 +1,131 @@
+import asyncio
+import os
+import sys
+import time
+from collections import namedtuple
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from src.providers.ResponseCache import MemoryTier, RedisTier, ResponseCache
+
+# Seuls la température et _asdict des paramètres sont utilisés par le cache
+Params = namedtuple("Params", ["temperature", "top_p"], defaults=[0.95])
+
+
+class BrokenTier:
+    """Tier persistant injoignable."""
+
+    def get(self, key):
+        raise ConnectionError("unreachable")
+
+    def set(self, key, value):
+        raise ConnectionError("unreachable")
+
+    def incr(self, counter, amount=1):
+        raise ConnectionError("unreachable")
+
+
+@pytest.fixture
+def redis_tier(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    import redis
+
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(
+        redis.Redis,
+        "from_url",
+        lambda url, **kwargs: fakeredis.FakeRedis(server=server, **kwargs),
+    )
+    return RedisTier("redis://localhost")
+
+
+def test_memory_tier_evicts_the_least_recently_used():
+    tier = MemoryTier(max_entries=2)
+    tier.set("a", "1")
+    tier.set("b", "2")
+    tier.get("a")
+
+    tier.set("c", "3")
+
+    assert (tier.get("a"), tier.get("b"), tier.get("c")) == ("1", None, "3")
+
+
+def test_memory_tier_is_bounded_in_bytes():
+    tier = MemoryTier(max_bytes=2 * sys.getsizeof("x" * 100))
+    for key in "abc":
+        tier.set(key, key * 100)
+
+    assert len(tier) == 2
+    assert tier.get("a") is None
+    assert tier.usage()["bytes"] <= tier.max_bytes
+
+
+def test_memory_tier_entries_expire():
+    tier = MemoryTier(ttl=0.05)
+    tier.set("a", "1")
+    time.sleep(0.06)
+
+    assert tier.get("a") is None
+    assert len(tier) == 0
+
+
+def test_hot_temperatures_bypass_the_cache():
+    cache = ResponseCache(MemoryTier(), max_temperature=0.2)
+
+    asyncio.run(cache.set("k", Params(0.7), "answer"))
+
+    assert asyncio.run(cache.get("k", Params(0.7))) is None
+    assert asyncio.run(cache.get("k", Params(0.0))) is None
+    assert cache.stats()["process"]["bypasses"] == 1
+    assert cache.stats()["process"]["misses"] == 1
+
+
+def test_answers_are_served_from_memory():
+    cache = ResponseCache(MemoryTier())
+
+    asyncio.run(cache.set("k", Params(0.0), "answer"))
+
+    assert asyncio.run(cache.get("k", Params(0.0))) == "answer"
+    assert cache.stats()["process"]["memory_hits"] == 1
+
+
+def test_persistent_hits_are_kept_in_memory(redis_tier):
+    writer = ResponseCache(MemoryTier(), redis_tier)
+    reader = ResponseCache(MemoryTier(), redis_tier)
+    asyncio.run(writer.set("k", Params(0.0), "answer"))
+
+    # Un autre processus : seul le tier persistant a la réponse
+    assert asyncio.run(reader.get("k", Params(0.0))) == "answer"
+    assert asyncio.run(reader.get("k", Params(0.0))) == "answer"
+
+    stats = reader.stats()
+    assert stats["process"]["persistent_hits"] == 1
+    assert stats["process"]["memory_hits"] == 1
+    assert stats["shared"]["persistent_hits"] == 1
+
+
+def test_unreachable_persistent_tier_is_a_miss():
+    cache = ResponseCache(MemoryTier(), BrokenTier())
+
+    asyncio.run(cache.set("k", Params(0.0), "answer"))
+    cache.memory.clear()
+
+    assert asyncio.run(cache.get("k", Params(0.0))) is None
+    assert cache.counters.local["misses"] == 1
+
+
+def test_keys_depend_on_every_input():
+    key = ResponseCache.make_key("openai", "gpt", "system", "prompt", Params(0.0))
+
+    assert key == ResponseCache.make_key(
+        "openai", "gpt", "system", "prompt", Params(0.0)
+    )
+    assert key != ResponseCache.make_key(
+        "ollama", "gpt", "system", "prompt", Params(0.0)
+    )
+    assert key != ResponseCache.make_key("openai", "gpt", None, "prompt", Params(0.0))
+    assert key != ResponseCache.make_key(
+        "openai", "gpt", "system", "prompt", Params(0.0, top_p=0.5)
+    )
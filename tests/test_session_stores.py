@@ -0,0 +1,169 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from src.sessions.FileSessionStore import FileSessionStore
+from src.sessions.SQLiteSessionStore import SQLiteSessionStore
+
+
+def _redis_store(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    # Les scripts Lua du store demandent lupa
+    pytest.importorskip("lupa")
+    import redis
+
+    from src.sessions.RedisSessionStore import RedisSessionStore
+
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(
+        redis.Redis,
+        "from_url",
+        lambda url, **kwargs: fakeredis.FakeRedis(server=server, **kwargs),
+    )
+    return RedisSessionStore("redis://localhost")
+
+
+@pytest.fixture(params=["file", "sqlite", "redis"])
+def store(request, tmp_path, monkeypatch):
+    if request.param == "file":
+        return FileSessionStore(str(tmp_path / "sessions"))
+    if request.param == "sqlite":
+        return SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    return _redis_store(monkeypatch)
+
+
+def _messages(*contents):
+    return [{"role": "user", "content": content, "score": None} for content in contents]
+
+
+def test_window_gives_the_position_of_its_first_message(store):
+    store.append_messages("s", _messages("a", "b", "c"))
+
+    assert store.get_message_window("s", 2) == (1, _messages("b", "c"))
+    assert store.get_message_window("s") == (0, _messages("a", "b", "c"))
+    assert store.get_message_window("s", 10) == (0, _messages("a", "b", "c"))
+    assert store.get_message_window("other", 2) == (0, [])
+
+
+def test_append_returns_the_position_of_the_first_message(store):
+    assert store.append_messages("s", _messages("a", "b")) == 0
+    assert store.append_messages("s", _messages("c")) == 2
+    assert store.append_messages("s", []) == 3
+
+
+def test_update_keeps_messages_appended_meanwhile(store):
+    store.append_messages("s", _messages("a", "b"))
+    start, loaded = store.get_message_window("s", 1)
+    # Another process appends after the window was read
+    store.append_messages("s", _messages("c"))
+
+    scored = {**loaded[0], "score": 80}
+    assert store.update_messages("s", {start: (loaded[0], scored)}) == 1
+
+    assert store.get_messages("s") == [*_messages("a"), scored, *_messages("c")]
+
+
+def test_update_leaves_messages_changed_meanwhile(store):
+    store.append_messages("s", _messages("a", "b"))
+    start, loaded = store.get_message_window("s")
+    # The chat is cleaned, then starts again
+    store.replace_messages("s", _messages("x", "y"))
+
+    updates = {start + i: (old, {**old, "score": 80}) for i, old in enumerate(loaded)}
+    assert store.update_messages("s", updates) == 0
+
+    assert store.get_messages("s") == _messages("x", "y")
+
+
+def test_update_header_ignores_missing_sessions(store):
+    store.update_header("missing", game_completed=True)
+
+    assert store.get_header("missing") is None
+    assert store.ranked_sessions() == []
+
+
+def test_update_header_moves_the_session_in_the_ranking(store):
+    for session_id, level in [("a", 2), ("b", 3)]:
+        store.register_username(session_id, session_id)
+        store.set_header(session_id, {"username": session_id, "level": level})
+
+    store.update_header("a", level=3, best_score=77.5)
+
+    assert store.get_header("a") == {"username": "a", "level": 3, "best_score": 77.5}
+    assert store.ranked_sessions() == ["a", "b"]
+
+
+def test_usernames_belong_to_a_single_session(store):
+    assert store.register_username("a", "alice")
+    assert store.register_username("a", "alice")
+    assert not store.register_username("b", "alice")
+
+    assert store.find_session("alice") == "a"
+    assert store.find_session("bob") is None
+
+
+def test_renaming_releases_the_previous_username(store):
+    store.register_username("a", "alice")
+
+    assert store.register_username("a", "alicia")
+
+    assert store.find_session("alice") is None
+    assert store.register_username("b", "alice")
+    assert store.list_sessions() == [("a", "alicia"), ("b", "alice")]
+
+
+def test_sessions_are_listed_by_pages_in_order_of_registration(store):
+    for i in range(5):
+        store.register_username(f"s{i}", f"user{i}")
+
+    assert store.list_sessions(0, 2) == [("s0", "user0"), ("s1", "user1")]
+    assert store.list_sessions(4, 2) == [("s4", "user4")]
+    assert store.list_sessions(5, 2) == []
+
+
+def test_sessions_are_ranked_by_level_then_best_score(store):
+    for session_id, level, best_score in [("a", 2, 90), ("b", 3, 10), ("c", 2, 95)]:
+        store.register_username(session_id, session_id)
+        store.set_header(session_id, {"level": level, "best_score": best_score})
+
+    assert store.ranked_sessions() == ["b", "c", "a"]
+    assert store.ranked_sessions(1, 1) == ["c"]
+
+
+def test_headers_are_read_together(store):
+    store.set_header("a", {"username": "alice", "level": 2})
+
+    assert store.get_headers(["a", "missing"]) == [
+        {"username": "alice", "level": 2},
+        None,
+    ]
+
+
+def test_delete_frees_the_session_and_its_username(store):
+    store.register_username("a", "alice")
+    store.set_header("a", {"username": "alice", "level": 2})
+    store.append_messages("a", _messages("hello"))
+
+    store.delete("a")
+
+    assert store.get_header("a") is None
+    assert store.get_messages("a") == []
+    assert store.find_session("alice") is None
+    assert store.list_sessions() == []
+    assert store.ranked_sessions() == []
+
+
+def test_clear_deletes_every_session(store):
+    for session_id in ["a", "b"]:
+        store.register_username(session_id, session_id)
+        store.set_header(session_id, {"level": 1})
+        store.append_messages(session_id, _messages("hello"))
+
+    store.clear()
+
+    assert store.list_sessions() == []
+    assert store.get_headers(["a", "b"]) == [None, None]
+    assert store.get_messages("a") == []
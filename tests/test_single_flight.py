@@ -0,0 +1,136 @@
+import asyncio
+import os
+import sys
+from collections import namedtuple
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from src.providers.SingleFlight import SingleFlight
+
+Params = namedtuple("Params", ["temperature"])
+
+
+class Upstream:
+    """Appel au provider, lent, qui compte ses exécutions."""
+
+    def __init__(self, answer="answer", delay=0.05, error=None):
+        self.answer = answer
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return self.answer
+
+
+@pytest.fixture
+def redis_url(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    import redis
+
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(
+        redis.Redis,
+        "from_url",
+        lambda url, **kwargs: fakeredis.FakeRedis(server=server, **kwargs),
+    )
+    return "redis://localhost"
+
+
+def test_identical_calls_are_coalesced():
+    flight = SingleFlight()
+    upstream = Upstream()
+
+    async def main():
+        return await asyncio.gather(*(flight.do("k", upstream) for _ in range(5)))
+
+    assert asyncio.run(main()) == ["answer"] * 5
+    assert upstream.calls == 1
+
+
+def test_different_calls_are_not_coalesced():
+    flight = SingleFlight()
+    upstream = Upstream()
+
+    async def main():
+        return await asyncio.gather(flight.do("a", upstream), flight.do("b", upstream))
+
+    asyncio.run(main())
+
+    assert upstream.calls == 2
+
+
+def test_finished_calls_are_run_again():
+    flight = SingleFlight()
+    upstream = Upstream()
+
+    asyncio.run(flight.do("k", upstream))
+    asyncio.run(flight.do("k", upstream))
+
+    assert upstream.calls == 2
+
+
+def test_errors_reach_every_waiter():
+    flight = SingleFlight()
+    upstream = Upstream(error=RuntimeError("provider down"))
+
+    async def main():
+        return await asyncio.gather(
+            *(flight.do("k", upstream) for _ in range(3)), return_exceptions=True
+        )
+
+    results = asyncio.run(main())
+
+    assert upstream.calls == 1
+    assert all(isinstance(result, RuntimeError) for result in results)
+    # La clé est libérée : l'appel suivant est tenté à nouveau
+    upstream.error = None
+    assert asyncio.run(flight.do("k", upstream)) == "answer"
+
+
+def test_calls_are_coalesced_across_processes(redis_url):
+    # Deux instances, comme dans deux processus, sur le même Redis
+    leader = SingleFlight(redis_url=redis_url, poll_interval=0.01)
+    waiter = SingleFlight(redis_url=redis_url, poll_interval=0.01)
+    upstream = Upstream(delay=0.2)
+
+    async def main():
+        first = asyncio.create_task(leader.do("k", upstream))
+        await asyncio.sleep(0.05)
+        return await asyncio.gather(first, waiter.do("k", upstream))
+
+    assert asyncio.run(main()) == ["answer", "answer"]
+    assert upstream.calls == 1
+
+
+def test_waiters_compete_again_when_the_leader_fails(redis_url):
+    leader = SingleFlight(redis_url=redis_url, poll_interval=0.01)
+    waiter = SingleFlight(redis_url=redis_url, poll_interval=0.01)
+    failing = Upstream(delay=0.1, error=RuntimeError("provider down"))
+    upstream = Upstream()
+
+    async def main():
+        first = asyncio.create_task(leader.do("k", failing))
+        await asyncio.sleep(0.03)
+        second = await waiter.do("k", upstream)
+        with pytest.raises(RuntimeError):
+            await first
+        return second
+
+    assert asyncio.run(main()) == "answer"
+    assert (failing.calls, upstream.calls) == (1, 1)
+
+
+def test_keys_depend_on_the_variant():
+    key = SingleFlight.make_key("system", "prompt", Params(0.0))
+
+    assert key == SingleFlight.make_key("system", "prompt", Params(0.0))
+    assert key != SingleFlight.make_key("system", "prompt", Params(0.5))
+    assert key != SingleFlight.make_key("system", "prompt", Params(0.0), "stop")